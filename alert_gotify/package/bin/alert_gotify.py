@@ -1,12 +1,9 @@
 # encoding = utf-8
-import os
 import import_declare_test
 import sys
 
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
-
 from splunktaucclib.alert_actions_base import ModularAlertBase
-from alert_gotify import modalert_alert_gotify_helper
+from alert_gotify import settings
 
 class AlertActionWorkeralert_gotify(ModularAlertBase):
 
@@ -26,16 +23,15 @@ class AlertActionWorkeralert_gotify(ModularAlertBase):
         
         # URL and token can come from either alert config file or global settings
         # Note: url, token, and ssl_verify are not in the UI but can be set in savedsearches.conf
+        # Global settings are only looked up when not overridden, and are cached for process_event
         url = self.get_param("url")
         token = self.get_param("token")
-        global_url = self.get_global_setting("gotify_url")
-        global_token = self.get_global_setting("gotify_token")
         
-        if not url and not global_url:
+        if not url and not settings.get_global_setting(self, "gotify_url"):
             self.log_error("Gotify server URL must be specified either in the alert configuration file or in global settings.")
             return False
         
-        if not token and not global_token:
+        if not token and not settings.get_global_setting(self, "gotify_token"):
             self.log_error("Gotify app token must be specified either in the alert configuration file or in global settings.")
             return False
         
@@ -46,6 +42,8 @@ class AlertActionWorkeralert_gotify(ModularAlertBase):
         try:
             if not self.validate_params():
                 return 3
+            # Imported after validation so that invalid alerts exit before loading the delivery code
+            from alert_gotify import modalert_alert_gotify_helper
             status = modalert_alert_gotify_helper.process_event(self, *args, **kwargs)
         except (AttributeError, TypeError) as ae:
             self.log_error("Error: {}. Please double check spelling and also verify that a compatible version of Splunk_SA_CIM is installed.".format(str(ae)))
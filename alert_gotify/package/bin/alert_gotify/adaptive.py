@@ -0,0 +1,91 @@
+# encoding = utf-8
+"""
+Adaptive concurrency for requests to one Gotify server.
+
+The number of requests in flight follows an AIMD (additive increase,
+multiplicative decrease) rule: it grows by one per round of fast successful
+responses and is halved when Gotify answers 429 or 5xx, a request fails to
+connect or times out, or latency climbs well above the lowest latency seen.
+A Retry-After header also pauses new requests for the given time.
+
+The learned limit is kept in the local store per server, so the next alert
+process starts at the level the previous one arrived at instead of at the
+configured worker count.
+"""
+import threading
+import time
+
+NAMESPACE = "concurrency"
+
+# Learned limits are forgotten after a week without alerts to the server
+STATE_TTL = 7 * 24 * 3600
+
+# A response slower than LATENCY_TOLERANCE times the lowest latency seen,
+# plus LATENCY_SLACK seconds of jitter, counts as a sign of congestion
+LATENCY_TOLERANCE = 2.0
+LATENCY_SLACK = 0.01
+
+DECREASE_FACTOR = 0.5
+
+# Longest pause honored from a Retry-After header
+MAX_PAUSE = 60.0
+
+
+class ConcurrencyLimit(object):
+    """Thread-safe AIMD limit on the number of requests in flight."""
+
+    def __init__(self, maximum, initial=None, minimum=1, clock=time.monotonic, sleep=time.sleep):
+        self.maximum = max(minimum, maximum)
+        self.minimum = minimum
+        self.limit = float(min(self.maximum, max(minimum, initial or self.maximum)))
+        self.initial = self.limit
+        self.min_latency = None
+        self.paused_until = 0.0
+        # Results seen since the last decrease; one decrease per round of requests in flight
+        self.since_decrease = self.maximum
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+
+    @property
+    def current(self):
+        return int(self.limit)
+
+    def record(self, latency, status=None, retry_after=None):
+        """
+        Record the outcome of one request.
+
+        latency is in seconds; status is None for connection errors and timeouts.
+        """
+        with self.lock:
+            self.since_decrease += 1
+            if retry_after:
+                self.paused_until = max(self.paused_until, self.clock() + min(MAX_PAUSE, retry_after))
+            if status is not None and status != 429 and status < 500:
+                if self.min_latency is None or latency < self.min_latency:
+                    self.min_latency = latency
+                if latency <= self.min_latency * LATENCY_TOLERANCE + LATENCY_SLACK:
+                    self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+                    return
+            if self.since_decrease >= self.limit:
+                self.limit = max(float(self.minimum), self.limit * DECREASE_FACTOR)
+                self.since_decrease = 0
+
+    def wait_ready(self):
+        """Sleep while a Retry-After pause is in effect."""
+        delay = self.paused_until - self.clock()
+        if delay > 0:
+            self.sleep(delay)
+
+
+def load_limit(store, key, maximum, now=None):
+    """Return a ConcurrencyLimit starting from the limit learned for key, if any."""
+    now = time.time() if now is None else now
+    state = store.kv_get(NAMESPACE, key, now)
+    return ConcurrencyLimit(maximum, initial=state["limit"] if state else None)
+
+
+def save_limit(store, key, limiter, now=None):
+    """Store the limit learned in this run for the next alert process."""
+    now = time.time() if now is None else now
+    store.kv_update(NAMESPACE, key, lambda old: {"limit": round(limiter.limit, 2)}, now, ttl=STATE_TTL)
@@ -0,0 +1,153 @@
+# encoding = utf-8
+"""
+State-change tracking of alert results.
+
+A scheduled search that keeps returning the same failing hosts would page
+on every run. With state tracking, each result row is identified by a
+fingerprint of its key fields, and the fingerprints of the last run are
+kept per saved search in the local store as a sorted array of 8-byte
+hashes. Only rows whose fingerprint is new are rendered and sent; rows of
+the last run that are no longer returned are reported as cleared.
+
+New rows are attached to the message that carries them. A new row is only
+kept for the next run once every copy of its message was delivered, queued
+or spooled, so rows whose message failed are new again in the next run
+while delivered rows are not sent twice.
+
+Splunk only runs the alert action when the search triggers, so the state
+expires after a period without runs; rows returned after that count as new
+again.
+"""
+import base64
+import hashlib
+import time
+
+NAMESPACE = "state"
+
+DEFAULT_STATE_TTL = 3600.0
+
+FINGERPRINT_SIZE = 8
+
+
+def parse_keys(value):
+    """Parse the comma separated state_keys parameter into a tuple of field names."""
+    keys = tuple(dict.fromkeys(name.strip() for name in (value or "").split(",") if name.strip()))
+    if not keys:
+        raise ValueError("state_keys names no fields")
+    return keys
+
+
+def state_key(search_name, url, token):
+    """Return the state key of a saved search alerting one app token, without storing the token itself."""
+    hasher = hashlib.sha256()
+    for part in (search_name, url, token):
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def fingerprint(row, keys):
+    """Return the fingerprint of a result row's key fields."""
+    hasher = hashlib.blake2b(digest_size=FINGERPRINT_SIZE)
+    for name in keys:
+        value = row.get(name)
+        hasher.update(("" if value is None else str(value)).encode("utf-8"))
+        hasher.update(b"\0")
+    return hasher.digest()
+
+
+def pack(fingerprints):
+    return base64.b64encode(b"".join(sorted(fingerprints))).decode("ascii")
+
+
+def unpack(value):
+    data = base64.b64decode(value)
+    return set(data[i:i + FINGERPRINT_SIZE] for i in range(0, len(data), FINGERPRINT_SIZE))
+
+
+class ChangeTracker(object):
+    """Pass through the result rows that were not returned by the last run."""
+
+    def __init__(self, keys, previous=None):
+        self.keys = keys
+        self.previous = previous or set()
+        self.seen = set()
+        # Fingerprints of the new rows, and of those whose message was delivered or spooled
+        self.fresh = set()
+        self.done = set()
+        # New rows not yet attached to a message
+        self.unclaimed = []
+        # id(message) -> [message, row fingerprints, outcomes outstanding, all delivered]
+        self.messages = {}
+        # Set once every result has been read; an incomplete run says nothing about cleared rows
+        self.complete = False
+
+    def new_rows(self, results):
+        for row in results:
+            key = fingerprint(row, self.keys)
+            if key in self.seen:
+                continue
+            self.seen.add(key)
+            if key not in self.previous:
+                self.fresh.add(key)
+                self.unclaimed.append(key)
+                yield row
+        self.complete = True
+
+    @property
+    def new(self):
+        return len(self.fresh)
+
+    @property
+    def cleared(self):
+        return len(self.previous - self.seen)
+
+    def take(self, row=None):
+        """Return the fingerprint of the new row just read, to be claimed with other rows later."""
+        return self.unclaimed.pop()
+
+    def claim(self, message, keys=None):
+        """Attach keys, by default the new rows read since the last claim, to message and return it."""
+        if keys is None:
+            keys, self.unclaimed = self.unclaimed, []
+        self.messages[id(message)] = [message, keys, 1, True]
+        return message
+
+    def expect(self, message, copies):
+        """Wait for the outcome of copies of message, one per target it is sent to."""
+        entry = self.messages.get(id(message))
+        if entry is not None and entry[0] is message:
+            entry[2] = copies
+
+    def settle(self, message, delivered):
+        """Record the outcome of one copy of message; messages that were never claimed are ignored."""
+        entry = self.messages.get(id(message))
+        if entry is None or entry[0] is not message:
+            return
+        entry[3] = entry[3] and delivered
+        entry[2] -= 1
+        if entry[2] <= 0:
+            del self.messages[id(message)]
+            if entry[3]:
+                self.done.update(entry[1])
+
+    def kept(self):
+        """Return the fingerprints for the next run: new rows count once their message was delivered."""
+        return self.seen - (self.fresh - self.done)
+
+
+def load_tracker(store, key, keys, now=None):
+    """Return a ChangeTracker holding the fingerprints of the last run for key."""
+    now = time.time() if now is None else now
+    state = store.kv_get(NAMESPACE, key, now)
+    if not state or state.get("keys") != list(keys):
+        # Fingerprints of other key fields cannot be compared
+        return ChangeTracker(keys)
+    return ChangeTracker(keys, unpack(state["fingerprints"]))
+
+
+def save_tracker(store, key, tracker, ttl=DEFAULT_STATE_TTL, now=None):
+    """Keep the fingerprints of this run for the next one."""
+    now = time.time() if now is None else now
+    state = {"keys": list(tracker.keys), "fingerprints": pack(tracker.kept())}
+    store.kv_update(NAMESPACE, key, lambda old: state, now, ttl=ttl)
@@ -0,0 +1,92 @@
+# encoding = utf-8
+"""
+Cross-alert coalescing of messages for one Gotify app token.
+
+During an incident several saved searches sending to the same app token
+tend to fire within seconds of each other. With a coalescing window, the
+first alert process to fire opens a window in the local store and waits
+for it to close; alerts firing in the meantime add their messages to the
+window and exit. The first process then sends all of them as one combined
+notification.
+
+If the process holding a window dies, the next alert to fire after the
+window is well overdue takes the window over, messages included.
+"""
+import time
+
+from .sender import build_payload
+
+NAMESPACE = "coalesce"
+
+# A window this long past its close without being collected is taken over
+STALE_AFTER = 60.0
+
+# Uncollected messages are kept this long for a later alert to take over
+STATE_TTL = 24 * 3600
+
+MAX_TITLE_LENGTH = 250
+
+SEPARATOR = "\n\n"
+
+
+def join(store, key, payload, window, member, now=None):
+    """
+    Add payload to the open window for key, or open one.
+
+    Returns the time the window closes if member now holds the window and
+    must send its messages, or None if another process will.
+    """
+    now = time.time() if now is None else now
+    leader = [None]
+
+    def update(state):
+        if state is not None and now <= state["closes"] + STALE_AFTER:
+            state["messages"].append(payload)
+            return state
+        messages = state["messages"] if state is not None else []
+        messages.append(payload)
+        leader[0] = now + window
+        return {"member": member, "closes": leader[0], "messages": messages}
+
+    store.kv_update(NAMESPACE, key, update, now, ttl=STATE_TTL)
+    return leader[0]
+
+
+def collect(store, key, member, now=None):
+    """Close the window held by member and return its messages; empty if it was taken over."""
+    now = time.time() if now is None else now
+    messages = []
+
+    def update(state):
+        if state is None or state["member"] != member:
+            return state
+        messages.extend(state["messages"])
+        return None
+
+    store.kv_update(NAMESPACE, key, update, now, keep_expiry=True)
+    return messages
+
+
+def wait(closes):
+    """Sleep until the window closing at closes has closed."""
+    time.sleep(max(0.0, closes - time.time()))
+
+
+def combine(payloads, max_bytes=None, markdown=False):
+    """Return one payload with the messages of payloads, at the highest of their priorities."""
+    if len(payloads) == 1:
+        payload = payloads[0]
+        return build_payload(payload.get("message"), payload.get("title"), payload.get("priority", 0),
+                             max_bytes, markdown)
+    titles = list(dict.fromkeys(payload.get("title") for payload in payloads if payload.get("title")))
+    title = "{} alerts: {}".format(len(payloads), ", ".join(titles)) if titles else "{} alerts".format(len(payloads))
+    if len(title) > MAX_TITLE_LENGTH:
+        title = title[:MAX_TITLE_LENGTH - 3] + "..."
+    sections = []
+    for payload in payloads:
+        heading = payload.get("title")
+        if heading and markdown:
+            heading = "**{}**".format(heading)
+        sections.append("{}\n{}".format(heading, payload.get("message")) if heading else payload.get("message"))
+    priority = max(int(payload.get("priority", 0)) for payload in payloads)
+    return build_payload(SEPARATOR.join(sections), title, priority, max_bytes, markdown)
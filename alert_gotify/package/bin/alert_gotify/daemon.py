@@ -0,0 +1,271 @@
+# encoding = utf-8
+"""
+Long-running delivery daemon and the client used by the alert action.
+
+The daemon is started by the alert_gotify_daemon.py scripted input. It listens
+on a Unix domain socket in the state directory and delivers messages from a
+queue over warm keep-alive connections, one pooled sender per Gotify server
+and token. The queue has priority lanes (see lanes.py), so pages are sent
+ahead of informational messages when Gotify is slow. Messages it cannot
+deliver, messages shed from a full queue and messages still queued when it
+stops go to the delivery spool, which the daemon also drains periodically.
+
+Protocol: the client writes one JSON message per line, closes its write side,
+and reads back a single {"accepted": n} line once the daemon has queued them.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+
+from . import spool
+from .lanes import DEFAULT_WEIGHTS, LaneScheduler
+from .resilience import breaker_allow, breaker_record
+from .sender import GotifySender
+from .store import LocalStore, default_state_dir
+
+SOCKET_NAME = "alert_gotify.sock"
+
+# Seconds the alert action waits for the daemon before sending directly
+CLIENT_TIMEOUT = 2.0
+
+# Seconds the daemon waits for the next message of a client, which renders
+# them one result at a time; alert actions run for at most 5 minutes by default
+CLIENT_IDLE_TIMEOUT = 300.0
+
+DEFAULT_WORKERS = 8
+MAX_QUEUE = 10000
+DRAIN_INTERVAL = 60
+
+logger = logging.getLogger("alert_gotify.daemon")
+
+
+def default_socket_path():
+    return os.path.join(default_state_dir(), SOCKET_NAME)
+
+
+def is_supported():
+    """Unix domain sockets are not available on every platform Splunk runs on."""
+    return hasattr(socket, "AF_UNIX")
+
+
+def encode_message(url, token, ssl_verify, payload):
+    return (json.dumps({
+        "url": url, "token": token, "ssl_verify": ssl_verify, "payload": payload
+    }) + "\n").encode("utf-8")
+
+
+class DaemonClient(object):
+    """Hand messages to a running daemon over its Unix domain socket."""
+
+    def __init__(self, socket_path=None, timeout=CLIENT_TIMEOUT):
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+        self.sock = None
+        self.sent = 0
+
+    def connect(self):
+        """Return True if the daemon is reachable."""
+        if not is_supported() or not os.path.exists(self.socket_path):
+            return False
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            return False
+        self.sock = sock
+        return True
+
+    def send(self, url, token, ssl_verify, payload):
+        self.sock.sendall(encode_message(url, token, ssl_verify, payload))
+        self.sent += 1
+
+    def finish(self):
+        """Close the write side and return how many messages the daemon accepted."""
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+            reply = self.sock.makefile("rb").readline()
+            return json.loads(reply.decode("utf-8"))["accepted"]
+        finally:
+            self.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class DeliveryDaemon(object):
+    """Deliver queued messages over warm connections until stopped."""
+
+    def __init__(self, socket_path=None, workers=DEFAULT_WORKERS, drain_interval=DRAIN_INTERVAL,
+                 lane_weights=DEFAULT_WEIGHTS):
+        self.socket_path = socket_path or default_socket_path()
+        self.workers = workers
+        self.drain_interval = drain_interval
+        self.queue = LaneScheduler(capacity=MAX_QUEUE, weights=lane_weights)
+        self.senders = {}
+        self.senders_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.server = None
+        self.ready = threading.Event()
+        self.local = threading.local()
+
+    def already_running(self):
+        """True if another daemon answers on the socket."""
+        if not os.path.exists(self.socket_path):
+            return False
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+            return True
+        except OSError:
+            # Stale socket left behind by a daemon that did not shut down cleanly
+            os.unlink(self.socket_path)
+            return False
+        finally:
+            probe.close()
+
+    def serve_forever(self):
+        """Accept and deliver messages until stop() is called."""
+        state_dir = os.path.dirname(self.socket_path)
+        if not os.path.isdir(state_dir):
+            os.makedirs(state_dir, mode=0o700, exist_ok=True)
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Messages carry app tokens, so only the Splunk user may connect
+        umask = os.umask(0o177)
+        try:
+            self.server.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        self.server.listen(128)
+        self.server.settimeout(0.5)
+
+        threads = [threading.Thread(target=self._deliver_loop, name="gotify-delivery-{}".format(i))
+                   for i in range(self.workers)]
+        threads.append(threading.Thread(target=self._drain_loop, name="gotify-spool-drain"))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        logger.info("Delivery daemon listening on %s with %d workers", self.socket_path, self.workers)
+        self.ready.set()
+
+        try:
+            while not self.stopping.is_set():
+                try:
+                    conn, _ = self.server.accept()
+                except socket.timeout:
+                    continue
+                threading.Thread(target=self._handle_client, args=(conn,), daemon=True).start()
+        finally:
+            self.server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self._spool_queued()
+            self._close_senders()
+
+    def stop(self):
+        self.stopping.set()
+
+    def _handle_client(self, conn):
+        accepted = 0
+        shed = []
+        try:
+            conn.settimeout(CLIENT_IDLE_TIMEOUT)
+            for line in conn.makefile("rb"):
+                shed.extend(self.queue.put(json.loads(line.decode("utf-8"))))
+                accepted += 1
+            if shed:
+                self._spool(shed, "Delivery daemon queue full")
+            conn.sendall((json.dumps({"accepted": accepted}) + "\n").encode("utf-8"))
+        except (OSError, ValueError) as e:
+            logger.error("Dropped client connection after %d messages: %s", accepted, e)
+        finally:
+            conn.close()
+
+    def _sender(self, url, token, ssl_verify):
+        key = (url, token, ssl_verify)
+        with self.senders_lock:
+            sender = self.senders.get(key)
+            if sender is None:
+                sender = self.senders[key] = GotifySender(url, token, ssl_verify=ssl_verify, workers=self.workers)
+            return sender
+
+    def _deliver_loop(self):
+        while not self.stopping.is_set():
+            message = self.queue.get(timeout=0.5)
+            if message is None:
+                continue
+            try:
+                self._deliver(message)
+            except Exception:
+                logger.exception("Unexpected error delivering a Gotify message")
+                self._spool([message], "Unexpected delivery error")
+
+    def _store(self):
+        """Return this thread's connection to the local store."""
+        store = getattr(self.local, "store", None)
+        if store is None:
+            store = self.local.store = LocalStore()
+        return store
+
+    def _deliver(self, message):
+        url = message["url"]
+        store = self._store()
+        if not breaker_allow(store, url):
+            self._spool([message], "Circuit breaker open")
+            return
+        error = self._sender(url, message["token"], message["ssl_verify"]).deliver(message["payload"])
+        if error is None:
+            breaker_record(store, url, True)
+        elif error.retryable:
+            breaker_record(store, url, False)
+            self._spool([message], str(error))
+        else:
+            logger.error("Failed to send Gotify message to %s. %s", url, error)
+
+    def _drain_loop(self):
+        while not self.stopping.wait(self.drain_interval):
+            try:
+                result = spool.drain(self._store())
+                if result.sent or result.failed or result.dropped:
+                    logger.info("Spool drain finished: %d sent, %d deferred, %d dropped",
+                                result.sent, result.failed, result.dropped)
+            except Exception:
+                logger.exception("Could not drain the Gotify delivery spool")
+
+    def _spool(self, messages, error):
+        store = self._store()
+        for message in messages:
+            spool.defer(store, message["url"], message["token"], message["ssl_verify"],
+                        [(message["payload"], error)])
+
+    def _spool_queued(self):
+        """Keep messages that were accepted but not delivered before shutdown."""
+        queued = self.queue.drain()
+        if queued:
+            self._spool(queued, "Delivery daemon stopped")
+            logger.info("Spooled %d queued message(s) at shutdown", len(queued))
+
+    def _close_senders(self):
+        with self.senders_lock:
+            for sender in self.senders.values():
+                sender.close()
+            self.senders = {}
+
+
+def run(socket_path=None, workers=DEFAULT_WORKERS, lane_weights=DEFAULT_WEIGHTS):
+    """Run a daemon unless one is already serving the socket."""
+    daemon = DeliveryDaemon(socket_path, workers=workers, lane_weights=lane_weights)
+    if daemon.already_running():
+        logger.info("Delivery daemon already running on %s", daemon.socket_path)
+        return 0
+    # splunkd stops scripted inputs with SIGTERM; queued messages are spooled on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    daemon.serve_forever()
+    return 0
@@ -0,0 +1,102 @@
+# encoding = utf-8
+"""
+Digest aggregation of search results.
+
+Results are grouped by an optional field and rendered one line per result.
+A group is emitted as a Gotify message as soon as it reaches the row cap or
+the byte budget, so memory is bounded by the number of open groups rather
+than the size of the result set.
+"""
+
+DEFAULT_MAX_ROWS = 50
+DEFAULT_MAX_BYTES = 32 * 1024
+
+LINE_SEPARATOR = "\n"
+
+
+def _truncate_utf8(text, max_bytes):
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text, len(encoded)
+    text = encoded[:max_bytes].decode("utf-8", "ignore")
+    return text, len(text.encode("utf-8"))
+
+
+class _Group(object):
+
+    __slots__ = ("title", "lines", "size", "part", "tags")
+
+    def __init__(self, title):
+        self.title = title
+        self.lines = []
+        self.size = 0
+        self.part = 1
+        self.tags = []
+
+
+class DigestBuilder(object):
+    """Collapse rendered results into a small number of digest messages."""
+
+    def __init__(self, line_template, title_template, group_by=None,
+                 max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES):
+        self.line_template = line_template
+        self.title_template = title_template
+        self.group_by = group_by
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.groups = {}
+
+    def add(self, result, tag=None):
+        """Add a result and return the digests (title, message, tags) it completed."""
+        key = result.get(self.group_by) if self.group_by else None
+        group = self.groups.get(key)
+        if group is None:
+            title = self.title_template.render(result)
+            if self.group_by:
+                label = "{}={}".format(self.group_by, key or "")
+                title = "{} [{}]".format(title, label) if title else label
+            group = self.groups[key] = _Group(title)
+
+        line, size = _truncate_utf8(self.line_template.render(result), self.max_bytes)
+        completed = []
+        if group.lines and group.size + len(LINE_SEPARATOR) + size > self.max_bytes:
+            completed.append(self._emit(group))
+        group.size += size + (len(LINE_SEPARATOR) if group.lines else 0)
+        group.lines.append(line)
+        if tag is not None:
+            group.tags.append(tag)
+        if len(group.lines) >= self.max_rows:
+            completed.append(self._emit(group))
+        return completed
+
+    def flush(self):
+        """Return the digests (title, message, tags) for every group that still holds lines."""
+        completed = [self._emit(group) for group in self.groups.values() if group.lines]
+        self.groups = {}
+        return completed
+
+    def _emit(self, group):
+        title = group.title
+        if group.part > 1:
+            title = "{} (part {})".format(title, group.part) if title else "Part {}".format(group.part)
+        message = LINE_SEPARATOR.join(group.lines)
+        tags = group.tags
+        group.lines = []
+        group.size = 0
+        group.part += 1
+        group.tags = []
+        return title, message, tags
+
+
+def build_digests(results, builder, tag=None):
+    """
+    Stream (title, message) digests from an iterable of results.
+
+    With tag, a function of a result, digests are (title, message, tags)
+    with the tags of the results they hold.
+    """
+    for result in results:
+        for digest in builder.add(result, None if tag is None else tag(result)):
+            yield digest if tag else digest[:2]
+    for digest in builder.flush():
+        yield digest if tag else digest[:2]
@@ -0,0 +1,175 @@
+# encoding = utf-8
+"""
+Asyncio delivery engine for sending messages to several Gotify servers.
+
+requests is synchronous, so each request runs on a thread pool driven by an
+event loop. Every target keeps its own keep-alive session, requests to one
+host are capped by a per-host semaphore and the whole fan-out is bounded by
+an overall deadline, so sending to ten servers costs about one round-trip
+instead of ten sequential ones.
+
+A request that is already running when the deadline passes cannot be
+interrupted. It is given up to the read timeout to finish, and if it still
+has not, its message is reported as failed but not retryable: it may yet be
+delivered, so spooling it could send it twice.
+"""
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from .resilience import DEFAULT_READ_TIMEOUT
+from .sender import DeliveryError, GotifySender, SendResult
+
+DEFAULT_HOST_CONNECTIONS = 4
+
+# Seconds the whole fan-out may take before unsent messages are given up
+DEFAULT_DEADLINE = 30.0
+
+Target = collections.namedtuple("Target", ("url", "token"))
+
+
+def parse_targets(value, default_token):
+    """
+    Parse the targets parameter into a list of Target.
+
+    Entries are separated by commas or newlines and have the form url|token;
+    entries without a token use default_token. Duplicates are dropped.
+    """
+    targets = []
+    for entry in (value or "").replace("\n", ",").split(","):
+        url, _, token = entry.partition("|")
+        url = url.strip()
+        if not url:
+            continue
+        if not url.lower().startswith(("http://", "https://")):
+            raise ValueError("invalid target URL '{}'".format(url))
+        target = Target(url, token.strip() or default_token)
+        if target not in targets:
+            targets.append(target)
+    return targets
+
+
+def deadline_error():
+    return DeliveryError("Deadline exceeded before the message was sent", retryable=True)
+
+
+def unknown_error():
+    return DeliveryError("Deadline exceeded while the message was being sent, it may have been delivered",
+                         retryable=False)
+
+
+class FanOut(object):
+    """Send messages to several Gotify targets concurrently."""
+
+    def __init__(self, targets, ssl_verify=True, timeout=None, retry=None,
+                 host_connections=DEFAULT_HOST_CONNECTIONS, deadline=DEFAULT_DEADLINE, metrics=None, stream=None,
+                 compress=False):
+        self.targets = list(targets)
+        self.host_connections = host_connections
+        self.deadline = deadline
+        # Seconds requests still running at the deadline are given to finish
+        self.grace = timeout[1] if isinstance(timeout, tuple) else (timeout or DEFAULT_READ_TIMEOUT)
+        # Requests given up on while still running, which keep using their sender's session
+        self.abandoned = 0
+        # Only messages sent to the first target, the alert's own server, can appear on its stream
+        self.senders = dict(
+            (target, GotifySender(target.url, target.token, ssl_verify=ssl_verify,
+                                  workers=host_connections, timeout=timeout, retry=retry, metrics=metrics,
+                                  stream=stream if index == 0 else None, compress=compress))
+            for index, target in enumerate(self.targets)
+        )
+        self.hosts = set(urlsplit(target.url).netloc.lower() for target in self.targets)
+
+    def close(self):
+        if self.abandoned:
+            # Closing the sessions under running requests would fail them; they go with the process
+            return
+        for sender in self.senders.values():
+            sender.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, jobs, on_result=None):
+        """
+        Send every (target, payload) job and return {target: SendResult}.
+
+        Jobs are consumed lazily. If given, on_result(target, payload, error)
+        is called from the calling thread once per job, with error None on
+        success. Jobs still unsent when the deadline passes fail as retryable,
+        and jobs still being sent after a further read timeout as not retryable.
+        """
+        return asyncio.run(self._send(jobs, on_result))
+
+    async def _send(self, jobs, on_result):
+        loop = asyncio.get_running_loop()
+        results = dict((target, SendResult()) for target in self.targets)
+        limits = dict((host, asyncio.Semaphore(self.host_connections)) for host in self.hosts)
+        workers = self.host_connections * len(self.hosts)
+        max_pending = workers * 2
+        stop = loop.time() + self.deadline if self.deadline else None
+        pending = {}
+        # Tasks whose request has been handed to a worker thread
+        started = set()
+        expired = []
+
+        def record(target, payload, error):
+            if error is None:
+                results[target].sent += 1
+            else:
+                results[target].record_error(error)
+            if on_result is not None:
+                on_result(target, payload, error)
+
+        def collect(done):
+            for task in done:
+                target, payload = pending.pop(task)
+                try:
+                    error = task.result()
+                except Exception as e:
+                    error = DeliveryError("Unexpected error: {}".format(str(e)), retryable=True)
+                record(target, payload, error)
+
+        async def drain_to(limit):
+            while len(pending) > limit and not expired:
+                timeout = None if stop is None else max(0.0, stop - loop.time())
+                done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    expired.append(True)
+                collect(done)
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for target, payload in jobs:
+                if expired:
+                    record(target, payload, deadline_error())
+                    continue
+                limit = limits[urlsplit(target.url).netloc.lower()]
+                task = loop.create_task(self._deliver(loop, executor, limit, self.senders[target], payload, started))
+                pending[task] = (target, payload)
+                await drain_to(max_pending - 1)
+            await drain_to(0)
+        finally:
+            for task in [task for task in pending if task not in started]:
+                task.cancel()
+                target, payload = pending.pop(task)
+                record(target, payload, deadline_error())
+            if pending:
+                # Running requests cannot be interrupted, so wait for their outcome for a while
+                done, running = await asyncio.wait(list(pending), timeout=self.grace)
+                collect(done)
+                for task in running:
+                    target, payload = pending.pop(task)
+                    record(target, payload, unknown_error())
+                self.abandoned += len(running)
+            executor.shutdown(wait=False)
+        return results
+
+    async def _deliver(self, loop, executor, limit, sender, payload, started):
+        async with limit:
+            started.add(asyncio.current_task())
+            return await loop.run_in_executor(executor, sender.deliver, payload)
@@ -0,0 +1,223 @@
+# encoding = utf-8
+"""
+Delivery coordination shared by a search head cluster through the KV store.
+
+On a search head cluster any member may run an alert, so deduplication,
+rate limits and the circuit breaker kept in the local store only
+coordinate the alerts of one member. KVStoreState offers the
+local store's kv_get/kv_update interface on the app's alert_gotify_state
+collection instead.
+
+Each alert run reads the live documents of the collection in one request,
+works on them in memory and writes its changes back in one batch_save
+request when it finishes. A snapshot read by another alert on the same
+member within the last cache_ttl seconds is reused from the local store
+instead of querying splunkd again.
+
+The KV store has no transactions, so members updating the same document at
+the same moment overwrite each other: shared limits are approximate. When
+splunkd cannot be reached, the run falls back to the local store.
+"""
+import hashlib
+import json
+import random
+import time
+
+import requests
+
+APP = "alert_gotify"
+COLLECTION = "alert_gotify_state"
+
+DEFAULT_SERVER_URI = "https://127.0.0.1:8089"
+
+# Seconds a snapshot of the collection is reused by later alerts on this member
+DEFAULT_CACHE_TTL = 2.0
+
+CACHE_NAMESPACE = "kvstore"
+
+# batch_save accepts at most this many documents (limits.conf max_documents_per_batch_save)
+MAX_BATCH = 1000
+
+# Share of alert runs that also delete expired documents
+PURGE_PROBABILITY = 0.05
+
+TIMEOUT = 10
+
+
+class KVStoreError(Exception):
+    """splunkd rejected a KV store request."""
+
+
+class KVStoreClient(object):
+    """Minimal REST client for one KV store collection."""
+
+    def __init__(self, server_uri, session_key, app=APP, collection=COLLECTION):
+        self.url = "{}/servicesNS/nobody/{}/storage/collections/data/{}".format(
+            server_uri.rstrip("/"), app, collection
+        )
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": "Splunk {}".format(session_key)})
+        # splunkd's management port normally has a self-signed certificate. This is passed on
+        # every request, as REQUESTS_CA_BUNDLE overrides a session-level verify setting.
+        self.verify = False
+
+    def _check(self, response):
+        if response.status_code >= 300:
+            raise KVStoreError("KV store request failed with status {}: {}".format(
+                response.status_code, response.text[:200]
+            ))
+        return response
+
+    def query(self, query):
+        response = self.session.get(self.url, params={"query": json.dumps(query), "output_mode": "json"},
+                                    verify=self.verify, timeout=TIMEOUT)
+        return self._check(response).json()
+
+    def batch_save(self, documents):
+        for start in range(0, len(documents), MAX_BATCH):
+            batch = json.dumps(documents[start:start + MAX_BATCH])
+            self._check(self.session.post(self.url + "/batch_save", data=batch,
+                                          headers={"Content-Type": "application/json"}, verify=self.verify,
+                                          timeout=TIMEOUT))
+
+    def delete(self, query):
+        self._check(self.session.delete(self.url, params={"query": json.dumps(query)}, verify=self.verify,
+                                        timeout=TIMEOUT))
+
+    def close(self):
+        self.session.close()
+
+
+def document_key(namespace, key):
+    return hashlib.sha256("{}\0{}".format(namespace, key).encode("utf-8")).hexdigest()
+
+
+class KVStoreState(object):
+    """
+    kv_get/kv_update on a KV store collection, read once and written once per alert run.
+
+    Used as a context manager, or closed, it stays open so all deliveries of
+    the run share it; finish() writes the changes once the alert run is done.
+    """
+
+    def __init__(self, client, cache=None, cache_ttl=DEFAULT_CACHE_TTL, on_error=None):
+        self.client = client
+        # LocalStore holding the last snapshot read on this member
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.on_error = on_error
+        self.entries = None
+        self.changed = {}
+        self.fallback = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def _failed(self, error):
+        if self.on_error is not None:
+            self.on_error("KV store unavailable, using local state for this run: {}".format(str(error)))
+        if self.fallback is None:
+            from .store import LocalStore
+
+            self.fallback = LocalStore()
+
+    def _load(self, now):
+        if self.entries is not None:
+            return
+        if self.cache is not None and self.cache_ttl:
+            snapshot = self.cache.kv_get(CACHE_NAMESPACE, self.client.url, now)
+            if snapshot is not None:
+                self.entries = snapshot
+                return
+        documents = self.client.query({"$or": [{"expires": None}, {"expires": {"$gt": now}}]})
+        self.entries = dict(
+            (document["_key"], [document["namespace"], document["key"], json.loads(document["value"]),
+                                document.get("expires")])
+            for document in documents
+        )
+        self._cache(now, keep_expiry=False)
+
+    def _cache(self, now, keep_expiry):
+        if self.cache is not None and self.cache_ttl:
+            entries = self.entries
+            self.cache.kv_update(CACHE_NAMESPACE, self.client.url, lambda old: entries, now, ttl=self.cache_ttl,
+                                 keep_expiry=keep_expiry)
+
+    def _ready(self, now):
+        if self.fallback is None:
+            try:
+                self._load(now)
+            except (requests.exceptions.RequestException, KVStoreError, ValueError, KeyError) as e:
+                self._failed(e)
+        return self.fallback
+
+    def kv_get(self, namespace, key, now):
+        fallback = self._ready(now)
+        if fallback is not None:
+            return fallback.kv_get(namespace, key, now)
+        entry = self.entries.get(document_key(namespace, key))
+        if entry is None or (entry[3] is not None and entry[3] <= now):
+            return None
+        return entry[2]
+
+    def kv_update(self, namespace, key, update, now, ttl=None, keep_expiry=False):
+        fallback = self._ready(now)
+        if fallback is not None:
+            return fallback.kv_update(namespace, key, update, now, ttl=ttl, keep_expiry=keep_expiry)
+        doc_key = document_key(namespace, key)
+        entry = self.entries.get(doc_key)
+        old = None
+        if entry is not None and (entry[3] is None or entry[3] > now):
+            old = entry[2]
+        new = update(old)
+        if new is None:
+            if entry is None:
+                return None
+            # Deleted documents are written as expired and purged later, so one batch_save covers all changes
+            entry = [namespace, key, None, now]
+        elif keep_expiry and old is not None:
+            entry = [namespace, key, new, entry[3]]
+        else:
+            entry = [namespace, key, new, None if ttl is None else now + ttl]
+        self.entries[doc_key] = self.changed[doc_key] = entry
+        return new
+
+    def kv_purge(self, now):
+        if self.fallback is not None:
+            self.fallback.kv_purge(now)
+        elif random.random() < PURGE_PROBABILITY:
+            try:
+                self.client.delete({"expires": {"$lte": now}})
+            except (requests.exceptions.RequestException, KVStoreError) as e:
+                if self.on_error is not None:
+                    self.on_error("Could not purge expired KV store state: {}".format(str(e)))
+
+    def flush(self, now=None):
+        """Write the changes of this run in one batch_save request."""
+        now = time.time() if now is None else now
+        if self.fallback is not None or not self.changed:
+            return
+        documents = [
+            {"_key": doc_key, "namespace": namespace, "key": key, "value": json.dumps(value), "expires": expires}
+            for doc_key, (namespace, key, value, expires) in self.changed.items()
+        ]
+        self.client.batch_save(documents)
+        self.changed = {}
+        self._cache(now, keep_expiry=True)
+
+    def close(self):
+        pass
+
+    def finish(self):
+        """Write the changes of this run and release the connection and local stores."""
+        try:
+            self.flush()
+        finally:
+            self.client.close()
+            if self.fallback is not None:
+                self.fallback.close()
+            if self.cache is not None:
+                self.cache.close()
@@ -0,0 +1,153 @@
+# encoding = utf-8
+"""
+Priority lanes for the delivery daemon's queue.
+
+Messages are queued in one lane per Gotify priority band and delivered by
+weighted round-robin, highest band first, so a storm of informational
+messages cannot delay a page while Gotify is slow. Under backpressure,
+low-priority messages for the same target and title are coalesced into one
+message, and when the queue is full the oldest message of the lowest band
+is shed (handed back to the caller to spool) to make room.
+"""
+import collections
+import threading
+
+# Lowest priority of each band, highest band first (Gotify: 8-10 high, 4-7 normal, 0-3 low)
+BANDS = (8, 4, 0)
+BAND_NAMES = ("high", "normal", "low")
+
+DEFAULT_WEIGHTS = (8, 3, 1)
+DEFAULT_CAPACITY = 10000
+
+# Share of the capacity above which low-priority messages are coalesced
+COALESCE_THRESHOLD = 0.5
+
+# Coalesced message bodies are not grown beyond this size
+MAX_COALESCED_BYTES = 32768
+
+
+def lane_for(priority):
+    """Return the lane index for a Gotify priority."""
+    try:
+        priority = int(priority)
+    except (TypeError, ValueError):
+        priority = 0
+    for index, lowest in enumerate(BANDS):
+        if priority >= lowest:
+            return index
+    return len(BANDS) - 1
+
+
+def parse_weights(value):
+    """Parse comma separated lane weights, highest band first."""
+    if value is None or value == "":
+        return DEFAULT_WEIGHTS
+    weights = tuple(int(part) for part in str(value).split(","))
+    if len(weights) != len(BANDS) or min(weights) < 1:
+        raise ValueError("expected {} positive lane weights".format(len(BANDS)))
+    return weights
+
+
+def _coalesce_key(message):
+    payload = message["payload"]
+    return (message["url"], message["token"], payload.get("title"), payload.get("priority"))
+
+
+class LaneScheduler(object):
+    """Bounded, thread-safe queue of daemon messages with priority lanes."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, weights=DEFAULT_WEIGHTS,
+                 coalesce_threshold=COALESCE_THRESHOLD):
+        self.capacity = capacity
+        self.weights = tuple(weights)
+        self.coalesce_at = int(capacity * coalesce_threshold)
+        self.lanes = [collections.deque() for _ in BANDS]
+        self.credits = list(self.weights)
+        # Latest queued message per coalescing key in the lowest lane
+        self.coalescable = {}
+        self.size = 0
+        self.coalesced = 0
+        self.shed = 0
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return self.size
+
+    def put(self, message):
+        """Queue a message and return the list of messages shed to make room."""
+        lane = lane_for(message["payload"].get("priority"))
+        lowest = len(BANDS) - 1
+        with self.condition:
+            if lane == lowest and self.size >= self.coalesce_at and self._coalesce(message):
+                return []
+
+            shed = []
+            if self.size >= self.capacity:
+                victim = self._shed_from(lane)
+                if victim is None:
+                    # Everything queued outranks this message
+                    self.shed += 1
+                    return [message]
+                shed.append(victim)
+
+            self.lanes[lane].append(message)
+            self.size += 1
+            if lane == lowest:
+                self.coalescable[_coalesce_key(message)] = message
+            self.condition.notify()
+            return shed
+
+    def get(self, timeout=None):
+        """Return the next message by weighted round-robin, or None on timeout."""
+        with self.condition:
+            if not self.size and not self.condition.wait_for(lambda: self.size, timeout):
+                return None
+            return self._pop()
+
+    def drain(self):
+        """Remove and return every queued message, highest band first."""
+        with self.condition:
+            messages = [message for lane in self.lanes for message in lane]
+            for lane in self.lanes:
+                lane.clear()
+            self.coalescable.clear()
+            self.size = 0
+            return messages
+
+    def _pop(self):
+        for _ in range(2):
+            for index, lane in enumerate(self.lanes):
+                if lane and self.credits[index] > 0:
+                    self.credits[index] -= 1
+                    return self._take(index)
+            # Every non-empty lane has used its share of this round
+            self.credits = list(self.weights)
+
+    def _take(self, index):
+        message = self.lanes[index].popleft()
+        self.size -= 1
+        if index == len(BANDS) - 1:
+            key = _coalesce_key(message)
+            if self.coalescable.get(key) is message:
+                del self.coalescable[key]
+        return message
+
+    def _shed_from(self, lane):
+        """Remove the oldest message from the lowest non-empty band at or below lane."""
+        for index in range(len(BANDS) - 1, lane - 1, -1):
+            if self.lanes[index]:
+                self.shed += 1
+                return self._take(index)
+        return None
+
+    def _coalesce(self, message):
+        queued = self.coalescable.get(_coalesce_key(message))
+        if queued is None:
+            return False
+        payload = queued["payload"]
+        body = (payload.get("message") or "") + "\n" + (message["payload"].get("message") or "")
+        if len(body.encode("utf-8")) > MAX_COALESCED_BYTES:
+            return False
+        payload["message"] = body
+        self.coalesced += 1
+        return True
@@ -0,0 +1,234 @@
+# encoding = utf-8
+"""
+Timing spans and counters for one alert invocation.
+
+process_event collects where its time goes (settings resolution, payload
+build, connection setup, TLS, request and response) and what happened to
+each message, and emits everything as a single JSON line in the alert log.
+Optionally the same figures are appended to a file in the HTTP Event
+Collector multiple-metric format, ready to be sent to a metrics index.
+
+Connection setup is timed by urllib3 connection classes that report to the
+active Metrics object. Only the pools of adapters using TimedConnections
+create them, so requests to splunkd or the KV store are not counted.
+"""
+import datetime
+import json
+import os
+import threading
+import time
+
+from urllib3 import connectionpool, poolmanager
+from urllib3.connection import HTTPConnection, HTTPSConnection
+
+METRIC_PREFIX = "alert_gotify."
+
+_active = None
+
+
+def _record(name, seconds):
+    metrics = _active
+    if metrics is not None:
+        metrics.observe(name, seconds)
+
+
+def _count(name):
+    metrics = _active
+    if metrics is not None:
+        metrics.incr(name)
+
+
+class TimedHTTPConnection(HTTPConnection):
+    """HTTP connection that records DNS and TCP connect time."""
+
+    def connect(self):
+        start = time.perf_counter()
+        super(TimedHTTPConnection, self).connect()
+        _record("connect", time.perf_counter() - start)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    """HTTPS connection that records DNS and TCP connect time, the TLS handshake and session resumptions."""
+
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedHTTPSConnection, self)._new_conn()
+        finally:
+            self._tcp_seconds = time.perf_counter() - start
+
+    def connect(self):
+        self._tcp_seconds = 0.0
+        start = time.perf_counter()
+        super(TimedHTTPSConnection, self).connect()
+        _record("connect", self._tcp_seconds)
+        _record("tls", time.perf_counter() - start - self._tcp_seconds)
+        if getattr(self.sock, "session_reused", False):
+            _count("tls_resumed")
+
+
+class TimedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+TIMED_POOL_CLASSES = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+
+class TimedConnections(object):
+    """requests HTTPAdapter mixin whose connection pools time their connections."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedConnections, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = TIMED_POOL_CLASSES
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super(TimedConnections, self).proxy_manager_for(proxy, **proxy_kwargs)
+        # SOCKS proxies bring their own pool classes
+        if manager.pool_classes_by_scheme is poolmanager.pool_classes_by_scheme:
+            manager.pool_classes_by_scheme = TIMED_POOL_CLASSES
+        return manager
+
+
+class Metrics(object):
+    """Thread-safe spans (seconds, summed) and counters."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.clock = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        # Dimensions included with the metrics, such as the alert mode
+        self.fields = {}
+        self.lock = threading.Lock()
+
+    def activate(self):
+        """Make this the object that connection timings are reported to."""
+        global _active
+        _active = self
+        return self
+
+    def observe(self, name, seconds):
+        with self.lock:
+            self.spans[name] = self.spans.get(name, 0.0) + seconds
+            if name == "connect":
+                self.counters["connections"] = self.counters.get("connections", 0) + 1
+
+    def incr(self, name, value=1):
+        if value:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def timed_iter(self, name, iterable):
+        """Yield from iterable, adding the time spent producing items to a span."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.observe(name, time.perf_counter() - start)
+                return
+            self.observe(name, time.perf_counter() - start)
+            yield item
+
+    def timed(self, post):
+        """
+        Wrap a requests post function to time every attempt.
+
+        The request span runs until the response headers arrive and the
+        response span covers reading the body.
+        """
+        def timed_post(*args, **kwargs):
+            start = time.perf_counter()
+            self.incr("attempts")
+            try:
+                response = post(*args, **kwargs)
+            except Exception:
+                self.observe("request", time.perf_counter() - start)
+                raise
+            total = time.perf_counter() - start
+            elapsed = getattr(response, "elapsed", None)
+            headers = elapsed.total_seconds() if isinstance(elapsed, datetime.timedelta) else total
+            self.observe("request", min(headers, total))
+            self.observe("response", max(0.0, total - headers))
+            return response
+        return timed_post
+
+    def on_retry(self, delay):
+        """RetryPolicy callback counting retries and their backoff."""
+        self.incr("retries")
+        self.observe("backoff", delay)
+
+    def as_dict(self, **fields):
+        with self.lock:
+            document = dict(self.fields)
+            document.update(fields)
+            document["duration_ms"] = _ms(time.perf_counter() - self.clock)
+            document["spans_ms"] = dict((name, _ms(seconds)) for name, seconds in sorted(self.spans.items()))
+            document["counters"] = dict(sorted(self.counters.items()))
+        return document
+
+    def emit(self, helper, path=None, **fields):
+        """Log the metrics as one JSON line, and append them to path in HEC format if given."""
+        document = self.as_dict(**fields)
+        helper.log_info("Delivery metrics: {}".format(json.dumps(document, sort_keys=True)))
+        if path:
+            try:
+                write_hec(path, document, self.started)
+            except OSError as e:
+                helper.log_error("Could not write metrics file {}: {}".format(path, str(e)))
+        return document
+
+
+class _Span(object):
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+def _ms(seconds):
+    return round(seconds * 1000.0, 3)
+
+
+def hec_event(document, timestamp):
+    """Return a HEC multiple-metric event for a metrics document."""
+    fields = {}
+    for key, value in document.items():
+        if key == "spans_ms":
+            for name, ms in value.items():
+                fields["metric_name:{}span.{}_ms".format(METRIC_PREFIX, name)] = ms
+        elif key == "counters":
+            for name, count in value.items():
+                fields["metric_name:{}{}".format(METRIC_PREFIX, name)] = count
+        elif key == "duration_ms":
+            fields["metric_name:{}duration_ms".format(METRIC_PREFIX)] = value
+        elif value is not None:
+            # Remaining fields become dimensions
+            fields[key] = value
+    return {"time": round(timestamp, 3), "event": "metric", "source": "alert_gotify", "fields": fields}
+
+
+def write_hec(path, document, timestamp):
+    line = json.dumps(hec_event(document, timestamp), sort_keys=True) + "\n"
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    # A single append of a short line keeps concurrent alert processes from interleaving
+    with open(path, "a") as metrics_file:
+        metrics_file.write(line)
@@ -1,90 +1,1107 @@
 # encoding = utf-8
+import itertools
 import os
+import random
 import sys
+import time
 
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lib"))
+# import_declare_test normally puts lib first already; a duplicate entry would
+# add a directory scan to every import
+LIB_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "lib"))
+if LIB_DIR not in sys.path:
+    sys.path.insert(0, LIB_DIR)
 import requests
 
+from . import spool
+from .metrics import Metrics
+from .params import parse_bool, parse_non_negative, parse_positive_int
+from .resilience import (
+    RetryPolicy, breaker_allow, breaker_record, is_retryable_status, parse_retries, parse_timeout
+)
+from .results import iter_results
+from .settings import get_global_setting
+from .sender import (
+    GotifySender, PayloadBuilder, build_headers, build_message_url, build_payload, compressed_body, parse_workers,
+    post_message
+)
+from .store import LocalStore, default_state_dir
+from .templating import compile_template
+from .tls import resolve_verify
+from .truncation import DEFAULT_MAX_MESSAGE_BYTES
+
+MODE_SINGLE = "single"
+MODE_PER_RESULT = "per_result"
+MODE_DIGEST = "digest"
+MODE_SUMMARY = "summary"
+MODES = (MODE_SINGLE, MODE_PER_RESULT, MODE_DIGEST, MODE_SUMMARY)
+
+# Failed messages are written to the spool in batches of this size
+SPOOL_BATCH = 500
+
+# Where deduplication, rate limit and circuit breaker state is shared
+SHARED_STATE_LOCAL = "local"
+SHARED_STATE_KVSTORE = "kvstore"
+SHARED_STATES = (SHARED_STATE_LOCAL, SHARED_STATE_KVSTORE)
+
+_STATE_ATTRIBUTE = "_alert_gotify_state"
+
+
+class Delivery(object):
+    """Gotify server and delivery options resolved for one alert run."""
+
+    def __init__(self, url, token, ssl_verify, timeout, retry, workers, spool_enabled,
+                 dedup_window=0, rate_limit=0, rate_burst=None, use_daemon=False, targets=None,
+                 host_connections=None, deadline=None, metrics=None, adaptive=False,
+                 max_message_bytes=DEFAULT_MAX_MESSAGE_BYTES, markdown=False, compress=False, coalesce_window=0):
+        self.url = url
+        self.token = token
+        self.ssl_verify = ssl_verify
+        self.timeout = timeout
+        self.retry = retry
+        self.workers = workers
+        self.spool_enabled = spool_enabled
+        self.dedup_window = dedup_window
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.use_daemon = use_daemon
+        self.targets = targets
+        self.host_connections = host_connections
+        self.deadline = deadline
+        self.metrics = metrics or Metrics()
+        # Adapt the requests in flight to the server's load, up to workers
+        self.adaptive = adaptive
+        self.max_message_bytes = max_message_bytes
+        self.markdown = markdown
+        self.compress = compress
+        self.coalesce_window = coalesce_window
+        # StreamWatcher measuring delivery latency in a sampled alert run
+        self.stream = None
+        # Router choosing the targets of each result from a routing lookup
+        self.routes = None
+        # ChangeTracker passing on only the results that are new since the last run
+        self.changes = None
+        self.changes_key = None
+        self.state_ttl = None
+
+    @property
+    def throttled(self):
+        return bool(self.dedup_window or self.rate_limit)
+
+    def sender(self, limiter=None):
+        return GotifySender(self.url, self.token, ssl_verify=self.ssl_verify, workers=self.workers,
+                            timeout=self.timeout, retry=self.retry, metrics=self.metrics, stream=self.stream,
+                            limiter=limiter, compress=self.compress)
+
 
 def process_event(helper, *args, **kwargs):
+    metrics = Metrics().activate()
+    status = 1
+    try:
+        status = _process_event(helper, metrics)
+        return status
+    finally:
+        _flush_state(helper)
+        _emit_metrics(helper, metrics, status)
+
+
+def process_payloads(helper, payloads, label, metrics=None):
+    """
+    Send prepared payloads with the delivery options of helper's parameters.
+
+    Used by the replay command, which reads messages from a file instead of
+    rendering search results. Returns 0 when every message was delivered or
+    queued, 1 otherwise.
+    """
+    metrics = (metrics or Metrics()).activate()
+    metrics.fields["mode"] = label.lower()
+    status = 1
+    try:
+        delivery = _resolve_delivery(helper, metrics)
+        if delivery is None:
+            return status
+        payloads = metrics.timed_iter("build", payloads)
+        if delivery.targets:
+            status = _fan_out(helper, delivery, payloads, label)
+        else:
+            status = _send_payloads(helper, delivery, payloads, label)
+        return status
+    finally:
+        _flush_state(helper)
+        _emit_metrics(helper, metrics, status)
+
+
+def _process_event(helper, metrics):
     helper.log_info("Alert action alert_gotify started.")
-    
+
     # Get parameters from alert configuration
-    url = helper.get_param("url")
-    token = helper.get_param("token")
     message = helper.get_param("message")
     title = helper.get_param("title")
     priority = helper.get_param("priority")
-    ssl_verify = helper.get_param("ssl_verify")
-    
-    # Get global settings if alert-specific settings are not provided
-    if not url:
-        url = helper.get_global_setting("gotify_url")
-        helper.log_info("Using global Gotify URL setting")
-    
-    if not token:
-        token = helper.get_global_setting("gotify_token")
-        helper.log_info("Using global Gotify token setting")
-    
-    # Handle SSL verification - default to True if not specified
-    if ssl_verify is None or ssl_verify == "":
-        ssl_verify = True
-    elif isinstance(ssl_verify, str):
-        ssl_verify = ssl_verify not in ['0', 'false', 'False', 'FALSE', 'no', 'No', 'NO']
+    mode = helper.get_param("mode") or MODE_SINGLE
+    metrics.fields["mode"] = mode
+
+    if mode not in MODES:
+        helper.log_error("Invalid mode '{}'. Expected one of: {}".format(mode, ", ".join(MODES)))
+        return 1
+
+    delivery = _resolve_delivery(helper, metrics)
+    if delivery is None:
+        return 1
+
+    if helper.get_param("state_keys"):
+        if not _load_changes(helper, delivery):
+            return 1
+
+    delivery.stream = _open_stream(helper, delivery)
+    try:
+        return _deliver(helper, delivery, mode, message, title, priority)
+    finally:
+        if delivery.stream is not None:
+            _close_stream(helper, delivery)
+
+
+def _deliver(helper, delivery, mode, message, title, priority):
+    """Render the alert's messages for its mode and send them."""
+    message_template = compile_template(message)
+    title_template = compile_template(title)
+
+    if mode == MODE_PER_RESULT:
+        status = _process_per_result(helper, delivery, message_template, title_template, priority)
+    elif mode == MODE_DIGEST:
+        status = _process_digest(helper, delivery, message_template, title_template, priority)
+    elif mode == MODE_SUMMARY:
+        status = _process_summary(helper, delivery, message_template, title_template, priority)
     else:
-        ssl_verify = bool(ssl_verify)
-    
-    try:
-        # Construct headers
-        headers = {
-            'X-Gotify-Key': token,
-            'accept': 'application/json',
-            'Content-Type': 'application/json'
-        }
-        
-        # Construct payload
-        payload = {
-            'message': message,
-            'priority': int(priority)
-        }
-        
-        if title:
-            payload['title'] = title
-        
+        status = _process_single(helper, delivery, message_template, title_template, message, title, priority)
+    if delivery.changes is not None:
+        status = max(status, _finish_changes(helper, delivery, title_template, priority))
+    return status
+
+
+def _process_single(helper, delivery, message_template, title_template, message, title, priority):
+    """Send the alert's message, rendered against the first result."""
+    metrics = delivery.metrics
+    url, token, ssl_verify = delivery.url, delivery.token, delivery.ssl_verify
+
+    try:
+        with metrics.span("build"):
+            # Construct headers
+            headers = build_headers(token)
+
+            # Render templated fields against the first result, which also picks the route
+            first_result = None
+            if (delivery.changes is not None or delivery.routes is not None
+                    or not (message_template.is_static and title_template.is_static)):
+                fields = message_template.fields + title_template.fields
+                if delivery.routes is not None:
+                    fields += delivery.routes.fields
+                results = _results(helper, delivery, fields)
+                first_result = next(iter(results), None)
+                if delivery.changes is not None:
+                    # Every row is fingerprinted, but only the first new one is rendered
+                    for _ in results:
+                        pass
+                    if first_result is None:
+                        helper.log_info("No new results since the last run, not sending")
+                        return 0
+                elif hasattr(results, "close"):
+                    results.close()
+                first_result = first_result or {}
+                message = message_template.render(first_result)
+                title = title_template.render(first_result)
+
+            # Construct payload
+            payload = build_payload(message, title, priority, delivery.max_message_bytes, delivery.markdown)
+
+        # Send one notification for the alerts firing on the same token within the window
+        if delivery.coalesce_window and delivery.routes is None:
+            coalesced = _coalesce(helper, delivery, payload)
+            if coalesced is None:
+                # Another alert process sends it
+                _settle(delivery, _claim(delivery, payload), True)
+                return 0
+            payload = coalesced
+        _claim(delivery, payload)
+
+        if delivery.routes is not None:
+            return _fan_out(helper, delivery, [(_route(delivery, first_result), payload)], "Routed", routed=True)
+        if delivery.targets:
+            return _fan_out(helper, delivery, [payload], "Multi-target")
+
         # Construct URL
-        gotify_url = url
-        if gotify_url.endswith("/"):
-            gotify_url = gotify_url[:-1]
-        gotify_url += "/message"
-        
+        gotify_url = build_message_url(url)
+
+        # Suppress duplicates and enforce the rate limit across alert processes
+        if delivery.throttled:
+            with _state_store(helper) as store:
+                throttle = _throttle(store, delivery)
+                held = throttle.admit(payload)
+            _count_held(metrics, throttle)
+            if held:
+                helper.log_info("Not sending Gotify message: {}".format(held))
+                _settle(delivery, payload, bool(throttle.duplicates))
+                return 0
+
+        # Fail fast while other alerts have found the server unavailable
+        if not _breaker_allow(helper, url):
+            helper.log_error("Gotify server {} is unavailable (circuit breaker open), not sending".format(url))
+            metrics.incr("failed")
+            _spool_messages(helper, delivery, [(payload, "Circuit breaker open")])
+            return 1
+
+        if delivery.use_daemon:
+            _, lost, remaining = _hand_off(helper, delivery, [payload])
+            if remaining is None:
+                if lost:
+                    return 1
+                helper.log_info("Queued Gotify message with the delivery daemon")
+                return 0
+
         helper.log_info("Sending message to Gotify server: {}".format(url))
-        
+
+        # The payload's JSON is encoded once, and the headers already carry its Content-Type
+        body = {"data": payload.body}
+        if delivery.compress:
+            body = compressed_body(payload)
+            if "headers" in body:
+                headers = dict(headers, **body.pop("headers"))
+
         # Send the request
-        response = requests.post(
+        post = metrics.timed(post_message)
+        started = time.monotonic()
+        response = delivery.retry.run(lambda: post(
             gotify_url,
             headers=headers,
-            json=payload,
-            verify=ssl_verify
-        )
-        
+            verify=ssl_verify,
+            timeout=delivery.timeout,
+            **body
+        ))
+
         if response.status_code == 200:
             helper.log_info("Successfully sent Gotify message (200 OK)")
+            metrics.incr("sent")
+            _settle(delivery, payload, True)
+            if delivery.stream is not None:
+                delivery.stream.sent(response, started)
+            _breaker_record(helper, url, True)
+            if delivery.spool_enabled:
+                _drain_spool(helper)
             return 0
         else:
-            helper.log_error("Failed to send Gotify message. Status code: {}, Response: {}".format(
-                response.status_code, response.text
-            ))
+            error = "Status code: {}, Response: {}".format(response.status_code, response.text)
+            helper.log_error("Failed to send Gotify message. {}".format(error))
+            metrics.incr("failed")
+            if is_retryable_status(response.status_code):
+                _breaker_record(helper, url, False)
+                _spool_messages(helper, delivery, [(payload, error)])
             return 1
-            
+
     except requests.exceptions.SSLError as e:
+        metrics.incr("failed")
         helper.log_error("SSL verification failed: {}".format(str(e)))
         helper.log_error("Try setting 'Verify SSL Certificate' to false if using self-signed certificates")
         return 1
     except requests.exceptions.RequestException as e:
         helper.log_error("Request error sending Gotify message: {}".format(str(e)))
+        metrics.incr("failed")
+        _breaker_record(helper, url, False)
+        _spool_messages(helper, delivery, [(payload, "Request error: {}".format(str(e)))])
         return 1
     except Exception as e:
         helper.log_error("Error sending Gotify message: {}".format(str(e)))
         import traceback
         helper.log_error(traceback.format_exc())
         return 1
+
+
+def _resolve_delivery(helper, metrics):
+    """Return the Delivery for helper's parameters, or None after logging an invalid parameter."""
+    url = helper.get_param("url")
+    token = helper.get_param("token")
+    ssl_verify = helper.get_param("ssl_verify")
+
+    # Get global settings if alert-specific settings are not provided
+    with metrics.span("settings"):
+        if not url:
+            url = get_global_setting(helper, "gotify_url")
+            helper.log_info("Using global Gotify URL setting")
+
+        if not token:
+            token = get_global_setting(helper, "gotify_token")
+            helper.log_info("Using global Gotify token setting")
+
+    # Handle SSL verification - default to True if not specified, optionally against a custom CA
+    try:
+        ssl_verify = resolve_verify(parse_bool(ssl_verify, True), helper.get_param("ca_path"))
+    except ValueError as e:
+        helper.log_error("Invalid SSL verification setting: {}".format(str(e)))
+        return None
+
+    shared_state = helper.get_param("shared_state") or SHARED_STATE_LOCAL
+    if shared_state not in SHARED_STATES:
+        helper.log_error("Invalid shared_state '{}'. Expected one of: {}".format(
+            shared_state, ", ".join(SHARED_STATES)
+        ))
+        return None
+
+    try:
+        delivery = Delivery(
+            url, token, ssl_verify,
+            timeout=parse_timeout(helper.get_param("connect_timeout"), helper.get_param("read_timeout")),
+            retry=RetryPolicy(parse_retries(helper.get_param("retries")), on_retry=metrics.on_retry),
+            workers=parse_workers(helper.get_param("workers")),
+            # Undelivered messages are spooled for retry unless disabled
+            spool_enabled=parse_bool(helper.get_param("spool"), True),
+            dedup_window=parse_non_negative(helper.get_param("dedup_window")),
+            rate_limit=parse_non_negative(helper.get_param("rate_limit")),
+            rate_burst=parse_non_negative(helper.get_param("rate_burst"), None),
+            # Hand messages to the delivery daemon when it is running
+            use_daemon=parse_bool(helper.get_param("daemon"), False),
+            adaptive=parse_bool(helper.get_param("adaptive_concurrency"), False),
+            max_message_bytes=int(parse_non_negative(helper.get_param("max_message_bytes"),
+                                                     DEFAULT_MAX_MESSAGE_BYTES)),
+            markdown=parse_bool(helper.get_param("markdown"), False),
+            compress=parse_bool(helper.get_param("compress"), False),
+            coalesce_window=parse_non_negative(helper.get_param("coalesce_window")),
+            metrics=metrics,
+        )
+        extra_targets = helper.get_param("targets")
+        routes = helper.get_param("routes")
+        if extra_targets or routes:
+            from .fanout import DEFAULT_DEADLINE, DEFAULT_HOST_CONNECTIONS, Target, parse_targets
+
+            # The alert's own server comes first, followed by the additional targets
+            delivery.targets = [Target(url, token)] + [
+                target for target in parse_targets(extra_targets, token) if target != (url, token)
+            ]
+            # Results the routing table has no row for go to these targets
+            if routes:
+                delivery.routes = _load_routes(helper, routes, url, token)
+                if delivery.routes is None:
+                    return None
+            delivery.host_connections = parse_positive_int(
+                helper.get_param("host_connections"), DEFAULT_HOST_CONNECTIONS
+            )
+            delivery.deadline = parse_non_negative(helper.get_param("deadline"), DEFAULT_DEADLINE)
+    except ValueError as e:
+        helper.log_error("Invalid delivery parameter: {}".format(str(e)))
+        return None
+    return delivery
+
+
+def _load_routes(helper, path, url, token):
+    """Return the Router of a routing lookup, or None after logging why it cannot be used."""
+    from .routing import load_routes
+
+    try:
+        if LocalStore.exists():
+            with LocalStore() as store:
+                table = load_routes(path, store)
+        else:
+            table = load_routes(path)
+    except (OSError, ValueError) as e:
+        helper.log_error("Invalid routing table: {}".format(str(e)))
+        return None
+    return table.bind(url, token)
+
+
+def _route(delivery, result):
+    """Return the targets of a result: those of its routing table rows, or the alert's."""
+    return delivery.routes.route(result) or delivery.targets
+
+
+def _process_per_result(helper, delivery, message_template, title_template, priority):
+    """Send one Gotify message per search result over a pooled sender."""
+    try:
+        builder = PayloadBuilder(message_template, title_template, priority, delivery.max_message_bytes,
+                                 delivery.markdown)
+    except (TypeError, ValueError):
+        helper.log_error("Invalid priority '{}'".format(priority))
+        return 1
+
+    if delivery.routes is not None:
+        fields = message_template.fields + title_template.fields + delivery.routes.fields
+        jobs = delivery.metrics.timed_iter("build", (
+            (_route(delivery, result), _claim(delivery, builder.build(result)))
+            for result in _results(helper, delivery, fields)
+        ))
+        return _fan_out(helper, delivery, jobs, "Per-result", routed=True)
+
+    payloads = delivery.metrics.timed_iter("build", (
+        _claim(delivery, builder.build(result))
+        for result in _results(helper, delivery, message_template.fields + title_template.fields)
+    ))
+    if delivery.targets:
+        return _fan_out(helper, delivery, payloads, "Per-result")
+    return _send_payloads(helper, delivery, payloads, "Per-result")
+
+
+def _process_digest(helper, delivery, message_template, title_template, priority):
+    """Collapse search results into a few digest messages and send them."""
+    from .digest import DEFAULT_MAX_BYTES, DEFAULT_MAX_ROWS, DigestBuilder, build_digests
+
+    try:
+        builder = DigestBuilder(
+            message_template,
+            title_template,
+            group_by=helper.get_param("group_by") or None,
+            max_rows=parse_positive_int(helper.get_param("digest_max_rows"), DEFAULT_MAX_ROWS),
+            max_bytes=parse_positive_int(helper.get_param("digest_max_bytes"), DEFAULT_MAX_BYTES),
+        )
+    except ValueError as e:
+        helper.log_error("Invalid digest parameter: {}".format(str(e)))
+        return 1
+    if delivery.routes is not None:
+        helper.log_error("Routing tables are not used in digest mode, sending to the alert's targets")
+
+    fields = message_template.fields + title_template.fields + ((builder.group_by,) if builder.group_by else ())
+    results = _results(helper, delivery, fields)
+    if delivery.changes is not None:
+        # Each digest carries the new rows of its group
+        digests = build_digests(results, builder, tag=delivery.changes.take)
+    else:
+        digests = ((title, message, None) for title, message in build_digests(results, builder))
+    payloads = delivery.metrics.timed_iter("build", (
+        _claim(delivery, build_payload(message, title, priority, delivery.max_message_bytes, delivery.markdown), rows)
+        for title, message, rows in digests
+    ))
+    if delivery.targets:
+        return _fan_out(helper, delivery, payloads, "Digest")
+    return _send_payloads(helper, delivery, payloads, "Digest")
+
+
+def _process_summary(helper, delivery, message_template, title_template, priority):
+    """Send one message with the most frequent values of some result fields."""
+    from .summary import DEFAULT_TOP, Summary, parse_fields, summarize
+
+    try:
+        summary = Summary(parse_fields(helper.get_param("summary_fields")),
+                          top=parse_positive_int(helper.get_param("summary_top"), DEFAULT_TOP))
+    except ValueError as e:
+        helper.log_error("Invalid summary parameter: {}".format(str(e)))
+        return 1
+    if delivery.routes is not None:
+        helper.log_error("Routing tables are not used in summary mode, sending to the alert's targets")
+
+    fields = message_template.fields + title_template.fields + tuple(field.name for field in summary.fields)
+    try:
+        with delivery.metrics.span("build"):
+            first_result = summarize(_results(helper, delivery, fields), summary)
+            if first_result is None:
+                helper.log_info("No results to summarize, not sending")
+                return 0
+            header = message_template.render(first_result).strip()
+            payload = _claim(delivery, build_payload(
+                summary.render(header, delivery.markdown), title_template.render(first_result),
+                priority, delivery.max_message_bytes, delivery.markdown
+            ))
+    except (TypeError, ValueError):
+        helper.log_error("Invalid priority '{}'".format(priority))
+        return 1
+
+    helper.log_info("Summarized {} result(s)".format(summary.total))
+    if delivery.targets:
+        return _fan_out(helper, delivery, [payload], "Summary")
+    return _send_payloads(helper, delivery, [payload], "Summary")
+
+
+def _results(helper, delivery, fields):
+    """Return the alert's results; with state tracking only the rows that are new since the last run."""
+    if delivery.changes is None:
+        return iter_results(helper, fields)
+    return delivery.changes.new_rows(iter_results(helper, fields + delivery.changes.keys))
+
+
+def _load_changes(helper, delivery):
+    """Set up state tracking for the alert's saved search; returns False after logging an invalid parameter."""
+    from .changes import DEFAULT_STATE_TTL, load_tracker, parse_keys, state_key
+
+    search_name = getattr(helper, "search_name", None)
+    if not isinstance(search_name, str) or not search_name:
+        helper.log_error("State tracking needs the saved search name, sending every result")
+        return True
+    try:
+        keys = parse_keys(helper.get_param("state_keys"))
+        delivery.state_ttl = parse_non_negative(helper.get_param("state_ttl"), DEFAULT_STATE_TTL) or None
+    except ValueError as e:
+        helper.log_error("Invalid state tracking parameter: {}".format(str(e)))
+        return False
+    delivery.changes_key = state_key(search_name, delivery.url, delivery.token)
+    try:
+        with LocalStore() as store:
+            delivery.changes = load_tracker(store, delivery.changes_key, keys)
+    except Exception as e:
+        helper.log_error("Could not read result state, sending every result: {}".format(str(e)))
+    return True
+
+
+def _finish_changes(helper, delivery, title_template, priority):
+    """Report cleared results and keep this run's state, without the new results that were not delivered."""
+    from .changes import save_tracker
+
+    changes = delivery.changes
+    if not changes.complete:
+        # Some results were never read, so the state of the last run is kept
+        return 0
+    helper.log_info("State tracking: {} new and {} cleared result(s) of {}".format(
+        changes.new, changes.cleared, len(changes.seen)
+    ))
+    undelivered = changes.new - len(changes.done)
+    if undelivered:
+        helper.log_info("{} new result(s) were not delivered and count as new in the next run".format(undelivered))
+    status = 0
+    if changes.cleared:
+        title = title_template.render({}).strip()
+        try:
+            payload = build_payload(
+                "{} result(s) of the last run cleared".format(changes.cleared),
+                "{} (cleared)".format(title) if title else "Cleared", priority,
+                delivery.max_message_bytes, delivery.markdown
+            )
+        except (TypeError, ValueError):
+            helper.log_error("Invalid priority '{}'".format(priority))
+            return 1
+        if delivery.targets:
+            status = _fan_out(helper, delivery, [payload], "Cleared")
+        else:
+            status = _send_payloads(helper, delivery, [payload], "Cleared")
+    try:
+        with LocalStore() as store:
+            save_tracker(store, delivery.changes_key, changes, ttl=delivery.state_ttl)
+    except Exception as e:
+        helper.log_error("Could not update result state: {}".format(str(e)))
+    return status
+
+
+def _send_payloads(helper, delivery, payloads, label):
+    """Send a stream of payloads through a pooled sender and log the outcome."""
+    try:
+        pending = []
+        spooled = [0]
+
+        def spool_pending():
+            spooled[0] += _spool_messages(helper, delivery, pending, log=False)
+            del pending[:]
+
+        if not _breaker_allow(helper, delivery.url):
+            helper.log_error("Gotify server {} is unavailable (circuit breaker open), not sending".format(
+                delivery.url
+            ))
+            if delivery.spool_enabled:
+                for payload in payloads:
+                    pending.append((payload, "Circuit breaker open"))
+                    if len(pending) >= SPOOL_BATCH:
+                        spool_pending()
+                spool_pending()
+                delivery.metrics.incr("failed", spooled[0])
+                helper.log_info("Spooled {} undelivered Gotify message(s) for retry".format(spooled[0]))
+            return 1
+
+        helper.log_info("{} delivery to Gotify server: {} ({} workers)".format(
+            label, delivery.url, delivery.workers
+        ))
+
+        def on_result(index, payload, error):
+            if error is not None and error.retryable:
+                pending.append((payload, error))
+                if len(pending) >= SPOOL_BATCH:
+                    spool_pending()
+            else:
+                if error is not None:
+                    delivery.metrics.incr("rejected")
+                _settle(delivery, payload, error is None)
+
+        store = _state_store(helper) if delivery.throttled else None
+        try:
+            throttle = _throttle(store, delivery) if store else None
+            if throttle:
+                payloads = _admitted(delivery, throttle, payloads)
+            handed_off = lost = 0
+            if delivery.use_daemon:
+                handed_off, lost, payloads = _hand_off(helper, delivery, payloads)
+            result = None
+            if payloads is not None:
+                limiter = _load_limiter(helper, delivery) if delivery.adaptive else None
+                with delivery.sender(limiter) as sender:
+                    result = sender.send_many(payloads, on_result=on_result)
+                if limiter is not None:
+                    _save_limiter(helper, delivery, limiter)
+        finally:
+            if store:
+                store.close()
+
+        if throttle and (throttle.duplicates or throttle.rate_limited):
+            helper.log_info("Not sending {} duplicate and {} rate limited Gotify message(s)".format(
+                throttle.duplicates, throttle.rate_limited
+            ))
+
+        if throttle:
+            _count_held(delivery.metrics, throttle)
+        delivery.metrics.incr("handed_off", handed_off)
+        if result is None:
+            helper.log_info("{} delivery queued {} message(s) with the delivery daemon".format(label, handed_off))
+            return 1 if lost else 0
+        delivery.metrics.incr("sent", result.sent)
+        delivery.metrics.incr("failed", result.failed)
+
+        for error in result.errors:
+            helper.log_error("Failed to send Gotify message. {}".format(error))
+        helper.log_info("{} delivery finished: {} sent, {} failed".format(label, result.sent, result.failed))
+
+        retryable_failures = spooled[0] + len(pending)
+        if result.sent:
+            _breaker_record(helper, delivery.url, True)
+        elif retryable_failures:
+            _breaker_record(helper, delivery.url, False)
+
+        if pending:
+            spool_pending()
+        if spooled[0]:
+            helper.log_info("Spooled {} undelivered Gotify message(s) for retry".format(spooled[0]))
+        elif result.sent and delivery.spool_enabled:
+            _drain_spool(helper)
+        return 1 if result.failed or lost else 0
+
+    except Exception as e:
+        helper.log_error("Error sending Gotify messages: {}".format(str(e)))
+        import traceback
+        helper.log_error(traceback.format_exc())
+        return 1
+
+
+def _fan_out(helper, delivery, payloads, label, routed=False):
+    """
+    Send every payload to every target through the asyncio engine.
+
+    With routed set, payloads are (targets, payload) pairs and each payload
+    only goes to its own targets.
+    """
+    from .fanout import FanOut
+    from .throttle import DUPLICATE
+
+    targets = delivery.targets
+    if routed:
+        targets = targets + [target for target in delivery.routes.targets if target not in targets]
+    else:
+        payloads = ((delivery.targets, payload) for payload in payloads)
+
+    try:
+        blocked = set()
+        for target in targets:
+            if target.url not in blocked and not _breaker_allow(helper, target.url):
+                helper.log_error("Gotify server {} is unavailable (circuit breaker open), not sending".format(
+                    target.url
+                ))
+                blocked.add(target.url)
+
+        helper.log_info("{} delivery to {} Gotify targets ({} connections per host)".format(
+            label, len(targets), delivery.host_connections
+        ))
+
+        pending = dict((target, []) for target in targets)
+        deferred = dict((target, 0) for target in targets)
+        spooled = [0]
+
+        def defer(target, payload, error):
+            deferred[target] += 1
+            pending[target].append((payload, error))
+            if len(pending[target]) >= SPOOL_BATCH:
+                spooled[0] += _spool_messages(helper, delivery, pending[target], log=False, target=target)
+                del pending[target][:]
+
+        def on_result(target, payload, error):
+            if error is not None and error.retryable:
+                defer(target, payload, error)
+            else:
+                if error is not None:
+                    delivery.metrics.incr("rejected")
+                _settle(delivery, payload, error is None)
+
+        store = _state_store(helper) if delivery.throttled else None
+        try:
+            throttles = dict(
+                (target, _throttle(store, delivery, target)) for target in targets
+            ) if store else {}
+
+            def jobs():
+                for payload_targets, payload in payloads:
+                    if delivery.changes is not None:
+                        delivery.changes.expect(payload, len(payload_targets))
+                    for target in payload_targets:
+                        held = None
+                        if target.url in blocked:
+                            defer(target, payload, "Circuit breaker open")
+                        elif throttles:
+                            held = throttles[target].admit(payload)
+                        if held is not None:
+                            _settle(delivery, payload, held == DUPLICATE)
+                        elif target.url not in blocked:
+                            yield target, payload
+
+            with FanOut(targets, ssl_verify=delivery.ssl_verify, timeout=delivery.timeout,
+                        retry=delivery.retry, host_connections=delivery.host_connections,
+                        deadline=delivery.deadline, metrics=delivery.metrics, stream=delivery.stream,
+                        compress=delivery.compress) as engine:
+                results = engine.send(jobs(), on_result=on_result)
+        finally:
+            if store:
+                store.close()
+
+        for throttle in throttles.values():
+            _count_held(delivery.metrics, throttle)
+        held = sum(t.duplicates + t.rate_limited for t in throttles.values())
+        if held:
+            helper.log_info("Not sending {} duplicate or rate limited Gotify message(s)".format(held))
+
+        failed = 0
+        sent = 0
+        for target in targets:
+            result = results[target]
+            for error in result.errors:
+                helper.log_error("Failed to send Gotify message to {}. {}".format(target.url, error))
+            if target.url in blocked:
+                failed += deferred[target]
+            elif result.sent:
+                _breaker_record(helper, target.url, True)
+            elif deferred[target]:
+                _breaker_record(helper, target.url, False)
+            spooled[0] += _spool_messages(helper, delivery, pending[target], log=False, target=target)
+            sent += result.sent
+            failed += result.failed
+
+        helper.log_info("{} delivery finished: {} sent, {} failed".format(label, sent, failed))
+        delivery.metrics.incr("sent", sent)
+        delivery.metrics.incr("failed", failed)
+        if spooled[0]:
+            helper.log_info("Spooled {} undelivered Gotify message(s) for retry".format(spooled[0]))
+        elif sent and delivery.spool_enabled:
+            _drain_spool(helper)
+        return 1 if failed else 0
+
+    except Exception as e:
+        helper.log_error("Error sending Gotify messages: {}".format(str(e)))
+        import traceback
+        helper.log_error(traceback.format_exc())
+        return 1
+
+
+def _open_stream(helper, delivery):
+    """Subscribe to the Gotify client stream if this alert run is sampled, otherwise return None."""
+    client_token = helper.get_param("stream_token")
+    if not client_token:
+        return None
+    from .stream import DEFAULT_SAMPLE, StreamError, StreamWatcher
+
+    try:
+        sample = parse_non_negative(helper.get_param("stream_sample"), DEFAULT_SAMPLE)
+    except ValueError as e:
+        helper.log_error("Invalid stream_sample, delivery latency is not measured: {}".format(str(e)))
+        return None
+    if random.random() >= sample:
+        return None
+    try:
+        return StreamWatcher(delivery.url, client_token, delivery.ssl_verify, timeout=delivery.timeout[0]).open()
+    except (OSError, StreamError) as e:
+        helper.log_error("Could not subscribe to the Gotify stream, delivery latency is not measured: {}".format(
+            str(e)
+        ))
+        return None
+
+
+def _close_stream(helper, delivery):
+    """Wait for sent messages to appear on the stream and log their delivery latency."""
+    from .stream import DEFAULT_WAIT, percentile
+
+    watcher = delivery.stream
+    try:
+        try:
+            wait = parse_non_negative(helper.get_param("stream_wait"), DEFAULT_WAIT)
+        except ValueError:
+            wait = DEFAULT_WAIT
+        watcher.wait(wait)
+    finally:
+        watcher.close()
+
+    tracked = len(watcher.sent_at)
+    latencies = watcher.latencies()
+    delivery.metrics.incr("stream_tracked", tracked)
+    delivery.metrics.incr("stream_seen", len(latencies))
+    if not tracked:
+        return
+    if not latencies:
+        helper.log_error("None of {} sent Gotify message(s) appeared on the stream within {}s".format(tracked, wait))
+        return
+    helper.log_info(
+        "Stream delivery latency: {} of {} message(s) seen, p50={}ms p90={}ms p99={}ms max={}ms".format(
+            len(latencies), tracked,
+            *[round(percentile(latencies, percent) * 1000.0, 1) for percent in (50, 90, 99, 100)]
+        )
+    )
+
+
+def _count_held(metrics, throttle):
+    metrics.incr("duplicates", throttle.duplicates)
+    metrics.incr("rate_limited", throttle.rate_limited)
+
+
+def _emit_metrics(helper, metrics, status):
+    """Log the invocation's metrics and append them to the metrics file if configured."""
+    counters = metrics.counters
+    # Messages that were neither delivered nor kept for retry
+    metrics.incr("dropped", max(0, counters.get("failed", 0) - counters.get("spooled", 0)))
+    path = helper.get_param("metrics_file")
+    if path and not os.path.isabs(path):
+        path = os.path.join(default_state_dir(), path)
+    search_name = getattr(helper, "search_name", None)
+    try:
+        metrics.emit(helper, path=path, status=status,
+                     search_name=search_name if isinstance(search_name, str) else None)
+    except Exception as e:
+        helper.log_error("Could not emit delivery metrics: {}".format(str(e)))
+
+
+def _throttle(store, delivery, target=None):
+    from .throttle import Throttle
+
+    url, token = target or (delivery.url, delivery.token)
+    return Throttle(store, url, token, dedup_window=delivery.dedup_window,
+                    rate_limit=delivery.rate_limit, burst=delivery.rate_burst)
+
+
+def _admitted(delivery, throttle, payloads):
+    """Yield the payloads that pass deduplication and rate limiting."""
+    from .throttle import DUPLICATE
+
+    for payload in payloads:
+        held = throttle.admit(payload)
+        if held is None:
+            yield payload
+        else:
+            # A duplicate was already sent
+            _settle(delivery, payload, held == DUPLICATE)
+
+
+def _claim(delivery, payload, rows=None):
+    """With state tracking, attach the new results a message carries to it; returns the message."""
+    if delivery.changes is not None:
+        delivery.changes.claim(payload, rows)
+    return payload
+
+
+def _settle(delivery, payload, delivered):
+    """With state tracking, record whether a message was delivered, queued or spooled."""
+    if delivery.changes is not None:
+        delivery.changes.settle(payload, delivered)
+
+
+def _hand_off(helper, delivery, payloads):
+    """
+    Queue payloads with the delivery daemon.
+
+    Returns (queued, lost, remaining) where remaining is None once every
+    payload was written to the daemon, otherwise the payloads that must be
+    sent directly. Lost payloads were written but not confirmed as queued;
+    they are counted as failed, as the daemon may or may not have them.
+    """
+    from .daemon import DaemonClient
+
+    client = DaemonClient()
+    if not client.connect():
+        helper.log_info("Delivery daemon is not running, sending directly")
+        return 0, 0, payloads
+
+    payloads = iter(payloads)
+    current = None
+    writing = True
+    accepted = 0
+    remaining = None
+    # Messages carrying new results, settled once the daemon has confirmed them
+    handed = [] if delivery.changes is not None else None
+    try:
+        for current in payloads:
+            client.send(delivery.url, delivery.token, delivery.ssl_verify, current)
+            if handed is not None:
+                handed.append(current)
+            current = None
+        writing = False
+        accepted = client.finish()
+    except (OSError, ValueError, KeyError) as e:
+        client.close()
+        if writing:
+            helper.log_error("Delivery daemon handoff failed after {} message(s), sending the rest directly: {}".format(
+                client.sent, str(e)
+            ))
+            remaining = payloads if current is None else itertools.chain([current], payloads)
+        else:
+            helper.log_error("Delivery daemon did not confirm the handoff: {}".format(str(e)))
+    lost = max(0, client.sent - accepted)
+    if lost:
+        helper.log_error("{} of {} message(s) written to the delivery daemon were not confirmed as queued".format(
+            lost, client.sent
+        ))
+        delivery.metrics.incr("failed", lost)
+    for index, payload in enumerate(handed or ()):
+        _settle(delivery, payload, index < accepted)
+    return accepted, lost, remaining
+
+
+def _spool_messages(helper, delivery, failures, log=True, target=None):
+    """Record (payload, error) failures in the local spool and return how many were kept."""
+    kept = delivery.spool_enabled and bool(failures)
+    if kept:
+        url, token = target or (delivery.url, delivery.token)
+        try:
+            with LocalStore() as store:
+                spool.defer(store, url, token, delivery.ssl_verify, failures)
+        except Exception as e:
+            helper.log_error("Could not spool undelivered Gotify messages: {}".format(str(e)))
+            kept = False
+    for payload, _ in failures:
+        _settle(delivery, payload, kept)
+    if not kept:
+        return 0
+    delivery.metrics.incr("spooled", len(failures))
+    if log:
+        helper.log_info("Spooled {} undelivered Gotify message(s) for retry".format(len(failures)))
+    return len(failures)
+
+
+def _drain_spool(helper):
+    """Retry spooled messages now that the Gotify server has accepted a message."""
+    if not LocalStore.exists():
+        # Nothing was ever spooled on this search head
+        return
+    try:
+        with LocalStore() as store:
+            result = spool.drain(store)
+        for error in result.errors:
+            helper.log_error(error)
+        if result.sent or result.failed or result.dropped:
+            helper.log_info("Spool drain finished: {} sent, {} deferred, {} dropped".format(
+                result.sent, result.failed, result.dropped
+            ))
+    except Exception as e:
+        helper.log_error("Could not drain the Gotify delivery spool: {}".format(str(e)))
+
+
+def _coalesce(helper, delivery, payload):
+    """
+    Add payload to the coalescing window of the alert's token.
+
+    Returns the combined payload to send once the window has closed, or None
+    if another alert process sends it.
+    """
+    from .coalesce import collect, combine, join, wait
+    from .throttle import token_key
+
+    key = token_key(delivery.url, delivery.token)
+    member = os.urandom(8).hex()
+    try:
+        # Windows are a single record updated by every alert joining them, which only the
+        # local store's transactions keep intact, so coalescing stays local with shared_state too
+        with LocalStore() as store:
+            closes = join(store, key, payload, delivery.coalesce_window, member)
+    except Exception as e:
+        helper.log_error("Could not coalesce Gotify message, sending it alone: {}".format(str(e)))
+        return payload
+    if closes is None:
+        helper.log_info("Coalesced Gotify message into the notification of another alert")
+        delivery.metrics.incr("coalesced")
+        return None
+
+    with delivery.metrics.span("coalesce"):
+        wait(closes)
+    try:
+        with LocalStore() as store:
+            payloads = collect(store, key, member)
+    except Exception as e:
+        helper.log_error("Could not collect coalesced Gotify messages, sending this one alone: {}".format(str(e)))
+        return payload
+    if not payloads:
+        helper.log_info("Coalescing window was taken over by another alert")
+        return None
+    if len(payloads) > 1:
+        helper.log_info("Sending {} coalesced Gotify messages as one notification".format(len(payloads)))
+    return combine(payloads, delivery.max_message_bytes, delivery.markdown)
+
+
+def _load_limiter(helper, delivery):
+    """Return a concurrency limit starting where the last alert run to the server left off."""
+    from .adaptive import ConcurrencyLimit, load_limit
+
+    try:
+        with LocalStore() as store:
+            return load_limit(store, delivery.url, delivery.workers)
+    except Exception as e:
+        helper.log_error("Could not read adaptive concurrency state: {}".format(str(e)))
+        return ConcurrencyLimit(delivery.workers)
+
+
+def _save_limiter(helper, delivery, limiter):
+    """Keep the learned concurrency limit for the next alert run."""
+    from .adaptive import save_limit
+
+    helper.log_info("Adaptive concurrency for Gotify server {}: {} request(s) in flight (started at {})".format(
+        delivery.url, limiter.current, int(limiter.initial)
+    ))
+    try:
+        with LocalStore() as store:
+            save_limit(store, delivery.url, limiter)
+    except Exception as e:
+        helper.log_error("Could not update adaptive concurrency state: {}".format(str(e)))
+
+
+def _state_store(helper):
+    """
+    Return the store for the delivery state shared by alert processes.
+
+    With shared_state = kvstore this is the KV store state of the alert run,
+    which stays open until _flush_state; otherwise a new LocalStore.
+    """
+    if (helper.get_param("shared_state") or SHARED_STATE_LOCAL) != SHARED_STATE_KVSTORE:
+        return LocalStore()
+    state = helper.__dict__.get(_STATE_ATTRIBUTE)
+    if state is None:
+        from .kvstore import DEFAULT_SERVER_URI, KVStoreClient, KVStoreState
+
+        settings = getattr(helper, "settings", None)
+        server_uri = settings.get("server_uri") if isinstance(settings, dict) else None
+        client = KVStoreClient(server_uri or DEFAULT_SERVER_URI, getattr(helper, "session_key", ""))
+        state = helper.__dict__[_STATE_ATTRIBUTE] = KVStoreState(client, cache=LocalStore(),
+                                                                 on_error=helper.log_error)
+    return state
+
+
+def _flush_state(helper):
+    """Write the changes of the alert run to the KV store, if it was used."""
+    state = helper.__dict__.pop(_STATE_ATTRIBUTE, None)
+    if state is None:
+        return
+    try:
+        state.finish()
+    except Exception as e:
+        helper.log_error("Could not write delivery state to the KV store: {}".format(str(e)))
+
+
+def _breaker_allow(helper, url):
+    """Check the shared circuit breaker; a missing or unreadable store allows delivery."""
+    if helper.get_param("shared_state") != SHARED_STATE_KVSTORE and not LocalStore.exists():
+        return True
+    try:
+        with _state_store(helper) as store:
+            return breaker_allow(store, url)
+    except Exception as e:
+        helper.log_error("Could not read circuit breaker state: {}".format(str(e)))
+        return True
+
+
+def _breaker_record(helper, url, success):
+    """Record a delivery outcome in the shared circuit breaker."""
+    # Successes only need to clear existing state, so skip creating the store for them
+    if success and helper.get_param("shared_state") != SHARED_STATE_KVSTORE and not LocalStore.exists():
+        return
+    try:
+        with _state_store(helper) as store:
+            breaker_record(store, url, success)
+    except Exception as e:
+        helper.log_error("Could not update circuit breaker state: {}".format(str(e)))
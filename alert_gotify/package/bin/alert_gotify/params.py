@@ -0,0 +1,38 @@
+# encoding = utf-8
+"""
+Parsing of optional alert action parameters.
+
+Hidden parameters set in savedsearches.conf arrive as strings (or not at all),
+so every option is parsed with an explicit default.
+"""
+
+FALSE_VALUES = ('0', 'false', 'False', 'FALSE', 'no', 'No', 'NO')
+
+
+def parse_bool(value, default):
+    """Parse an optional boolean parameter."""
+    if value is None or value == "":
+        return default
+    if isinstance(value, str):
+        return value not in FALSE_VALUES
+    return bool(value)
+
+
+def parse_positive_int(value, default):
+    """Parse an optional positive integer parameter."""
+    if value is None or value == "":
+        return default
+    value = int(value)
+    if value < 1:
+        raise ValueError("expected a positive integer, got {}".format(value))
+    return value
+
+
+def parse_non_negative(value, default=0):
+    """Parse an optional non-negative number parameter; 0 disables the feature."""
+    if value is None or value == "":
+        return default
+    value = float(value)
+    if value < 0:
+        raise ValueError("expected a non-negative number, got {}".format(value))
+    return value
@@ -0,0 +1,317 @@
+# encoding = utf-8
+"""
+Bulk replay of Gotify messages from a file.
+
+Reads messages from JSON lines, CSV or a saved Splunk results.csv.gz file and
+sends them through the alert action's delivery engine (pooled workers, rate
+limiting, retries and circuit breaker), in batches. After each batch, the
+offset of the next record is written to a checkpoint file. Messages the
+Gotify server rejects are logged, counted and skipped; the replay stops at
+the first batch with messages that may succeed later, or that delivered
+nothing because every message was rejected (a wrong token, say), so running
+it again resumes with that batch.
+
+The replay resumes on its own, so the spool is off unless enabled with
+--param spool=1; otherwise a failed batch would be both spooled and sent
+again by the next run.
+
+The alert action's rate_limit parameter drops messages over the limit, which
+is right for an alert storm but not for a replay, so the replay paces its own
+sending to --rate-limit instead.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from . import modalert_alert_gotify_helper
+from .metrics import Metrics
+from .params import parse_bool, parse_non_negative
+from .results import read_results
+from .sender import build_payload
+from .templating import compile_template
+from .truncation import DEFAULT_MAX_MESSAGE_BYTES
+
+FORMATS = ("jsonl", "csv", "results")
+
+DEFAULT_MESSAGE = "$result.message$"
+DEFAULT_TITLE = "$result.title$"
+DEFAULT_PRIORITY = 5
+DEFAULT_BATCH_SIZE = 1000
+
+
+def detect_format(path):
+    """Guess the input format from the file name."""
+    name = path.lower()
+    if name.endswith(".gz"):
+        return "results"
+    if name.endswith(".csv"):
+        return "csv"
+    return "jsonl"
+
+
+def read_records(path, fmt, fields):
+    """Yield one mapping per record of the input file."""
+    if fmt == "results":
+        for row in read_results(path, fields):
+            yield row
+        return
+    with open(path, newline="", encoding="utf-8") as records:
+        if fmt == "csv":
+            for row in csv.DictReader(records):
+                yield row
+            return
+        for number, line in enumerate(records, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError("line {}: {}".format(number, str(e)))
+            if not isinstance(record, dict):
+                raise ValueError("line {}: expected a JSON object".format(number))
+            yield record
+
+
+class MessageBuilder(object):
+    """Render records into payloads; records may carry their own priority field."""
+
+    def __init__(self, message, title, priority, max_bytes=DEFAULT_MAX_MESSAGE_BYTES, markdown=False):
+        self.message_template = compile_template(message)
+        self.title_template = compile_template(title)
+        self.priority = int(priority)
+        self.max_bytes = max_bytes
+        self.markdown = markdown
+        self.fields = self.message_template.fields + self.title_template.fields + ("priority",)
+
+    def build(self, record):
+        """Return the payload for a record, or None if it renders an empty message."""
+        message = self.message_template.render(record)
+        if not message:
+            return None
+        priority = record.get("priority")
+        return build_payload(message, self.title_template.render(record),
+                             self.priority if priority in (None, "") else priority, self.max_bytes, self.markdown)
+
+
+class Checkpoint(object):
+    """Offset of the next record to send, kept in a small JSON file."""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = os.path.abspath(source)
+
+    def load(self):
+        """Return the saved offset, or 0 if there is none for this source."""
+        try:
+            with open(self.path) as checkpoint_file:
+                state = json.load(checkpoint_file)
+        except (OSError, ValueError):
+            return 0
+        if state.get("source") != self.source:
+            return 0
+        return int(state.get("offset", 0))
+
+    def save(self, offset):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as checkpoint_file:
+            json.dump({"source": self.source, "offset": offset}, checkpoint_file)
+        os.replace(temporary, self.path)
+
+
+class Pacer(object):
+    """Space messages evenly to stay under a rate in messages per minute."""
+
+    def __init__(self, rate_per_minute, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 60.0 / rate_per_minute
+        self.clock = clock
+        self.sleep = sleep
+        self.next_send = None
+
+    def paced(self, payloads):
+        for payload in payloads:
+            now = self.clock()
+            if self.next_send is not None and now < self.next_send:
+                self.sleep(self.next_send - now)
+                now = self.next_send
+            self.next_send = now + self.interval
+            yield payload
+
+
+class ReplayHelper(object):
+    """Stand-in for the alert action helper with parameters from the command line."""
+
+    def __init__(self, params, verbose=False, stream=None):
+        self.params = params
+        self.verbose = verbose
+        self.stream = stream or sys.stderr
+
+    def get_param(self, name):
+        return self.params.get(name)
+
+    def get_global_setting(self, name):
+        # There are no global settings outside of splunkd; url and token are required
+        return None
+
+    def log_info(self, message):
+        if self.verbose:
+            self.stream.write("INFO {}\n".format(message))
+
+    def log_error(self, message):
+        self.stream.write("ERROR {}\n".format(message))
+
+
+class ReplayResult(object):
+    """Outcome of a replay."""
+
+    def __init__(self, offset):
+        self.offset = offset
+        self.sent = 0
+        self.failed = 0
+        self.spooled = 0
+        self.rejected = 0
+        self.skipped = 0
+        self.held = 0
+        self.status = 0
+
+    def add(self, counters):
+        self.sent += counters.get("sent", 0)
+        self.failed += counters.get("failed", 0)
+        self.spooled += counters.get("spooled", 0)
+        self.rejected += counters.get("rejected", 0)
+        self.held += counters.get("duplicates", 0) + counters.get("rate_limited", 0)
+
+
+def replay(helper, records, builder, offset=0, limit=None, batch_size=DEFAULT_BATCH_SIZE, checkpoint=None,
+           pacer=None):
+    """
+    Send records from offset on, batch by batch, and return a ReplayResult.
+
+    The checkpoint is advanced after each batch whose messages were all
+    delivered, spooled or rejected. The replay stops at the first batch that
+    was not, or that delivered nothing and had messages rejected, leaving
+    result.offset and the checkpoint at the start of that batch.
+    """
+    result = ReplayResult(offset)
+    stop = None if limit is None else offset + limit
+    batch = []
+
+    def flush(next_offset):
+        """Send the batch; returns False if some of its messages may be delivered by sending it again."""
+        if batch:
+            metrics = Metrics()
+            payloads = pacer.paced(batch) if pacer else batch
+            status = modalert_alert_gotify_helper.process_payloads(helper, payloads, "Replay", metrics=metrics)
+            counters = metrics.counters
+            result.add(counters)
+            del batch[:]
+            if status != 0:
+                result.status = status
+                failed = counters.get("failed", 0)
+                rejected = counters.get("rejected", 0)
+                if not failed or failed > rejected + counters.get("spooled", 0):
+                    # Sending the batch again may deliver the rest
+                    return False
+                if rejected and not counters.get("sent"):
+                    # Every message rejected points at the token or server rather than the records
+                    return False
+                if rejected:
+                    helper.log_error("Skipping {} rejected message(s) of records {} to {}".format(
+                        rejected, result.offset, next_offset - 1
+                    ))
+        result.offset = next_offset
+        if checkpoint is not None:
+            checkpoint.save(next_offset)
+        return True
+
+    next_offset = offset
+    for index, record in enumerate(records):
+        if index < offset:
+            continue
+        if stop is not None and index >= stop:
+            break
+        try:
+            payload = builder.build(record)
+        except ValueError as e:
+            raise ValueError("record {}: {}".format(index, str(e)))
+        if payload is None:
+            result.skipped += 1
+        else:
+            batch.append(payload)
+        next_offset = index + 1
+        if len(batch) >= batch_size and not flush(next_offset):
+            return result
+    flush(next_offset)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="alert_gotify_replay.py",
+        description="Send Gotify messages from a JSON lines, CSV or Splunk results.csv.gz file.",
+    )
+    parser.add_argument("path", help="file with one message per record")
+    parser.add_argument("--format", choices=FORMATS, help="input format (default: from the file name)")
+    parser.add_argument("--url", default=os.environ.get("GOTIFY_URL"), help="Gotify server URL ($GOTIFY_URL)")
+    parser.add_argument("--token", default=os.environ.get("GOTIFY_TOKEN"), help="app token ($GOTIFY_TOKEN)")
+    parser.add_argument("--message", default=DEFAULT_MESSAGE,
+                        help="message template rendered against each record (default: %(default)s)")
+    parser.add_argument("--title", default=DEFAULT_TITLE,
+                        help="title template rendered against each record (default: %(default)s)")
+    parser.add_argument("--priority", type=int, default=DEFAULT_PRIORITY,
+                        help="priority of records without a priority field (default: %(default)s)")
+    parser.add_argument("--workers", type=int, help="concurrent connections (default 8)")
+    parser.add_argument("--rate-limit", type=float, help="send at most this many messages per minute")
+    parser.add_argument("--offset", type=int, help="index of the first record to send (default: from the checkpoint)")
+    parser.add_argument("--limit", type=int, help="send at most this many records")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="records sent between checkpoints (default: %(default)s)")
+    parser.add_argument("--checkpoint", help="file recording the offset reached, to resume an interrupted replay")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="any other alert action parameter, such as ca_path=/path/ca.pem or spool=1")
+    parser.add_argument("--verbose", action="store_true", help="log progress to stderr")
+    args = parser.parse_args(argv)
+
+    if not args.url or not args.token:
+        parser.error("--url and --token (or GOTIFY_URL and GOTIFY_TOKEN) are required")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be positive")
+    if args.rate_limit is not None and args.rate_limit <= 0:
+        parser.error("--rate-limit must be positive")
+    # The checkpoint resumes a failed batch, so spooling it too would send it twice
+    params = {"url": args.url, "token": args.token, "spool": "0"}
+    if args.workers is not None:
+        params["workers"] = str(args.workers)
+    for param in args.param:
+        name, separator, value = param.partition("=")
+        if not separator:
+            parser.error("invalid --param '{}', expected NAME=VALUE".format(param))
+        params[name.strip()] = value
+
+    checkpoint = Checkpoint(args.checkpoint, args.path) if args.checkpoint else None
+    offset = args.offset
+    if offset is None:
+        offset = checkpoint.load() if checkpoint else 0
+
+    try:
+        max_bytes = int(parse_non_negative(params.get("max_message_bytes"), DEFAULT_MAX_MESSAGE_BYTES))
+        markdown = parse_bool(params.get("markdown"), False)
+    except ValueError as e:
+        parser.error("invalid --param: {}".format(str(e)))
+
+    helper = ReplayHelper(params, verbose=args.verbose)
+    builder = MessageBuilder(args.message, args.title, args.priority, max_bytes, markdown)
+    fmt = args.format or detect_format(args.path)
+    try:
+        result = replay(helper, read_records(args.path, fmt, builder.fields), builder, offset=offset,
+                        limit=args.limit, batch_size=args.batch_size, checkpoint=checkpoint,
+                        pacer=Pacer(args.rate_limit) if args.rate_limit else None)
+    except (OSError, ValueError) as e:
+        helper.log_error("Replay of {} failed: {}".format(args.path, str(e)))
+        return 1
+    print("action=replay sent={} failed={} spooled={} rejected={} held={} skipped={} offset={}".format(
+        result.sent, result.failed, result.spooled, result.rejected, result.held, result.skipped, result.offset
+    ))
+    return result.status
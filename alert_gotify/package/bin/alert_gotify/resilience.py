@@ -0,0 +1,148 @@
+# encoding = utf-8
+"""
+Timeouts, retries and a shared circuit breaker for requests to Gotify.
+
+The circuit breaker state is kept in the local store, so once a server has
+failed repeatedly every alert process on the search head fails fast (and
+spools its message) instead of waiting out its own timeouts.
+"""
+import random
+import time
+
+import requests
+
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 15.0
+
+DEFAULT_RETRIES = 2
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 5.0
+
+# Consecutive failed deliveries that open the breaker, and how long it stays open
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 60
+
+BREAKER_NAMESPACE = "breaker"
+
+
+def backoff_sleep(seconds):
+    """Wait before a retry; RetryPolicy looks this up on each retry, so it can be replaced on its own."""
+    time.sleep(seconds)
+
+
+def is_retryable_status(status_code):
+    """True for responses that may succeed when sent again later."""
+    return status_code == 429 or status_code >= 500
+
+
+def parse_timeout(connect, read):
+    """Parse the connect_timeout and read_timeout parameters into a requests timeout."""
+    connect = DEFAULT_CONNECT_TIMEOUT if connect is None or connect == "" else float(connect)
+    read = DEFAULT_READ_TIMEOUT if read is None or read == "" else float(read)
+    if connect <= 0 or read <= 0:
+        raise ValueError("timeouts must be positive")
+    return (connect, read)
+
+
+def parse_retries(value):
+    """Parse the retries parameter."""
+    if value is None or value == "":
+        return DEFAULT_RETRIES
+    value = int(value)
+    if value < 0:
+        raise ValueError("retries must not be negative")
+    return value
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header given in seconds, or return None."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy(object):
+    """Retry connection errors, timeouts, 429 and 5xx responses with jittered backoff."""
+
+    def __init__(self, retries=DEFAULT_RETRIES, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY, sleep=None, on_retry=None):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Defaults to backoff_sleep
+        self.sleep = sleep
+        # Called with the delay before each retry, e.g. to count retries
+        self.on_retry = on_retry
+
+    def delay(self, attempt, retry_after=None):
+        """Return the delay before retry number attempt (0-based)."""
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def run(self, send):
+        """Call send() until it returns a non-retryable response or retries run out."""
+        attempt = 0
+        while True:
+            try:
+                response = send()
+            except requests.exceptions.SSLError:
+                raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.retries:
+                    raise
+                delay = self.delay(attempt)
+            else:
+                if attempt >= self.retries or not is_retryable_status(response.status_code):
+                    return response
+                delay = self.delay(attempt, parse_retry_after(response.headers.get("Retry-After")))
+            if self.on_retry is not None:
+                self.on_retry(delay)
+            (self.sleep or backoff_sleep)(delay)
+            attempt += 1
+
+
+def breaker_allow(store, key, now=None):
+    """
+    Return True if a request to the server identified by key may be attempted.
+
+    After the cooldown one caller is let through as a probe; the breaker stays
+    open for everyone else until the probe's outcome is recorded.
+    """
+    now = time.time() if now is None else now
+    state = store.kv_get(BREAKER_NAMESPACE, key, now)
+    if not state or state["opened_until"] is None:
+        return True
+
+    decision = []
+
+    def update(state):
+        if not state or state["opened_until"] is None:
+            decision.append(True)
+            return state
+        if now < state["opened_until"]:
+            decision.append(False)
+            return state
+        decision.append(True)
+        state["opened_until"] = now + BREAKER_COOLDOWN
+        return state
+
+    store.kv_update(BREAKER_NAMESPACE, key, update, now)
+    return decision[0]
+
+
+def breaker_record(store, key, success, now=None):
+    """Record the outcome of a delivery attempt to the server identified by key."""
+    now = time.time() if now is None else now
+
+    def update(state):
+        if success:
+            return None
+        state = state or {"failures": 0, "opened_until": None}
+        state["failures"] += 1
+        if state["failures"] >= BREAKER_THRESHOLD:
+            state["opened_until"] = now + BREAKER_COOLDOWN
+        return state
+
+    return store.kv_update(BREAKER_NAMESPACE, key, update, now)
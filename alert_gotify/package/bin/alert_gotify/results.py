@@ -0,0 +1,81 @@
+# encoding = utf-8
+"""
+Streaming, column-projected reader for the alert's results file.
+
+UCC's get_events() builds a dict of every column for every row. Splunk
+results files carry many columns (_raw, multivalue __mv_ columns and so on)
+of which a message template references only a few, so this reader
+decompresses the file incrementally, keeps only the referenced columns and
+yields small ResultRow objects instead.
+"""
+import csv
+import gzip
+import os
+
+
+class ResultRow(object):
+    """One result row restricted to the projected columns; supports get() like a dict."""
+
+    __slots__ = ("_index", "_values")
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def get(self, name, default=None):
+        position = self._index.get(name)
+        if position is None:
+            return default
+        return self._values[position]
+
+    def __getitem__(self, name):
+        position = self._index.get(name)
+        if position is None:
+            raise KeyError(name)
+        return self._values[position]
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def keys(self):
+        return self._index.keys()
+
+    def __repr__(self):
+        return "ResultRow({!r})".format(dict((name, self._values[i]) for name, i in self._index.items()))
+
+
+def read_results(path, fields):
+    """
+    Yield a ResultRow per row of a gzipped CSV results file.
+
+    Only the columns in fields are kept; fields that are not columns of the
+    file are absent from every row.
+    """
+    with gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="") as results_file:
+        reader = csv.reader(results_file)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = dict((name, position) for position, name in enumerate(header))
+        wanted = [name for name in dict.fromkeys(fields) if name in columns]
+        index = dict((name, i) for i, name in enumerate(wanted))
+        positions = [columns[name] for name in wanted]
+        width = len(header)
+
+        for row in reader:
+            if len(row) < width:
+                # Short rows leave trailing columns empty, as csv.DictReader does
+                row.extend([None] * (width - len(row)))
+            yield ResultRow(index, tuple([row[position] for position in positions]))
+
+
+def iter_results(helper, fields):
+    """
+    Return the alert's results, reading only the given fields when possible.
+
+    Falls back to helper.get_events() when there is no results file to read.
+    """
+    path = getattr(helper, "results_file", None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return read_results(path, fields)
+    return helper.get_events()
@@ -0,0 +1,150 @@
+# encoding = utf-8
+"""
+Routing of results to Gotify targets by a CSV lookup.
+
+Each row of the lookup maps values of some result fields (such as team,
+service or severity) to a Gotify url and token. Empty cells, or *, match
+any value. Rows are compiled into one hash index per combination of
+fields they match on, so routing a result costs one dictionary lookup per
+combination, most specific first, however many rows the table has.
+
+Compiled tables are kept in memory and in the local store, keyed on the
+lookup's path and invalidated when its modification time or size changes.
+"""
+import csv
+import os
+import time
+
+from .fanout import Target
+from .store import APP_DIR
+
+NAMESPACE = "routes"
+
+# Compiled tables of lookups that have not been used for a week are dropped
+STATE_TTL = 7 * 24 * 3600
+
+TARGET_COLUMNS = ("url", "token")
+WILDCARDS = ("", "*")
+KEY_SEPARATOR = "\x1f"
+
+# Compiled tables by path, with the (mtime, size) they were compiled from
+_compiled = {}
+
+
+def resolve_path(path):
+    """Resolve a lookup path; relative paths are taken from the app's lookups directory."""
+    path = os.path.expanduser(path)
+    if os.path.isabs(path):
+        return path
+    return os.path.join(APP_DIR, "lookups", path)
+
+
+class RoutingTable(object):
+    """Hash indexes from result field values to the targets of the matching rows."""
+
+    def __init__(self, fields, rules, patterns):
+        # Result fields the table matches on
+        self.fields = tuple(fields)
+        # (url, token) of each row; empty strings stand for the alert's own
+        self.rules = [tuple(rule) for rule in rules]
+        # [(field positions, {joined values: [rule indexes]})], most specific first
+        self.patterns = [(tuple(positions), index) for positions, index in patterns]
+
+    def as_dict(self):
+        return {"fields": list(self.fields), "rules": [list(rule) for rule in self.rules],
+                "patterns": [[list(positions), index] for positions, index in self.patterns]}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state["fields"], state["rules"], state["patterns"])
+
+    def bind(self, url, token):
+        """Return a Router sending to the alert's url and token where rows leave them empty."""
+        return Router(self, [Target(rule_url or url, rule_token or token) for rule_url, rule_token in self.rules])
+
+
+class Router(object):
+    """Route results through a RoutingTable to Target lists."""
+
+    def __init__(self, table, rule_targets):
+        self.fields = table.fields
+        self.patterns = table.patterns
+        self.rule_targets = rule_targets
+        self.targets = list(dict.fromkeys(rule_targets))
+
+    def route(self, result):
+        """Return the targets of the most specific rows matching result, or None."""
+        values = [result.get(name) for name in self.fields]
+        values = ["" if value is None else str(value) for value in values]
+        for positions, index in self.patterns:
+            rules = index.get(KEY_SEPARATOR.join([values[position] for position in positions]))
+            if rules is not None:
+                return list(dict.fromkeys(self.rule_targets[rule] for rule in rules))
+        return None
+
+
+def compile_routes(path):
+    """
+    Read a routing lookup into a RoutingTable.
+
+    Raises ValueError for a lookup without url or token and match columns,
+    or with an invalid row.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as lookup:
+        reader = csv.reader(lookup)
+        header = [name.strip() for name in next(reader, [])]
+        if not any(name in TARGET_COLUMNS for name in header):
+            raise ValueError("routing table {} has no url or token column".format(path))
+        fields = [name for name in header if name and name not in TARGET_COLUMNS]
+        if not fields:
+            raise ValueError("routing table {} has no columns to match results on".format(path))
+        columns = dict((name, position) for position, name in enumerate(header))
+
+        rules = []
+        indexes = {}
+        for number, row in enumerate(reader, 2):
+            if not any(cell.strip() for cell in row):
+                continue
+            row = [cell.strip() for cell in row] + [""] * (len(header) - len(row))
+            url, token = [row[columns[name]] if name in columns else "" for name in TARGET_COLUMNS]
+            if not url and not token:
+                raise ValueError("routing table {} line {}: no url or token".format(path, number))
+            if url and not url.lower().startswith(("http://", "https://")):
+                raise ValueError("routing table {} line {}: invalid url '{}'".format(path, number, url))
+            values = [row[columns[name]] for name in fields]
+            positions = tuple(i for i, value in enumerate(values) if value not in WILDCARDS)
+            key = KEY_SEPARATOR.join([values[i] for i in positions])
+            indexes.setdefault(positions, {}).setdefault(key, []).append(len(rules))
+            rules.append((url, token))
+
+    # More fields matched is more specific; ties keep the order of the lookup
+    order = sorted(indexes, key=lambda positions: -len(positions))
+    return RoutingTable(fields, rules, [(positions, indexes[positions]) for positions in order])
+
+
+def load_routes(path, store=None, now=None):
+    """
+    Return the compiled RoutingTable of a lookup, recompiling it only when the file changed.
+
+    Raises OSError if the lookup cannot be read and ValueError if it is invalid.
+    """
+    path = os.path.abspath(resolve_path(path))
+    stat = os.stat(path)
+    stamp = [stat.st_mtime_ns, stat.st_size]
+    cached = _compiled.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    now = time.time() if now is None else now
+    table = None
+    if store is not None:
+        state = store.kv_get(NAMESPACE, path, now)
+        if state is not None and state["stamp"] == stamp:
+            table = RoutingTable.from_dict(state["table"])
+    if table is None:
+        table = compile_routes(path)
+        if store is not None:
+            state = {"stamp": stamp, "table": table.as_dict()}
+            store.kv_update(NAMESPACE, path, lambda old: state, now, ttl=STATE_TTL)
+    _compiled[path] = (stamp, table)
+    return table
@@ -0,0 +1,337 @@
+# encoding = utf-8
+"""
+Pooled, concurrent delivery of Gotify messages.
+
+A single keep-alive requests.Session is shared by a bounded thread pool so
+that one alert process can send many messages without paying a TCP/TLS
+handshake per message.
+"""
+import gzip
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import TimedConnections
+from .resilience import (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, RetryPolicy, is_retryable_status,
+                         parse_retry_after)
+from .tls import TLSAdapter
+from .truncation import truncate_message
+
+
+DEFAULT_WORKERS = 8
+MAX_WORKERS = 32
+
+# Number of error descriptions kept for logging; the rest are only counted
+MAX_REPORTED_ERRORS = 10
+
+# Smaller bodies are sent uncompressed; gzip would barely shrink them
+COMPRESS_MIN_BYTES = 1024
+
+GZIP_HEADERS = {"Content-Encoding": "gzip"}
+
+# Gotify extras asking clients to render the message as markdown
+MARKDOWN_EXTRAS = {"client::display": {"contentType": "text/markdown"}}
+
+
+@lru_cache(maxsize=64)
+def build_message_url(url):
+    """Return the /message endpoint for a Gotify base URL."""
+    if url.endswith("/"):
+        url = url[:-1]
+    return url + "/message"
+
+
+@lru_cache(maxsize=64)
+def build_headers(token):
+    """Return the request headers for a Gotify app token. The dict is shared; do not modify it."""
+    return {
+        'X-Gotify-Key': token,
+        'accept': 'application/json',
+        'Content-Type': 'application/json'
+    }
+
+
+def build_payload(message, title, priority, max_bytes=None, markdown=False):
+    """
+    Return the JSON payload for a single Gotify message.
+
+    Messages longer than max_bytes are truncated; markdown messages carry
+    the extras that make clients render them as markdown.
+    """
+    payload = Payload()
+    payload['message'] = truncate_message(message, max_bytes, markdown)
+    payload['priority'] = int(priority)
+    if title:
+        payload['title'] = title
+    if markdown:
+        payload['extras'] = MARKDOWN_EXTRAS
+    return payload
+
+
+class Payload(dict):
+    """
+    A message payload that remembers its serialized JSON body.
+
+    The body is encoded at most once, however many targets or retries the
+    payload is sent to, and is discarded if the payload is modified.
+    """
+
+    __slots__ = ("_body",)
+
+    def __init__(self, *args, **kwargs):
+        super(Payload, self).__init__(*args, **kwargs)
+        self._body = None
+
+    @property
+    def body(self):
+        if self._body is None:
+            self._body = json.dumps(self).encode("ascii")
+        return self._body
+
+    def __setitem__(self, key, value):
+        self._body = None
+        super(Payload, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._body = None
+        super(Payload, self).__delitem__(key)
+
+    def update(self, *args, **kwargs):
+        self._body = None
+        super(Payload, self).update(*args, **kwargs)
+
+    def __reduce__(self):
+        return (Payload, (dict(self),))
+
+
+class PayloadBuilder(object):
+    """
+    Build payloads for one alert configuration.
+
+    The JSON body around the rendered message and title is prepared once, and
+    fully static payloads are serialized only once, so building a payload per
+    result costs two renders and two string escapes.
+    """
+
+    def __init__(self, message_template, title_template, priority, max_bytes=None, markdown=False):
+        self.message_template = message_template
+        self.title_template = title_template
+        self.priority = int(priority)
+        self.max_bytes = max_bytes
+        self.markdown = markdown
+        self._priority_json = ', "priority": {}'.format(self.priority)
+        self._extras_json = ', "extras": {}'.format(json.dumps(MARKDOWN_EXTRAS)) if markdown else ""
+        self._static = None
+        if message_template.is_static and title_template.is_static:
+            self._static = build_payload(message_template.source, title_template.source, self.priority,
+                                         max_bytes, markdown)
+            self._static.body
+
+    def build(self, result):
+        if self._static is not None:
+            payload = Payload(self._static)
+            payload._body = self._static._body
+            return payload
+        message = truncate_message(self.message_template.render(result), self.max_bytes, self.markdown)
+        title = self.title_template.render(result)
+        payload = Payload()
+        payload['message'] = message
+        payload['priority'] = self.priority
+        # Same escaping as json.dumps with ensure_ascii
+        parts = ['{"message": ', encode_basestring_ascii(message), self._priority_json]
+        if title:
+            payload['title'] = title
+            parts.extend((', "title": ', encode_basestring_ascii(title)))
+        if self.markdown:
+            payload['extras'] = MARKDOWN_EXTRAS
+            parts.append(self._extras_json)
+        parts.append("}")
+        payload._body = "".join(parts).encode("ascii")
+        return payload
+
+
+def compressed_body(payload):
+    """Return the requests keyword arguments posting payload, gzipped if it is large enough to gain."""
+    body = payload.body if isinstance(payload, Payload) else json.dumps(payload).encode("ascii")
+    if len(body) < COMPRESS_MIN_BYTES:
+        return {"data": body}
+    return {"data": gzip.compress(body, compresslevel=6), "headers": GZIP_HEADERS}
+
+
+def parse_workers(value):
+    """Parse the workers parameter, clamped to 1..MAX_WORKERS."""
+    if value is None or value == "":
+        return DEFAULT_WORKERS
+    return max(1, min(MAX_WORKERS, int(value)))
+
+
+class DeliveryError(object):
+    """Why a message was not delivered, and whether retrying may help."""
+
+    __slots__ = ("description", "retryable")
+
+    def __init__(self, description, retryable):
+        self.description = description
+        self.retryable = retryable
+
+    def __str__(self):
+        return self.description
+
+
+class SendResult(object):
+    """Outcome of sending a batch of messages."""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.errors = []
+
+    def record_error(self, error):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(str(error))
+
+
+class TimedHTTPAdapter(TimedConnections, HTTPAdapter):
+    """HTTPAdapter whose connections report their setup time to the active Metrics."""
+
+
+class TimedTLSAdapter(TimedConnections, TLSAdapter):
+    """TLSAdapter whose connections report their setup and handshake time to the active Metrics."""
+
+
+def new_session(workers=1):
+    """Return a requests session for Gotify with timed, pooled connections."""
+    session = requests.Session()
+    session.mount("http://", TimedHTTPAdapter(pool_connections=1, pool_maxsize=workers))
+    session.mount("https://", TimedTLSAdapter(pool_connections=1, pool_maxsize=workers))
+    return session
+
+
+def post_message(url, **kwargs):
+    """Send one request like requests.post, on a new session from new_session()."""
+    with new_session() as session:
+        return session.post(url, **kwargs)
+
+
+class GotifySender(object):
+    """Send messages to one Gotify server through a shared keep-alive session."""
+
+    def __init__(self, url, token, ssl_verify=True, workers=DEFAULT_WORKERS, timeout=None, retry=None,
+                 metrics=None, stream=None, limiter=None, compress=False):
+        self.url = url
+        self.message_url = build_message_url(url)
+        self.workers = workers
+        self.timeout = timeout or (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+        self.retry = retry or RetryPolicy()
+        self.metrics = metrics
+        # StreamWatcher timing how long accepted messages take to reach clients
+        self.stream = stream
+        # ConcurrencyLimit adapting the requests in flight to the server's responses
+        self.limiter = limiter
+        # Gzip large request bodies, for servers or proxies that accept Content-Encoding: gzip
+        self.compress = compress
+
+        self.session = new_session(workers)
+        self.session.headers.update(build_headers(token))
+        self.ssl_verify = ssl_verify
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, payload):
+        """Send one payload and return the response."""
+        post = self.session.post
+        if self.metrics is not None:
+            post = self.metrics.timed(post)
+        # Passed per request: a session-level verify=False is overridden by REQUESTS_CA_BUNDLE
+        if self.compress:
+            kwargs = compressed_body(payload)
+        elif isinstance(payload, Payload):
+            # The session already sends Content-Type: application/json
+            kwargs = {"data": payload.body}
+        else:
+            kwargs = {"json": payload}
+        if self.limiter is None:
+            return post(self.message_url, timeout=self.timeout, verify=self.ssl_verify, **kwargs)
+
+        started = time.monotonic()
+        try:
+            response = post(self.message_url, timeout=self.timeout, verify=self.ssl_verify, **kwargs)
+        except requests.exceptions.SSLError:
+            # Certificate problems say nothing about the server's load
+            raise
+        except requests.exceptions.RequestException:
+            self.limiter.record(time.monotonic() - started)
+            raise
+        self.limiter.record(time.monotonic() - started, response.status_code,
+                            parse_retry_after(response.headers.get("Retry-After")))
+        return response
+
+    def deliver(self, payload):
+        """Send one payload with retries and return None or a DeliveryError."""
+        started = time.monotonic()
+        try:
+            response = self.retry.run(lambda: self.send(payload))
+        except requests.exceptions.SSLError as e:
+            return DeliveryError("SSL error: {}".format(str(e)), retryable=False)
+        except requests.exceptions.RequestException as e:
+            return DeliveryError("Request error: {}".format(str(e)), retryable=True)
+        if response.status_code != 200:
+            return DeliveryError(
+                "Status code: {}, Response: {}".format(response.status_code, response.text),
+                retryable=is_retryable_status(response.status_code)
+            )
+        if self.stream is not None:
+            self.stream.sent(response, started)
+        return None
+
+    def send_many(self, payloads, on_result=None):
+        """
+        Send every payload from an iterable using the worker pool.
+
+        The iterable is consumed lazily with at most twice the worker count
+        in flight, so large result sets are never materialized in memory.
+        With a limiter, the number in flight follows its current limit instead.
+        If given, on_result(index, payload, error) is called from the calling
+        thread once per payload, with error None on success.
+        """
+        result = SendResult()
+        max_pending = self.workers * 2
+        pending = {}
+
+        def collect(done):
+            for future in done:
+                index, payload = pending.pop(future)
+                error = future.result()
+                if error is None:
+                    result.sent += 1
+                else:
+                    result.record_error(error)
+                if on_result is not None:
+                    on_result(index, payload, error)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for index, payload in enumerate(payloads):
+                while len(pending) >= (max_pending if self.limiter is None else self.limiter.current):
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                if self.limiter is not None:
+                    self.limiter.wait_ready()
+                pending[executor.submit(self.deliver, payload)] = (index, payload)
+            if pending:
+                done, _ = wait(pending)
+                collect(done)
+
+        return result
@@ -0,0 +1,130 @@
+# encoding = utf-8
+"""
+Resolution and caching of the add-on's global settings.
+
+Global settings are resolved at most once per alert process. When the
+settings_cache_ttl parameter is set they are also cached in the local store,
+so later alert processes skip the splunkd REST round-trips entirely. The cache
+is invalidated when the settings or password configuration files change.
+
+The app token is only written to the cache encrypted, with a key derived from
+Splunk's splunk.secret. If the cryptography package or splunk.secret is not
+available, only the URL is cached and the token is resolved through splunkd.
+"""
+import base64
+import hashlib
+import os
+import time
+
+from .params import parse_non_negative
+
+SETTINGS = ("gotify_url", "gotify_token")
+SECRET_SETTINGS = ("gotify_token",)
+
+CACHE_NAMESPACE = "settings"
+CACHE_KEY = "global"
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Configuration files whose changes invalidate the cache
+WATCHED_FILES = (
+    os.path.join("default", "alert_gotify_settings.conf"),
+    os.path.join("local", "alert_gotify_settings.conf"),
+    os.path.join("local", "passwords.conf"),
+)
+
+_MEMO_ATTRIBUTE = "_alert_gotify_settings"
+
+
+def get_global_setting(helper, name):
+    """Return a global setting, resolving it at most once for this helper."""
+    memo = helper.__dict__.setdefault(_MEMO_ATTRIBUTE, {})
+    if name not in memo:
+        try:
+            ttl = parse_non_negative(helper.get_param("settings_cache_ttl"))
+        except ValueError:
+            helper.log_error("Invalid settings_cache_ttl, settings will not be cached")
+            ttl = 0
+        if ttl and name in SETTINGS:
+            memo.update(_load_cached(helper, ttl))
+        else:
+            memo[name] = helper.get_global_setting(name)
+    return memo[name]
+
+
+def config_fingerprint():
+    """Return a fingerprint of the modification times of the watched files."""
+    parts = []
+    for relative in WATCHED_FILES:
+        try:
+            parts.append("{}:{}".format(relative, os.stat(os.path.join(APP_DIR, relative)).st_mtime_ns))
+        except OSError:
+            parts.append("{}:-".format(relative))
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def token_cipher():
+    """Return a Fernet cipher keyed from splunk.secret, or None if unavailable."""
+    try:
+        from cryptography.fernet import Fernet
+    except ImportError:
+        return None
+    secret_path = os.path.join(os.environ.get("SPLUNK_HOME", ""), "etc", "auth", "splunk.secret")
+    try:
+        with open(secret_path, "rb") as secret_file:
+            secret = secret_file.read().strip()
+    except OSError:
+        return None
+    if not secret:
+        return None
+    key = hashlib.sha256(b"alert_gotify settings cache\0" + secret).digest()
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def _load_cached(helper, ttl):
+    """Return all cacheable settings, from the local store when still valid."""
+    from .store import LocalStore
+
+    now = time.time()
+    fingerprint = config_fingerprint()
+    cipher = token_cipher()
+    try:
+        with LocalStore() as store:
+            values = _decode(store.kv_get(CACHE_NAMESPACE, CACHE_KEY, now), fingerprint, cipher)
+            if values is None:
+                values = dict((name, helper.get_global_setting(name)) for name in SETTINGS)
+                store.kv_update(CACHE_NAMESPACE, CACHE_KEY, lambda old: _encode(values, fingerprint, cipher),
+                                now, ttl=ttl)
+    except Exception as e:
+        helper.log_error("Could not use the settings cache: {}".format(str(e)))
+        values = {}
+
+    # Secrets that could not be cached are still resolved through splunkd
+    for name in SETTINGS:
+        if name not in values:
+            values[name] = helper.get_global_setting(name)
+    return values
+
+
+def _encode(values, fingerprint, cipher):
+    entry = {"fingerprint": fingerprint, "values": {}, "encrypted": {}}
+    for name, value in values.items():
+        if name not in SECRET_SETTINGS or value is None:
+            entry["values"][name] = value
+        elif cipher is not None:
+            entry["encrypted"][name] = cipher.encrypt(value.encode("utf-8")).decode("ascii")
+    return entry
+
+
+def _decode(entry, fingerprint, cipher):
+    """Return the cached values, or None when the entry is missing or stale."""
+    if not entry or entry.get("fingerprint") != fingerprint:
+        return None
+    values = dict(entry["values"])
+    if cipher is not None:
+        for name, token in entry["encrypted"].items():
+            try:
+                values[name] = cipher.decrypt(token.encode("ascii")).decode("utf-8")
+            except Exception:
+                pass
+    return values
@@ -0,0 +1,102 @@
+# encoding = utf-8
+"""
+Durable delivery spool for messages that could not be sent.
+
+Messages that fail with a retryable error are written to the local store and
+retried in bulk with exponential backoff, either by the next alert process
+that reaches the Gotify server or by the alert_gotify_spool scripted input.
+"""
+import random
+import time
+from collections import defaultdict
+
+from .resilience import breaker_allow, breaker_record
+from .sender import MAX_REPORTED_ERRORS, GotifySender
+
+# Backoff between attempts: BASE_DELAY doubling up to MAX_DELAY, with jitter
+BASE_DELAY = 30
+MAX_DELAY = 3600
+
+# Messages are abandoned after this many attempts or this many seconds
+MAX_ATTEMPTS = 12
+MAX_AGE = 24 * 3600
+
+# Limits for one drain pass
+DRAIN_LIMIT = 200
+DRAIN_LEASE = 300
+
+
+def backoff_delay(attempts):
+    """Return the jittered delay before the next attempt."""
+    delay = min(MAX_DELAY, BASE_DELAY * (2 ** (attempts - 1)))
+    return random.uniform(delay / 2.0, delay)
+
+
+def defer(store, url, token, ssl_verify, failures, now=None):
+    """Record (payload, error) messages that failed their first attempt."""
+    now = time.time() if now is None else now
+    entries = [(payload, str(error), now + backoff_delay(1)) for payload, error in failures]
+    if entries:
+        store.spool_add(url, token, ssl_verify, entries, now)
+
+
+class DrainResult(object):
+    """Outcome of a drain pass."""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.errors = []
+
+
+def drain(store, limit=DRAIN_LIMIT, workers=4, now=None):
+    """Retry due messages from the spool and return a DrainResult."""
+    now = time.time() if now is None else now
+    result = DrainResult()
+    # Most runs find nothing due, so check that before taking the write lock to claim
+    if not store.spool_due(now):
+        return result
+    items = store.spool_claim(now, limit, DRAIN_LEASE)
+    if not items:
+        return result
+
+    targets = defaultdict(list)
+    for item in items:
+        targets[(item.url, item.token, item.ssl_verify)].append(item)
+
+    finished = []
+    rescheduled = []
+    for (url, token, ssl_verify), group in targets.items():
+        # Leave messages for an unavailable server leased until its breaker closes
+        if not breaker_allow(store, url, now):
+            result.failed += len(group)
+            continue
+
+        def on_result(index, payload, error, group=group):
+            item = group[index]
+            if error is None:
+                result.sent += 1
+                finished.append(item.id)
+                return
+            attempts = item.attempts + 1
+            if not error.retryable or attempts >= MAX_ATTEMPTS or now - item.created >= MAX_AGE:
+                result.dropped += 1
+                if len(result.errors) < MAX_REPORTED_ERRORS:
+                    result.errors.append("Dropped spooled message after {} attempts: {}".format(attempts, error))
+                finished.append(item.id)
+            else:
+                result.failed += 1
+                rescheduled.append((item.id, attempts, now + backoff_delay(attempts), str(error)))
+
+        failed_before = result.failed
+        with GotifySender(url, token, ssl_verify=ssl_verify, workers=min(workers, len(group))) as sender:
+            outcome = sender.send_many([item.payload for item in group], on_result=on_result)
+        if outcome.sent:
+            breaker_record(store, url, True, now)
+        elif result.failed > failed_before:
+            breaker_record(store, url, False, now)
+
+    store.spool_delete(finished)
+    store.spool_reschedule(rescheduled)
+    return result
@@ -0,0 +1,220 @@
+# encoding = utf-8
+"""
+Local state shared by alert action processes on this search head.
+
+State lives in a SQLite database under the app's local directory. SQLite's
+file locking makes it safe for the many short-lived alert processes that may
+run concurrently, and WAL mode keeps readers from blocking the writer.
+"""
+import json
+import os
+import sqlite3
+from collections import namedtuple
+from contextlib import contextmanager
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Overrides the state directory, mainly for tests and the replay CLI
+STATE_DIR_ENV = "ALERT_GOTIFY_STATE_DIR"
+
+DB_NAME = "alert_gotify.db"
+
+# Seconds to wait for another process holding the database lock
+BUSY_TIMEOUT = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS spool (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    next_attempt REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    url TEXT NOT NULL,
+    token TEXT NOT NULL,
+    ssl_verify INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS spool_next_attempt ON spool (next_attempt);
+CREATE TABLE IF NOT EXISTS kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires REAL,
+    PRIMARY KEY (namespace, key)
+);
+"""
+
+SpoolItem = namedtuple("SpoolItem", "id created attempts url token ssl_verify payload")
+
+
+def _verify_column(ssl_verify):
+    # A CA path is kept as text; SQLite stores it as is in the INTEGER column
+    if isinstance(ssl_verify, str):
+        return ssl_verify
+    return int(bool(ssl_verify))
+
+
+def _verify_value(column):
+    if isinstance(column, str):
+        return column
+    return bool(column)
+
+
+def default_state_dir():
+    """Return the directory holding shared alert action state."""
+    return os.environ.get(STATE_DIR_ENV) or os.path.join(APP_DIR, "local", "data")
+
+
+def default_db_path():
+    """Return the path of the shared state database."""
+    return os.path.join(default_state_dir(), DB_NAME)
+
+
+class LocalStore(object):
+    """SQLite-backed store for state shared between alert processes."""
+
+    def __init__(self, path=None):
+        if path is None:
+            state_dir = default_state_dir()
+            if not os.path.isdir(state_dir):
+                os.makedirs(state_dir, mode=0o700, exist_ok=True)
+            path = default_db_path()
+        self.path = path
+
+        # The spool holds app tokens, so keep the database private to the owner
+        created = not os.path.exists(path)
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        if created:
+            os.chmod(path, 0o600)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    @staticmethod
+    def exists():
+        """True if shared state has been written on this search head."""
+        return os.path.exists(default_db_path())
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def transaction(self):
+        """Run statements in a write transaction that excludes other processes."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def spool_add(self, url, token, ssl_verify, entries, created):
+        """Record undelivered messages given as (payload, error, next_attempt) entries."""
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO spool (created, next_attempt, attempts, url, token, ssl_verify, payload, last_error) "
+                "VALUES (?, ?, 1, ?, ?, ?, ?, ?)",
+                [
+                    (created, next_attempt, url, token, _verify_column(ssl_verify), json.dumps(payload), error)
+                    for payload, error, next_attempt in entries
+                ]
+            )
+
+    def spool_due(self, now):
+        """True if some message is due for another attempt; a read that takes no write lock."""
+        return self.conn.execute("SELECT 1 FROM spool WHERE next_attempt <= ? LIMIT 1", (now,)).fetchone() is not None
+
+    def spool_claim(self, now, limit, lease):
+        """
+        Claim up to limit messages that are due for another attempt.
+
+        Claimed messages are hidden from other drainers for lease seconds, so
+        concurrent processes never send the same message twice.
+        """
+        with self.transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, created, attempts, url, token, ssl_verify, payload FROM spool "
+                "WHERE next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE spool SET next_attempt = ? WHERE id = ?",
+                    [(now + lease, row[0]) for row in rows]
+                )
+        return [
+            SpoolItem(row[0], row[1], row[2], row[3], row[4], _verify_value(row[5]), json.loads(row[6]))
+            for row in rows
+        ]
+
+    def spool_delete(self, ids):
+        """Remove delivered or abandoned messages."""
+        if not ids:
+            return
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM spool WHERE id = ?", [(item_id,) for item_id in ids])
+
+    def spool_reschedule(self, updates):
+        """Apply (id, attempts, next_attempt, error) updates after failed attempts."""
+        if not updates:
+            return
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE spool SET attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                [(attempts, next_attempt, error, item_id) for item_id, attempts, next_attempt, error in updates]
+            )
+
+    def spool_size(self):
+        """Return the number of undelivered messages."""
+        return self.conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def kv_get(self, namespace, key, now):
+        """Return the unexpired JSON value stored under namespace/key, or None."""
+        row = self.conn.execute(
+            "SELECT value, expires FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return None
+        return json.loads(row[0])
+
+    def kv_update(self, namespace, key, update, now, ttl=None, keep_expiry=False):
+        """
+        Atomically replace the value under namespace/key with update(old_value).
+
+        Expired values are passed to update as None. Returning None deletes the
+        entry. The new value expires after ttl seconds when ttl is given, unless
+        keep_expiry is set and an unexpired entry already exists.
+        """
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT value, expires FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            old = None
+            if row is not None and (row[1] is None or row[1] > now):
+                old = json.loads(row[0])
+            new = update(old)
+            if new is None:
+                if row is not None:
+                    conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+            else:
+                if keep_expiry and old is not None:
+                    expires = row[1]
+                else:
+                    expires = None if ttl is None else now + ttl
+                conn.execute(
+                    "INSERT OR REPLACE INTO kv (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+                    (namespace, key, json.dumps(new), expires)
+                )
+        return new
+
+    def kv_purge(self, now):
+        """Delete expired entries."""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (now,))
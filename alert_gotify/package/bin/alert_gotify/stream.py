@@ -0,0 +1,238 @@
+# encoding = utf-8
+"""
+End-to-end delivery latency measured on Gotify's client stream.
+
+A 200 response only means Gotify stored the message. To see how long it
+takes until clients actually receive it, a sampled alert run subscribes to
+the /stream WebSocket with a client token before sending, notes when each
+message it sent appears on the stream, and logs latency percentiles.
+
+The WebSocket client is a minimal RFC 6455 implementation that only
+receives, since the stream never needs more than text frames, pings and a
+close; it avoids shipping a WebSocket library with the app.
+"""
+import base64
+import hashlib
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from urllib.parse import urlsplit
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+DEFAULT_SAMPLE = 0.1
+DEFAULT_WAIT = 5.0
+
+# Only the first messages of a large alert run are timed
+MAX_TRACKED = 1000
+
+# Messages from other apps of the same user also arrive on the stream
+MAX_ARRIVALS = 10000
+
+
+class StreamError(Exception):
+    """The stream could not be opened or broke the WebSocket protocol."""
+
+
+def build_stream_url(url):
+    """Return the /stream endpoint for a Gotify base URL."""
+    if url.endswith("/"):
+        url = url[:-1]
+    return url + "/stream"
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of values."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100.0))]
+
+
+class StreamWatcher(object):
+    """Record when messages sent through Gotify appear on a client's stream."""
+
+    def __init__(self, url, client_token, ssl_verify=True, timeout=5.0):
+        self.url = build_stream_url(url)
+        self.client_token = client_token
+        self.ssl_verify = ssl_verify
+        self.timeout = timeout
+        self.sock = None
+        self.thread = None
+        self.sent_at = {}
+        self.arrived = {}
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def open(self):
+        """Connect and subscribe; raises StreamError or OSError on failure."""
+        parts = urlsplit(self.url)
+        secure = parts.scheme.lower() == "https"
+        port = parts.port or (443 if secure else 80)
+        sock = socket.create_connection((parts.hostname, port), timeout=self.timeout)
+        try:
+            if secure:
+                from .tls import ssl_context
+
+                verify = self.ssl_verify if self.ssl_verify is False or isinstance(self.ssl_verify, str) else True
+                sock = ssl_context(verify).wrap_socket(sock, server_hostname=parts.hostname)
+            self._handshake(sock, parts)
+        except Exception:
+            sock.close()
+            raise
+        # The reader blocks until the stream is closed
+        sock.settimeout(None)
+        self.sock = sock
+        self.thread = threading.Thread(target=self._read_loop, args=(sock,), name="alert_gotify-stream",
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def _handshake(self, sock, parts):
+        key = base64.b64encode(os.urandom(16)).decode("ascii")
+        host = parts.netloc.rpartition("@")[2]
+        request = (
+            "GET {} HTTP/1.1\r\n"
+            "Host: {}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            "Sec-WebSocket-Key: {}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            "X-Gotify-Key: {}\r\n"
+            "\r\n"
+        ).format(parts.path or "/", host, key, self.client_token)
+        sock.sendall(request.encode("utf-8"))
+
+        self._buffer = b""
+        while b"\r\n\r\n" not in self._buffer:
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise StreamError("Connection closed during the WebSocket handshake")
+            self._buffer += chunk
+            if len(self._buffer) > 65536:
+                raise StreamError("WebSocket handshake response too large")
+        head, _, self._buffer = self._buffer.partition(b"\r\n\r\n")
+        lines = head.decode("iso-8859-1").split("\r\n")
+        status = lines[0].split(" ", 2)
+        if len(status) < 2 or status[1] != "101":
+            raise StreamError("Stream subscription refused: {}".format(lines[0]))
+        headers = dict(
+            (name.strip().lower(), value.strip()) for name, _, value in (line.partition(":") for line in lines[1:])
+        )
+        expected = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        if headers.get("sec-websocket-accept") != expected:
+            raise StreamError("Invalid WebSocket handshake response")
+
+    def _recv_exact(self, sock, size):
+        while len(self._buffer) < size:
+            chunk = sock.recv(max(4096, size - len(self._buffer)))
+            if not chunk:
+                raise EOFError()
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _read_frame(self, sock):
+        first, second = self._recv_exact(sock, 2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self._recv_exact(sock, 2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self._recv_exact(sock, 8))[0]
+        mask = self._recv_exact(sock, 4) if second & 0x80 else None
+        payload = self._recv_exact(sock, length)
+        if mask:
+            payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        return bool(first & 0x80), first & 0x0F, payload
+
+    def _read_loop(self, sock):
+        message = b""
+        try:
+            while True:
+                fin, opcode, payload = self._read_frame(sock)
+                if opcode == OP_PING:
+                    _send_frame(sock, OP_PONG, payload[:125])
+                elif opcode == OP_CLOSE:
+                    return
+                elif opcode in (OP_TEXT, OP_CONTINUATION):
+                    message += payload
+                    if fin:
+                        self._arrive(message)
+                        message = b""
+        except (EOFError, OSError, ValueError):
+            return
+        finally:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+
+    def _arrive(self, data):
+        now = time.monotonic()
+        try:
+            message_id = json.loads(data.decode("utf-8")).get("id")
+        except (ValueError, AttributeError):
+            return
+        with self.condition:
+            if message_id is not None and len(self.arrived) < MAX_ARRIVALS:
+                self.arrived.setdefault(message_id, now)
+                self.condition.notify_all()
+
+    def sent(self, response, started):
+        """Record a message accepted by Gotify; started is the time.monotonic() when it was posted."""
+        try:
+            message_id = response.json().get("id")
+        except (ValueError, AttributeError):
+            return
+        if message_id is not None:
+            with self.condition:
+                if len(self.sent_at) < MAX_TRACKED:
+                    self.sent_at[message_id] = started
+
+    def wait(self, timeout):
+        """Wait until every recorded message has been seen on the stream, or timeout."""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while not self.closed and any(message_id not in self.arrived for message_id in self.sent_at):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+    def latencies(self):
+        """Return the seconds from posting to arrival of each message seen so far."""
+        with self.condition:
+            return [
+                max(0.0, self.arrived[message_id] - started)
+                for message_id, started in self.sent_at.items() if message_id in self.arrived
+            ]
+
+    def close(self):
+        sock, self.sock = self.sock, None
+        if sock is not None:
+            try:
+                _send_frame(sock, OP_CLOSE)
+            except OSError:
+                pass
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        if self.thread is not None:
+            self.thread.join(1.0)
+
+
+def _send_frame(sock, opcode, payload=b""):
+    # Client frames must be masked (RFC 6455 section 5.3); only short control frames are sent
+    mask = os.urandom(4)
+    masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+    sock.sendall(struct.pack("!BB", 0x80 | opcode, 0x80 | len(payload)) + mask + masked)
@@ -0,0 +1,171 @@
+# encoding = utf-8
+"""
+Heavy-hitter summary of large result sets.
+
+A search returning hundreds of thousands of results is better reported as
+one message with the most frequent values of a few fields than as that many
+messages. Results are read once; each field keeps a Space-Saving summary
+of a fixed number of counters, which holds every value occurring in more
+than 1/capacity of the results with a count off by at most the error it
+reports, and a HyperLogLog sketch estimating the number of distinct values.
+Memory stays the same however many results the search returns.
+"""
+import hashlib
+import math
+
+DEFAULT_TOP = 10
+
+# Counters kept per field for each value reported
+CAPACITY_FACTOR = 10
+
+# HyperLogLog registers are 2 ** HLL_PRECISION bytes, for a standard error of about 1.6%
+HLL_PRECISION = 12
+
+
+def parse_fields(value):
+    """Parse the comma separated summary_fields parameter into a tuple of field names."""
+    fields = tuple(dict.fromkeys(name.strip() for name in (value or "").split(",") if name.strip()))
+    if not fields:
+        raise ValueError("summary_fields names no fields")
+    return fields
+
+
+class SpaceSaving(object):
+    """
+    Top values of a stream in a fixed number of counters.
+
+    Counters are kept in buckets by count, so adding a value takes constant
+    time: a value that has no counter once all are in use takes over a
+    counter with the lowest count and inherits that count as its error.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # value -> [count, error]
+        self.counters = {}
+        # count -> values with that count
+        self.buckets = {}
+        self.minimum = 0
+        self.evicted = False
+
+    def add(self, value):
+        counter = self.counters.get(value)
+        if counter is None:
+            if len(self.counters) < self.capacity:
+                counter = self.counters[value] = [0, 0]
+                self.minimum = 0
+            else:
+                bucket = self.buckets[self.minimum]
+                victim = bucket.pop()
+                if not bucket:
+                    del self.buckets[self.minimum]
+                del self.counters[victim]
+                counter = self.counters[value] = [self.minimum, self.minimum]
+                self.evicted = True
+        else:
+            bucket = self.buckets[counter[0]]
+            bucket.discard(value)
+            if not bucket:
+                del self.buckets[counter[0]]
+        counter[0] += 1
+        self.buckets.setdefault(counter[0], set()).add(value)
+        if self.minimum not in self.buckets:
+            # The lowest count was that of this counter before it was incremented
+            self.minimum += 1
+
+    def top(self, k):
+        """Return up to k (value, count, error) tuples, most frequent first."""
+        ranked = sorted(self.counters.items(), key=lambda item: (-item[1][0], item[0]))
+        return [(value, count, error) for value, (count, error) in ranked[:k]]
+
+
+class HyperLogLog(object):
+    """Estimate of the number of distinct values in 2 ** precision bytes."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        raw = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        empty = self.registers.count(0)
+        if raw <= 2.5 * size and empty:
+            # Linear counting is more accurate for small cardinalities
+            return int(round(size * math.log(float(size) / empty)))
+        return int(round(raw))
+
+
+class FieldSummary(object):
+    """Top values and distinct count of one field."""
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.counts = SpaceSaving(capacity)
+        self.distinct = HyperLogLog()
+        self.rows = 0
+
+    def add(self, value):
+        self.rows += 1
+        self.counts.add(value)
+        self.distinct.add(value)
+
+    def distinct_count(self):
+        """Return (count, exact): exact while every value still has its own counter."""
+        if not self.counts.evicted:
+            return len(self.counts.counters), True
+        return max(self.distinct.estimate(), len(self.counts.counters)), False
+
+
+class Summary(object):
+    """Summarize results into the most frequent values of some fields."""
+
+    def __init__(self, fields, top=DEFAULT_TOP):
+        self.top = top
+        self.fields = [FieldSummary(name, top * CAPACITY_FACTOR) for name in fields]
+        self.total = 0
+
+    def add(self, result):
+        self.total += 1
+        for field in self.fields:
+            value = result.get(field.name)
+            if value is not None and value != "":
+                field.add(str(value))
+
+    def render(self, header=None, markdown=False):
+        """Return the summary as a message, below header if given."""
+        sections = [header] if header else []
+        sections.append("{} result(s)".format(self.total))
+        for field in self.fields:
+            distinct, exact = field.distinct_count()
+            heading = "Top {} ({}{} distinct in {} result(s)):".format(
+                field.name, "" if exact else "about ", distinct, field.rows
+            )
+            if markdown:
+                heading = "**{}**".format(heading)
+            lines = [heading]
+            for value, count, error in field.counts.top(self.top):
+                # Values that took over a counter occurred between count - error and count times
+                lines.append("- {}: {}".format(value, "{}-{}".format(count - error, count) if error else count))
+            sections.append("\n".join(lines))
+        return "\n\n".join(sections)
+
+
+def summarize(results, summary):
+    """Add every result to summary and return the first result, or None."""
+    first = None
+    for result in results:
+        if first is None:
+            first = result
+        summary.add(result)
+    return first
@@ -0,0 +1,67 @@
+# encoding = utf-8
+"""
+Precompiled $result.field$ templates for message and title.
+
+Templates are parsed once into alternating literal and field slots so that
+rendering a result is a list fill and a single join, without re-scanning the
+template string for every row.
+
+Splunk substitutes $result.field$ tokens in alert parameters itself (using the
+first result only) before the alert action runs. To render a token for every
+result, escape it in savedsearches.conf as $$result.field$$; Splunk then
+passes $result.field$ through unchanged.
+"""
+import re
+from functools import lru_cache
+
+TOKEN_PATTERN = re.compile(r"\$result\.([^$\s]+)\$")
+
+
+class Template(object):
+    """A template compiled into literal and field slots."""
+
+    __slots__ = ("source", "fields", "_parts")
+
+    def __init__(self, source):
+        self.source = source or ""
+        literals = []
+        fields = []
+        position = 0
+        for match in TOKEN_PATTERN.finditer(self.source):
+            literals.append(self.source[position:match.start()])
+            fields.append(match.group(1))
+            position = match.end()
+        literals.append(self.source[position:])
+
+        self.fields = tuple(fields)
+        # Reusable slot list: literals at even indexes, values at odd indexes
+        self._parts = [None] * (len(literals) + len(fields))
+        self._parts[::2] = literals
+
+    @property
+    def is_static(self):
+        """True when the template has no result tokens."""
+        return not self.fields
+
+    def render(self, result):
+        """Render the template against a result mapping. Missing fields render empty."""
+        if not self.fields:
+            return self.source
+        get = result.get
+        parts = list(self._parts)
+        parts[1::2] = [_to_text(get(field)) for field in self.fields]
+        return "".join(parts)
+
+
+def _to_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return str(value)
+
+
+@lru_cache(maxsize=64)
+def compile_template(source):
+    """Compile a template string, reusing earlier compilations in this process."""
+    return Template(source)
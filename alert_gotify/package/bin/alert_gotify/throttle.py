@@ -0,0 +1,106 @@
+# encoding = utf-8
+"""
+Cross-process deduplication and rate limiting of outgoing messages.
+
+Both are kept in the local store so that every alert process on the search
+head sees the same state:
+
+- a deduplication window keyed on a hash of (url, title, message, priority),
+  which suppresses identical messages from a flapping search, and
+- a token bucket per Gotify app token, which caps the message rate.
+"""
+import hashlib
+import time
+
+DEDUP_NAMESPACE = "dedup"
+RATE_NAMESPACE = "ratelimit"
+
+DUPLICATE = "duplicate"
+RATE_LIMITED = "rate limited"
+
+
+def _digest(*parts):
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(str(part).encode("utf-8"))
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def dedup_key(url, payload):
+    """Return the deduplication key for a payload sent to url."""
+    return _digest(url, payload.get("title") or "", payload.get("message") or "", payload.get("priority"))
+
+
+def token_key(url, token):
+    """Return the rate limit key for an app token, without storing the token itself."""
+    return _digest(url, token)
+
+
+def is_duplicate(store, key, window, now):
+    """Record key and return True if it was already seen within the last window seconds."""
+    seen = []
+
+    def update(first_seen):
+        seen.append(first_seen is not None)
+        return first_seen if first_seen is not None else now
+
+    # The window is fixed from the first message, so a flapping search is
+    # notified again once per window rather than suppressed forever
+    store.kv_update(DEDUP_NAMESPACE, key, update, now, ttl=window, keep_expiry=True)
+    return seen[0]
+
+
+def take_token(store, key, rate_per_minute, burst, now):
+    """Take one token from the bucket for key and return True if one was available."""
+    refill_per_second = rate_per_minute / 60.0
+    granted = []
+
+    def update(bucket):
+        if bucket is None:
+            tokens = float(burst)
+        else:
+            elapsed = max(0.0, now - bucket["updated"])
+            tokens = min(float(burst), bucket["tokens"] + elapsed * refill_per_second)
+        if tokens >= 1.0:
+            tokens -= 1.0
+            granted.append(True)
+        else:
+            granted.append(False)
+        return {"tokens": tokens, "updated": now}
+
+    # An idle bucket is full again after burst / rate, so it need not outlive that
+    store.kv_update(RATE_NAMESPACE, key, update, now, ttl=burst / refill_per_second + 60)
+    return granted[0]
+
+
+class Throttle(object):
+    """Admission control for messages sent to one Gotify server and app token."""
+
+    def __init__(self, store, url, token, dedup_window=0, rate_limit=0, burst=None):
+        self.store = store
+        self.url = url
+        self.rate_key = token_key(url, token)
+        self.dedup_window = dedup_window
+        self.rate_limit = rate_limit
+        self.burst = burst or max(1.0, rate_limit)
+        self.duplicates = 0
+        self.rate_limited = 0
+        store.kv_purge(time.time())
+
+    def admit(self, payload, now=None):
+        """Return None if the payload may be sent, otherwise why it was held back."""
+        now = time.time() if now is None else now
+        key = dedup_key(self.url, payload) if self.dedup_window else None
+        if key and self.store.kv_get(DEDUP_NAMESPACE, key, now) is not None:
+            self.duplicates += 1
+            return DUPLICATE
+        if self.rate_limit and not take_token(self.store, self.rate_key, self.rate_limit, self.burst, now):
+            # Not recorded for deduplication, so the message is sent once the bucket refills
+            self.rate_limited += 1
+            return RATE_LIMITED
+        if key and is_duplicate(self.store, key, self.dedup_window, now):
+            # Another alert process sent it since the check above
+            self.duplicates += 1
+            return DUPLICATE
+        return None
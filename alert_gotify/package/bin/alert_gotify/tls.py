@@ -0,0 +1,132 @@
+# encoding = utf-8
+"""
+Shared TLS contexts with session resumption.
+
+requests and urllib3 build a new SSL context for every connection, reload
+the CA bundle into it and disable session tickets, so every connection to
+Gotify pays a full TLS handshake. The adapter here gives each verification
+setting (on, off or a CA path) one context per process, loads its CA bundle
+once, and remembers the last TLS session per server so later connections
+(retries, further workers, spool drains and the long-running delivery
+daemon) resume it with an abbreviated handshake.
+"""
+import functools
+import os
+import ssl
+import threading
+
+from requests.adapters import HTTPAdapter
+from requests.utils import DEFAULT_CA_BUNDLE_PATH
+
+
+def resolve_verify(ssl_verify, ca_path=None):
+    """
+    Return the requests verify value for the ssl_verify flag and an optional CA path.
+
+    Raises ValueError if ca_path does not exist.
+    """
+    if not ssl_verify:
+        return False
+    if not ca_path:
+        return True
+    ca_path = os.path.expanduser(ca_path)
+    if not os.path.exists(ca_path):
+        raise ValueError("CA path '{}' does not exist".format(ca_path))
+    return ca_path
+
+
+class SessionCachingContext(ssl.SSLContext):
+    """Client SSL context that resumes the last session to each server."""
+
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+        context = super(SessionCachingContext, cls).__new__(cls, protocol, *args, **kwargs)
+        context._sessions = {}
+        context._sessions_lock = threading.Lock()
+        return context
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True, suppress_ragged_eofs=True,
+                    server_hostname=None, session=None):
+        key = _session_key(sock, server_hostname)
+        if session is None and key is not None:
+            with self._sessions_lock:
+                session = self._sessions.get(key)
+        # A session the server no longer accepts just results in a full handshake
+        wrapped = super(SessionCachingContext, self).wrap_socket(
+            sock, server_side=server_side, do_handshake_on_connect=do_handshake_on_connect,
+            suppress_ragged_eofs=suppress_ragged_eofs, server_hostname=server_hostname, session=session)
+        wrapped._session_key = key
+        if do_handshake_on_connect:
+            self.remember(wrapped)
+        return wrapped
+
+    def remember(self, sock):
+        key = getattr(sock, "_session_key", None)
+        try:
+            session = sock.session
+        except (AttributeError, ValueError, ssl.SSLError):
+            return
+        if key is None or session is None or not (session.has_ticket or session.id):
+            return
+        with self._sessions_lock:
+            self._sessions[key] = session
+
+
+def _session_key(sock, server_hostname):
+    try:
+        port = sock.getpeername()[1]
+    except (OSError, IndexError, TypeError):
+        return None
+    return (server_hostname, port)
+
+
+@functools.lru_cache(maxsize=8)
+def ssl_context(verify):
+    """
+    Return the process-wide context for a requests verify value.
+
+    verify is True for the default CA bundle, False to skip verification
+    or the path of a CA bundle file or directory.
+    """
+    context = SessionCachingContext()
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.options |= ssl.OP_NO_COMPRESSION
+    if verify is False:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+    ca_path = DEFAULT_CA_BUNDLE_PATH if verify is True else verify
+    if os.path.isdir(ca_path):
+        context.load_verify_locations(capath=ca_path)
+    else:
+        context.load_verify_locations(cafile=ca_path)
+    return context
+
+
+class TLSAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that uses the shared context for the verify value of each
+    request and saves the TLS session of each response's connection.
+    """
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super(TLSAdapter, self).build_connection_pool_key_attributes(
+            request, verify, cert)
+        if host_params["scheme"] == "https":
+            # The CA bundle is loaded into the shared context instead of every connection
+            pool_kwargs.pop("ca_certs", None)
+            pool_kwargs.pop("ca_cert_dir", None)
+            pool_kwargs["ssl_context"] = ssl_context(verify if verify is False or isinstance(verify, str) else True)
+        return host_params, pool_kwargs
+
+    def build_response(self, req, resp):
+        # TLS 1.3 tickets arrive after the handshake, so the session is saved again once the server answers
+        sock = getattr(getattr(resp, "connection", None), "sock", None)
+        context = getattr(sock, "context", None)
+        if isinstance(context, SessionCachingContext):
+            context.remember(sock)
+        return super(TLSAdapter, self).build_response(req, resp)
+
+    def cert_verify(self, conn, url, verify, cert):
+        super(TLSAdapter, self).cert_verify(conn, url, verify, cert)
+        conn.ca_certs = None
+        conn.ca_cert_dir = None
@@ -0,0 +1,78 @@
+# encoding = utf-8
+"""
+Size-aware truncation of message bodies.
+
+Messages rendered from wide results can grow to hundreds of kilobytes,
+which reverse proxies in front of Gotify reject or time out on and which
+no client displays usefully. An oversized message keeps its beginning and
+its end, cut at line boundaries where possible, with a marker stating how
+much was left out. Markdown messages also keep code fences balanced, so
+the elision does not turn the rest of the message into a code block.
+"""
+
+DEFAULT_MAX_MESSAGE_BYTES = 64 * 1024
+
+MARKER = "[... {} bytes omitted ...]"
+
+# Share of the budget given to the beginning of the message
+HEAD_SHARE = 0.75
+
+# A cut moves back to a line boundary when one is within this share of the kept text
+LINE_SEARCH = 0.25
+
+FENCE = "```"
+
+
+def _fits(text, max_bytes):
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    return encoded[:max_bytes].decode("utf-8", "ignore")
+
+
+def _open_fences(text):
+    """Return True if text ends inside a fenced code block."""
+    fences = 0
+    for line in text.split("\n"):
+        if line.lstrip().startswith(FENCE):
+            fences += 1
+    return fences % 2 == 1
+
+
+def truncate_message(text, max_bytes, markdown=False):
+    """
+    Return text shortened to at most max_bytes of UTF-8.
+
+    Text that fits is returned unchanged; a max_bytes of 0 or None disables truncation.
+    """
+    if not max_bytes or text is None:
+        return text
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+
+    # The marker is sized for the largest count it can show
+    separator = "\n\n"
+    fence_cost = 2 * (len(FENCE) + 1) if markdown else 0
+    budget = max_bytes - len(MARKER.format(len(encoded))) - 2 * len(separator) - fence_cost
+    if budget <= 0:
+        return _fits(text, max_bytes)
+
+    head_size = int(budget * HEAD_SHARE)
+    head = encoded[:head_size].decode("utf-8", "ignore")
+    tail = encoded[len(encoded) - (budget - head_size):].decode("utf-8", "ignore")
+
+    newline = head.rfind("\n")
+    if newline >= len(head) * (1 - LINE_SEARCH):
+        head = head[:newline]
+    newline = tail.find("\n")
+    if 0 <= newline <= len(tail) * LINE_SEARCH:
+        tail = tail[newline + 1:]
+
+    omitted = len(encoded) - len(head.encode("utf-8")) - len(tail.encode("utf-8"))
+    if markdown:
+        if _open_fences(head):
+            head += "\n" + FENCE
+        if _open_fences(text[:len(text) - len(tail)]):
+            tail = FENCE + "\n" + tail
+    return head + separator + MARKER.format(omitted) + separator + tail
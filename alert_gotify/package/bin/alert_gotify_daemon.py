@@ -0,0 +1,42 @@
+# encoding = utf-8
+"""
+Scripted input that runs the Gotify delivery daemon.
+
+Alert actions with the daemon parameter set hand their messages to this
+process over a Unix domain socket instead of opening their own connections.
+The script exits immediately if a daemon is already running, so splunkd can
+restart it on an interval.
+
+Options can be appended to the script path in the inputs.conf stanza:
+  --workers N           concurrent deliveries (default 8)
+  --lane-weights H,N,L  messages sent from the high, normal and low priority
+                        lanes per round under load (default 8,3,1)
+"""
+import os
+import import_declare_test
+import argparse
+import logging
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from alert_gotify import daemon
+from alert_gotify.lanes import DEFAULT_WEIGHTS, parse_weights
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=daemon.DEFAULT_WORKERS)
+    parser.add_argument("--lane-weights", type=parse_weights, default=DEFAULT_WEIGHTS)
+    args = parser.parse_args()
+
+    # splunkd indexes stderr of scripted inputs in splunkd.log
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format="%(levelname)s %(name)s - %(message)s")
+    if not daemon.is_supported():
+        logging.getLogger("alert_gotify.daemon").error("Unix domain sockets are not supported on this platform")
+        return 1
+    return daemon.run(workers=max(1, args.workers), lane_weights=args.lane_weights)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,21 @@
+# encoding = utf-8
+"""
+Command line tool that sends Gotify messages in bulk from a file.
+
+Replays notifications lost during an outage, or load tests a Gotify server,
+through the same delivery engine as the alert action. Run it with Splunk's
+Python, for example:
+
+  $SPLUNK_HOME/bin/splunk cmd python3 alert_gotify_replay.py --help
+"""
+import os
+import import_declare_test
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from alert_gotify import replay
+
+
+if __name__ == "__main__":
+    sys.exit(replay.main())
@@ -0,0 +1,31 @@
+# encoding = utf-8
+"""
+Scripted input that retries spooled Gotify messages.
+
+Runs one drain pass over the local delivery spool and writes a summary line
+to stdout, which Splunk indexes.
+"""
+import os
+import import_declare_test
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from alert_gotify import spool
+from alert_gotify.store import LocalStore
+
+
+def main():
+    with LocalStore() as store:
+        result = spool.drain(store)
+        remaining = store.spool_size()
+    for error in result.errors:
+        sys.stderr.write("{}\n".format(error))
+    print("action=drain sent={} deferred={} dropped={} remaining={}".format(
+        result.sent, result.failed, result.dropped, remaining
+    ))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+# encoding = utf-8
+"""
+Fixtures for the benchmark suite.
+
+Benchmarks are not part of the default test run. Run them from the tests
+directory with:
+
+    python -m pytest benchmark -o addopts="" --benchmark-only
+"""
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.fixture(autouse=True)
+def no_retry_sleep():
+    """Benchmarks measure real retry backoff, so nothing is patched out."""
+    return []
+
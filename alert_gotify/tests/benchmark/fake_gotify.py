@@ -0,0 +1,186 @@
+# encoding = utf-8
+"""
+Stand-in Gotify server for benchmarks and local testing.
+
+Accepts POST /message like Gotify and answers after a configurable latency.
+A share of requests can fail with 503 or be throttled with 429 and a
+Retry-After header, and with TLS enabled the handshake can be delayed to
+simulate a slow or distant server.
+
+Run standalone to point a development Splunk instance at it:
+
+    python fake_gotify.py --port 8080 --latency 0.05 --error-rate 0.1
+"""
+import argparse
+import json
+import os
+import random
+import ssl
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeGotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; Nagle would delay the body by a delayed-ACK period
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/message":
+            return self._reply(404, {"error": "Not Found"})
+        if not self.headers.get("X-Gotify-Key"):
+            return self._reply(401, {"error": "Unauthorized"})
+        if server.latency:
+            time.sleep(server.latency)
+
+        roll = server.random.random()
+        if roll < server.throttle_rate:
+            return self._reply(429, {"error": "Too Many Requests"}, {"Retry-After": str(server.retry_after)})
+        if roll < server.throttle_rate + server.error_rate:
+            return self._reply(503, {"error": "Service Unavailable"})
+
+        server.record(json.loads(body.decode("utf-8")))
+        self._reply(200, {"id": server.received})
+
+    def _reply(self, status, document, headers=None):
+        body = json.dumps(document).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeGotify(ThreadingHTTPServer):
+    """Threaded fake Gotify server; use as a context manager to run it in the background."""
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1, tls=False, handshake_delay=0.0, seed=None):
+        super(FakeGotify, self).__init__((host, port), FakeGotifyHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.handshake_delay = handshake_delay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.received = 0
+        self.handshakes = 0
+        self.resumed = 0
+        self.keep_messages = False
+        self.messages = []
+        self.context, self.cert_path = _tls_context() if tls else (None, None)
+        self.thread = None
+
+    @property
+    def url(self):
+        scheme = "https" if self.context else "http"
+        return "{}://{}:{}".format(scheme, self.server_address[0], self.server_address[1])
+
+    def record(self, payload):
+        with self.lock:
+            self.received += 1
+            if self.keep_messages:
+                self.messages.append(payload)
+
+    def get_request(self):
+        conn, address = super(FakeGotify, self).get_request()
+        if self.context:
+            conn = self.context.wrap_socket(conn, server_side=True, do_handshake_on_connect=False)
+        return conn, address
+
+    def finish_request(self, request, client_address):
+        # Runs in the connection's thread, so a slow handshake does not block accept()
+        if self.context:
+            if self.handshake_delay:
+                time.sleep(self.handshake_delay)
+            try:
+                request.do_handshake()
+            except (ssl.SSLError, OSError):
+                return
+            with self.lock:
+                self.handshakes += 1
+                self.resumed += request.session_reused
+        super(FakeGotify, self).finish_request(request, client_address)
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+def _tls_context():
+    """Return a server context with a throwaway self-signed certificate for localhost, and the certificate path."""
+    import datetime
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+
+    directory = tempfile.mkdtemp(prefix="fake_gotify")
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as cert_file:
+        cert_file.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as key_file:
+        key_file.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                         serialization.NoEncryption()))
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    return context, cert_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429")
+    parser.add_argument("--tls", action="store_true", help="serve HTTPS with a self-signed certificate")
+    parser.add_argument("--handshake-delay", type=float, default=0.0, help="seconds before each TLS handshake")
+    args = parser.parse_args()
+
+    server = FakeGotify(args.host, args.port, latency=args.latency, error_rate=args.error_rate,
+                        throttle_rate=args.throttle_rate, retry_after=args.retry_after, tls=args.tls,
+                        handshake_delay=args.handshake_delay)
+    print("Fake Gotify listening on {}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# encoding = utf-8
+"""
+Benchmarks for reading large alert results files.
+
+Compares the column-projected reader with a csv.DictReader pass like UCC's
+get_events(), recording the peak memory held by the rows of a result set,
+and measures summarizing a result set in summary mode.
+"""
+import csv
+import gzip
+import os
+import sys
+import tracemalloc
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify.results import read_results
+from alert_gotify.summary import Summary, summarize
+
+ROWS = 100000
+COLUMNS = ["_raw", "_time", "host", "source", "sourcetype", "pct"] + ["extra{}".format(i) for i in range(24)]
+
+
+@pytest.fixture(scope="module")
+def results_file(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("results") / "results.csv.gz")
+    with gzip.open(path, "wt", newline="", encoding="utf-8") as results_file:
+        writer = csv.writer(results_file)
+        writer.writerow(COLUMNS)
+        for i in range(ROWS):
+            writer.writerow(["event {} ".format(i) * 8, str(i), "web{:03d}".format(i % 500), "/var/log/app.log",
+                             "app", str(i % 100)] + ["value{}".format(i)] * 24)
+    return path
+
+
+def _dict_rows(path):
+    with gzip.open(path, "rt", newline="") as results_file:
+        for row in csv.DictReader(results_file):
+            yield row
+
+
+def _peak_kb(rows):
+    tracemalloc.start()
+    try:
+        kept = list(rows)
+        return tracemalloc.get_traced_memory()[1] // 1024, len(kept)
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.benchmark(group="results")
+def test_projected_reader(benchmark, results_file):
+    benchmark.pedantic(lambda: sum(1 for _ in read_results(results_file, ("host", "pct"))), rounds=3)
+    peak_kb, rows = _peak_kb(read_results(results_file, ("host", "pct")))
+    benchmark.extra_info.update({'rows': rows, 'peak_kb_all_rows': peak_kb})
+    assert rows == ROWS
+
+
+@pytest.mark.benchmark(group="results")
+def test_dict_reader(benchmark, results_file):
+    benchmark.pedantic(lambda: sum(1 for _ in _dict_rows(results_file)), rounds=3)
+    peak_kb, rows = _peak_kb(_dict_rows(results_file))
+    benchmark.extra_info.update({'rows': rows, 'peak_kb_all_rows': peak_kb})
+    assert rows == ROWS
+
+
+@pytest.mark.benchmark(group="results")
+def test_summary(benchmark, results_file):
+    fields = ("host", "pct", "extra0")
+
+    def run():
+        summary = Summary(fields)
+        summarize(read_results(results_file, fields), summary)
+        return summary
+
+    summary = benchmark.pedantic(run, rounds=3)
+    tracemalloc.start()
+    try:
+        summarize(read_results(results_file, fields), Summary(fields))
+        peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info.update({'rows': summary.total, 'peak_kb': peak_kb})
+    assert summary.total == ROWS
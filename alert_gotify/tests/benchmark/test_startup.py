@@ -0,0 +1,26 @@
+# encoding = utf-8
+"""
+Import time of the alert action helper.
+
+Every alert firing starts a fresh Python process, so the add-on's own import
+time is measured in subprocesses with -X importtime to catch regressions.
+It depends on the machine, which is why it is not part of the unit suite.
+"""
+import pytest
+
+from ..unit.test_startup import import_times
+
+# Budget for the add-on's own modules, excluding third-party libraries (microseconds)
+OWN_IMPORT_BUDGET_US = 50000
+
+
+@pytest.mark.benchmark(group="startup")
+def test_helper_import_budget(benchmark):
+    times = benchmark.pedantic(import_times, args=("alert_gotify.modalert_alert_gotify_helper",),
+                               rounds=3, iterations=1)
+
+    own_us = sum(self_us for name, (self_us, _) in times.items() if name.startswith("alert_gotify"))
+    benchmark.extra_info.update({
+        'own_import_us': own_us, 'total_import_us': times["alert_gotify.modalert_alert_gotify_helper"][1],
+    })
+    assert own_us < OWN_IMPORT_BUDGET_US
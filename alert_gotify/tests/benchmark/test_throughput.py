@@ -0,0 +1,200 @@
+# encoding = utf-8
+"""
+Throughput and latency benchmarks against the fake Gotify server.
+
+Each benchmark records messages/sec, p50/p99 per-message latency and peak
+RSS in extra_info, which pytest-benchmark includes in --benchmark-json
+output for comparison between runs.
+"""
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from unittest.mock import Mock
+import pytest
+
+BIN_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+sys.path.insert(0, BIN_DIR)
+from alert_gotify import modalert_alert_gotify_helper
+from alert_gotify.sender import GotifySender
+
+# Response latency of the fake server (seconds), roughly a nearby Gotify instance
+LATENCY = 0.005
+
+WORKER_SCRIPT = """
+import importlib.util
+import sys
+import types
+
+class ModularAlertBase(object):
+    def __init__(self, ta_name, alert_name):
+        pass
+
+base = types.ModuleType('splunktaucclib.alert_actions_base')
+base.ModularAlertBase = ModularAlertBase
+sys.modules['splunktaucclib'] = types.ModuleType('splunktaucclib')
+sys.modules['splunktaucclib.alert_actions_base'] = base
+
+spec = importlib.util.spec_from_file_location('alert_gotify_main', 'alert_gotify.py')
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+
+url, count = sys.argv[1], int(sys.argv[2])
+params = {'url': url, 'token': 'bench', 'message': 'Row $result.n$', 'priority': '5',
+          'mode': 'per_result' if count > 1 else 'single'}
+worker = module.AlertActionWorkeralert_gotify('alert_gotify', 'alert_gotify')
+worker.get_param = params.get
+worker.get_global_setting = lambda key: None
+worker.get_events = lambda: ({'n': str(i)} for i in range(count))
+worker.log_info = worker.log_error = lambda message: None
+sys.exit(worker.process_event())
+"""
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100.0))]
+
+
+def _peak_rss_mb(kilobytes):
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    return kilobytes / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+
+
+@pytest.fixture
+def latencies(monkeypatch):
+    """Record the duration of every delivery made through GotifySender."""
+    durations = []
+    lock = threading.Lock()
+    deliver = GotifySender.deliver
+
+    def timed(self, payload):
+        start = time.perf_counter()
+        try:
+            return deliver(self, payload)
+        finally:
+            with lock:
+                durations.append(time.perf_counter() - start)
+
+    monkeypatch.setattr(GotifySender, "deliver", timed)
+    return durations
+
+
+def _helper(url, count, **params):
+    helper = Mock()
+    values = {'url': url, 'token': 'bench', 'message': 'Row $result.n$', 'title': 'Benchmark',
+              'priority': '5', 'mode': 'per_result', 'ssl_verify': '1'}
+    values.update(params)
+    helper.get_param = Mock(side_effect=values.get)
+    helper.get_events = Mock(side_effect=lambda: ({'n': str(i)} for i in range(count)))
+    return helper
+
+
+def _bench_alert(benchmark, server, latencies, count, **params):
+    statuses = []
+    elapsed = []
+    url = params.pop("url", server.url)
+
+    def run():
+        helper = _helper(url, count, **params)
+        start = time.perf_counter()
+        statuses.append(modalert_alert_gotify_helper.process_event(helper))
+        elapsed.append(time.perf_counter() - start)
+
+    benchmark.pedantic(run, rounds=3, iterations=1)
+    benchmark.extra_info.update({
+        'messages': count,
+        'messages_per_sec': round(count / min(elapsed), 1),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+        'peak_rss_mb': round(_peak_rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss), 1),
+    })
+    return statuses
+
+
+@pytest.mark.benchmark(group="per_result")
+@pytest.mark.parametrize("workers", [1, 8, 32])
+@pytest.mark.parametrize("count", [100, 1000])
+def test_per_result_throughput(benchmark, fake_gotify, latencies, count, workers):
+    server = fake_gotify(latency=LATENCY)
+
+    statuses = _bench_alert(benchmark, server, latencies, count, workers=str(workers))
+
+    assert statuses == [0, 0, 0]
+    assert server.received == count * 3
+
+
+@pytest.mark.benchmark(group="digest")
+@pytest.mark.parametrize("count", [1000, 10000])
+def test_digest_throughput(benchmark, fake_gotify, latencies, count):
+    server = fake_gotify(latency=LATENCY)
+
+    statuses = _bench_alert(benchmark, server, latencies, count, mode='digest')
+
+    assert statuses == [0, 0, 0]
+
+
+@pytest.mark.benchmark(group="degraded")
+def test_errors_and_throttling(benchmark, fake_gotify, latencies):
+    server = fake_gotify(latency=LATENCY, error_rate=0.05, throttle_rate=0.02, retry_after=0, seed=1)
+
+    _bench_alert(benchmark, server, latencies, 200, workers='8')
+
+    assert server.received > 0
+
+
+@pytest.mark.benchmark(group="tls")
+@pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+@pytest.mark.parametrize("workers", [1, 8])
+def test_slow_tls_handshake(benchmark, fake_gotify, latencies, workers):
+    pytest.importorskip("cryptography")
+    server = fake_gotify(latency=LATENCY, tls=True, handshake_delay=0.05)
+
+    statuses = _bench_alert(benchmark, server, latencies, 100, workers=str(workers), ssl_verify='0')
+
+    assert statuses == [0, 0, 0]
+
+
+@pytest.mark.benchmark(group="tls")
+def test_tls_session_resumption(benchmark, fake_gotify, latencies):
+    pytest.importorskip("cryptography")
+    server = fake_gotify(latency=LATENCY, tls=True)
+    url = server.url.replace("127.0.0.1", "localhost")
+
+    statuses = _bench_alert(benchmark, server, latencies, 100, workers='8', url=url, ca_path=server.cert_path)
+
+    benchmark.extra_info.update({'handshakes': server.handshakes, 'resumed': server.resumed})
+    assert statuses == [0, 0, 0]
+    assert server.resumed > 0
+
+
+@pytest.mark.benchmark(group="worker")
+@pytest.mark.parametrize("count", [1, 100])
+def test_worker_entry_point(benchmark, fake_gotify, state_dir, count):
+    """Run the alert action in a fresh process, as splunkd does for every firing."""
+    server = fake_gotify(latency=LATENCY)
+    peak_rss = []
+    elapsed = []
+
+    def run():
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "-c", WORKER_SCRIPT, server.url, str(count)], cwd=BIN_DIR)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed.append(time.perf_counter() - start)
+        peak_rss.append(usage.ru_maxrss)
+        assert process.returncode == 0
+
+    benchmark.pedantic(run, rounds=3, iterations=1)
+    benchmark.extra_info.update({
+        'messages': count,
+        'messages_per_sec': round(count / min(elapsed), 1),
+        'p50_ms': round(_percentile(elapsed, 50) * 1000, 2),
+        'p99_ms': round(_percentile(elapsed, 99) * 1000, 2),
+        'peak_rss_mb': round(_peak_rss_mb(max(peak_rss)), 1),
+    })
+    assert server.received == count * 3
@@ -10,6 +10,41 @@ import pytest
 
 # Add package bin directory to path for imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "package", "bin"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "benchmark"))
+from fake_gotify import FakeGotify
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    """Keep shared alert action state (spool, caches) in a per-test directory."""
+    path = tmp_path / "state"
+    monkeypatch.setenv("ALERT_GOTIFY_STATE_DIR", str(path))
+    return path
+
+
+@pytest.fixture(autouse=True)
+def no_retry_sleep(monkeypatch):
+    """Run retry backoff without actually sleeping."""
+    sleeps = []
+    monkeypatch.setattr("alert_gotify.resilience.backoff_sleep", sleeps.append)
+    return sleeps
+
+
+@pytest.fixture
+def fake_gotify():
+    """Factory for fake Gotify servers that are shut down after the test."""
+    servers = []
+
+    def start(**options):
+        if options.get("tls"):
+            pytest.importorskip("cryptography")
+        server = FakeGotify(**options).__enter__()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.__exit__(None, None, None)
 
 
 @pytest.fixture
@@ -0,0 +1,169 @@
+# encoding = utf-8
+"""
+Unit tests for adaptive concurrency.
+"""
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify.adaptive import ConcurrencyLimit, load_limit, save_limit
+from alert_gotify.sender import GotifySender
+from alert_gotify.store import LocalStore
+
+URL = 'https://gotify.example.com'
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.mark.unit
+class TestConcurrencyLimit:
+    """Test the AIMD rule."""
+
+    def test_starts_at_maximum(self):
+        assert ConcurrencyLimit(8).current == 8
+        assert ConcurrencyLimit(8, initial=20).current == 8
+        assert ConcurrencyLimit(8, initial=0.5).current == 1
+
+    def test_fast_successes_increase_by_one_per_round(self):
+        limiter = ConcurrencyLimit(16, initial=4)
+        for _ in range(4):
+            limiter.record(0.05, 200)
+        assert limiter.current == 4
+        limiter.record(0.05, 200)
+        assert limiter.current == 5
+
+    def test_never_exceeds_maximum(self):
+        limiter = ConcurrencyLimit(4)
+        for _ in range(100):
+            limiter.record(0.05, 200)
+        assert limiter.limit == 4
+
+    @pytest.mark.parametrize('status', [429, 500, 503, None])
+    def test_overload_halves_the_limit(self, status):
+        limiter = ConcurrencyLimit(8)
+        limiter.record(1.0, status)
+        assert limiter.current == 4
+
+    def test_one_decrease_per_round(self):
+        limiter = ConcurrencyLimit(8)
+        for _ in range(4):
+            limiter.record(0.05, 503)
+        # Errors from requests already in flight when the limit dropped count as one event
+        assert limiter.current == 4
+        limiter.record(0.05, 503)
+        assert limiter.current == 2
+
+    def test_never_drops_below_one(self):
+        limiter = ConcurrencyLimit(8)
+        for _ in range(100):
+            limiter.record(0.05, 500)
+        assert limiter.current == 1
+
+    def test_latency_spike_decreases(self):
+        limiter = ConcurrencyLimit(8)
+        limiter.record(0.05, 200)
+        limiter.record(0.06, 200)
+        assert limiter.current == 8
+        limiter.record(1.0, 200)
+        assert limiter.current == 4
+
+    def test_client_errors_are_not_congestion(self):
+        limiter = ConcurrencyLimit(8)
+        limiter.record(0.05, 401)
+        assert limiter.current == 8
+
+    def test_retry_after_pauses(self):
+        clock = FakeClock()
+        limiter = ConcurrencyLimit(8, clock=clock, sleep=clock.sleep)
+        limiter.record(0.05, 429, retry_after=3)
+        limiter.wait_ready()
+        assert clock.sleeps == [3]
+        limiter.wait_ready()
+        assert clock.sleeps == [3]
+
+    def test_retry_after_is_capped(self):
+        clock = FakeClock()
+        limiter = ConcurrencyLimit(8, clock=clock, sleep=clock.sleep)
+        limiter.record(0.05, 503, retry_after=3600)
+        limiter.wait_ready()
+        assert clock.sleeps == [60]
+
+
+@pytest.mark.unit
+class TestPersistence:
+    """Test that learned limits carry over between alert runs."""
+
+    def test_limit_is_kept_per_server(self):
+        with LocalStore() as store:
+            limiter = load_limit(store, URL, 8, now=1000)
+            assert limiter.current == 8
+            limiter.record(1.0, 503)
+            save_limit(store, URL, limiter, now=1000)
+
+            assert load_limit(store, URL, 8, now=1001).current == 4
+            assert load_limit(store, 'https://other.example.com', 8, now=1001).current == 8
+
+    def test_lower_workers_cap_the_stored_limit(self):
+        with LocalStore() as store:
+            save_limit(store, URL, ConcurrencyLimit(16), now=1000)
+            assert load_limit(store, URL, 2, now=1001).current == 2
+
+    def test_limit_expires(self):
+        with LocalStore() as store:
+            limiter = ConcurrencyLimit(8, initial=2)
+            save_limit(store, URL, limiter, now=1000)
+            assert load_limit(store, URL, 8, now=1000 + 8 * 24 * 3600).current == 8
+
+
+@pytest.mark.unit
+class TestAdaptiveSender:
+    """Test the sender with an adaptive limit."""
+
+    def test_responses_are_reported(self, requests_mock):
+        requests_mock.post(URL + '/message', [
+            {'status_code': 429, 'headers': {'Retry-After': '2'}},
+            {'status_code': 200},
+        ])
+        clock = FakeClock()
+        limiter = ConcurrencyLimit(4, initial=1, clock=clock, sleep=clock.sleep)
+        with GotifySender(URL, 'tok', workers=4, limiter=limiter) as sender:
+            result = sender.send_many([{'message': 'a', 'priority': 5}, {'message': 'b', 'priority': 5}])
+
+        assert result.sent == 2
+        assert limiter.current == 2
+        assert clock.sleeps == [2]
+
+    def test_in_flight_follows_the_limit(self, mocker):
+        limiter = ConcurrencyLimit(8, initial=2)
+        lock = threading.Lock()
+        in_flight = [0]
+        peak = [0]
+
+        def deliver(payload):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            threading.Event().wait(0.01)
+            with lock:
+                in_flight[0] -= 1
+            return None
+
+        with GotifySender(URL, 'tok', workers=8, limiter=limiter) as sender:
+            mocker.patch.object(sender, 'deliver', side_effect=deliver)
+            result = sender.send_many([{'message': str(i), 'priority': 5} for i in range(10)])
+
+        assert result.sent == 10
+        assert peak[0] == 2
@@ -240,3 +240,39 @@ class TestAlertActionWorker:
         
         assert result == 5
         worker.log_error.assert_called()
+
+    def test_validate_params_skips_global_lookup_with_overrides(self):
+        """Test that global settings are not fetched when URL/token are overridden."""
+        worker = AlertActionWorkeralert_gotify("alert_gotify", "alert_gotify")
+
+        worker.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test message',
+            'priority': '5',
+            'url': 'https://custom.gotify.local',
+            'token': 'custom_token',
+        }.get(key))
+        worker.get_global_setting = Mock(return_value=None)
+        worker.log_error = Mock()
+
+        assert worker.validate_params() is True
+        worker.get_global_setting.assert_not_called()
+
+    def test_global_settings_resolved_once(self):
+        """Test that validation and delivery share one lookup per setting."""
+        from alert_gotify import settings
+        worker = AlertActionWorkeralert_gotify("alert_gotify", "alert_gotify")
+
+        worker.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test message',
+            'priority': '5',
+        }.get(key))
+        worker.get_global_setting = Mock(side_effect=lambda key: {
+            'gotify_url': 'https://gotify.example.com',
+            'gotify_token': 'test_token',
+        }.get(key))
+        worker.log_error = Mock()
+
+        assert worker.validate_params() is True
+        settings.get_global_setting(worker, 'gotify_url')
+        settings.get_global_setting(worker, 'gotify_token')
+        assert worker.get_global_setting.call_count == 2
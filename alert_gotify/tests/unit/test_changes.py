@@ -0,0 +1,217 @@
+# encoding = utf-8
+"""
+Unit tests for state-change tracking of results.
+"""
+import json
+import os
+import sys
+import pytest
+from unittest.mock import Mock, patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import changes, modalert_alert_gotify_helper
+from alert_gotify.store import LocalStore
+
+
+def respond(status, field):
+    """Return a requests_mock callback answering with the status of the message's field."""
+    def callback(request, context):
+        context.status_code = status[request.json()[field]]
+        return ''
+    return callback
+
+
+@pytest.mark.unit
+class TestChangeTracker:
+    """Test fingerprints and the tracker."""
+
+    def test_parse_keys(self):
+        assert changes.parse_keys(' host, check ,host') == ('host', 'check')
+        with pytest.raises(ValueError):
+            changes.parse_keys(' , ')
+
+    def test_fingerprint_uses_only_key_fields(self):
+        keys = ('host',)
+        assert changes.fingerprint({'host': 'a', 'pct': 90}, keys) == changes.fingerprint({'host': 'a'}, keys)
+        assert changes.fingerprint({'host': 'a'}, keys) != changes.fingerprint({'host': 'b'}, keys)
+        assert len(changes.fingerprint({'host': 'a'}, keys)) == changes.FINGERPRINT_SIZE
+
+    def test_only_new_rows_pass(self):
+        keys = ('host',)
+        previous = {changes.fingerprint({'host': 'a'}, keys), changes.fingerprint({'host': 'b'}, keys)}
+        tracker = changes.ChangeTracker(keys, previous)
+
+        rows = list(tracker.new_rows([{'host': 'a'}, {'host': 'c'}, {'host': 'c'}]))
+
+        assert rows == [{'host': 'c'}]
+        assert tracker.complete
+        assert tracker.new == 1
+        assert tracker.cleared == 1
+
+    def test_incomplete_until_all_results_are_read(self):
+        tracker = changes.ChangeTracker(('host',))
+        rows = tracker.new_rows([{'host': 'a'}, {'host': 'b'}])
+
+        next(rows)
+
+        assert not tracker.complete
+
+    def test_only_delivered_rows_are_kept(self):
+        keys = ('host',)
+        tracker = changes.ChangeTracker(keys, {changes.fingerprint({'host': 'a'}, keys)})
+        sent, failed, copied = {'n': 1}, {'n': 2}, {'n': 3}
+
+        rows = tracker.new_rows([{'host': 'a'}, {'host': 'b'}, {'host': 'c'}, {'host': 'd'}, {'host': 'e'}])
+        next(rows)
+        tracker.claim(sent)
+        next(rows)
+        tracker.claim(failed)
+        tracker.expect(tracker.claim(copied, [tracker.take() for _ in rows]), 2)
+        tracker.settle(sent, True)
+        tracker.settle(failed, False)
+        tracker.settle(copied, True)
+
+        fingerprints = dict((changes.fingerprint({'host': h}, keys), h) for h in 'abcde')
+        assert sorted(fingerprints[key] for key in tracker.kept()) == ['a', 'b']
+        tracker.settle(copied, True)
+        assert sorted(fingerprints[key] for key in tracker.kept()) == ['a', 'b', 'd', 'e']
+        assert tracker.messages == {}
+
+    def test_state_round_trip(self):
+        keys = ('host',)
+        tracker = changes.ChangeTracker(keys)
+        list(tracker.new_rows({'host': str(i)} for i in range(100)))
+        tracker.settle(tracker.claim({}), True)
+
+        with LocalStore() as store:
+            changes.save_tracker(store, 'key', tracker, now=1000)
+            loaded = changes.load_tracker(store, 'key', keys, now=1001)
+            assert loaded.previous == tracker.seen
+            assert changes.load_tracker(store, 'key', ('other',), now=1001).previous == set()
+            assert changes.load_tracker(store, 'key', keys, now=1000 + 3601).previous == set()
+
+
+@pytest.mark.unit
+class TestStateChangeAlerts:
+    """Test state tracking in the alert action."""
+
+    def _set_params(self, helper, **overrides):
+        params = {
+            'message': '$result.host$ is down',
+            'title': 'Hosts down',
+            'priority': '5',
+            'state_keys': 'host',
+        }
+        params.update(overrides)
+        helper.get_param = Mock(side_effect=lambda key: params.get(key))
+        helper.search_name = 'Host check'
+
+    def _run(self, helper, hosts):
+        helper.get_events = Mock(return_value=iter([{'host': host} for host in hosts]))
+        return modalert_alert_gotify_helper.process_event(helper)
+
+    def test_per_result_sends_new_and_cleared(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, mode='per_result')
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        assert self._run(mock_helper, ['a', 'b']) == 0
+        assert requests_mock.call_count == 2
+
+        assert self._run(mock_helper, ['a', 'b']) == 0
+        assert requests_mock.call_count == 2
+
+        assert self._run(mock_helper, ['b', 'c']) == 0
+        messages = [request.json() for request in requests_mock.request_history[2:]]
+        assert messages[0]['message'] == 'c is down'
+        assert messages[1] == {
+            'message': '1 result(s) of the last run cleared', 'title': 'Hosts down (cleared)', 'priority': 5
+        }
+
+    def test_failed_run_keeps_rows_new(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, mode='per_result')
+        requests_mock.post('https://gotify.example.com/message', status_code=401)
+
+        assert self._run(mock_helper, ['a', 'b']) == 1
+        assert requests_mock.call_count == 2
+
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+        assert self._run(mock_helper, ['a', 'b']) == 0
+        assert sorted(request.json()['message'] for request in requests_mock.request_history[2:]) == [
+            'a is down', 'b is down'
+        ]
+
+        assert self._run(mock_helper, ['a', 'b']) == 0
+        assert requests_mock.call_count == 4
+
+    def test_rate_limited_rows_stay_new(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, mode='per_result', rate_limit='60', rate_burst='1')
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        assert self._run(mock_helper, ['a', 'b']) == 0
+        assert requests_mock.call_count == 1
+
+        self._set_params(mock_helper, mode='per_result')
+        assert self._run(mock_helper, ['a', 'b']) == 0
+        assert requests_mock.call_count == 2
+        assert requests_mock.last_request.json()['message'] == 'b is down'
+
+    def test_only_undelivered_rows_are_sent_again(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, mode='per_result')
+        status = {'a is down': 503, 'b is down': 200, 'c is down': 401}
+        requests_mock.post('https://gotify.example.com/message', text=respond(status, 'message'))
+
+        assert self._run(mock_helper, ['a', 'b', 'c']) == 1
+        with LocalStore() as store:
+            assert store.spool_size() == 1
+        sent = len(requests_mock.request_history)
+
+        status.update({'a is down': 200, 'c is down': 200})
+        assert self._run(mock_helper, ['a', 'b', 'c']) == 0
+        assert [r.json()['message'] for r in requests_mock.request_history[sent:]] == ['c is down']
+
+    def test_digest_rows_follow_their_group(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, mode='digest', group_by='team', message='$result.host$')
+        status = {'Hosts down [team=x]': 200, 'Hosts down [team=y]': 401}
+        requests_mock.post('https://gotify.example.com/message', text=respond(status, 'title'))
+        rows = [{'host': 'a', 'team': 'x'}, {'host': 'b', 'team': 'y'}, {'host': 'c', 'team': 'x'}]
+
+        mock_helper.get_events = Mock(return_value=iter(rows))
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+
+        status['Hosts down [team=y]'] = 200
+        mock_helper.get_events = Mock(return_value=iter(rows))
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+        assert requests_mock.last_request.json()['message'] == 'b'
+        assert requests_mock.call_count == 3
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_single_mode_sends_only_on_new_rows(self, mock_post, mock_helper):
+        self._set_params(mock_helper)
+        mock_post.return_value = Mock(status_code=200)
+
+        assert self._run(mock_helper, ['a']) == 0
+        assert mock_post.call_count == 1
+
+        assert self._run(mock_helper, ['a']) == 0
+        assert mock_post.call_count == 1
+        mock_helper.log_info.assert_any_call("No new results since the last run, not sending")
+
+        assert self._run(mock_helper, ['a', 'b']) == 0
+        assert mock_post.call_count == 2
+        assert json.loads(mock_post.call_args[1]['data'])['message'] == 'b is down'
+
+    def test_state_is_per_saved_search(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, mode='per_result')
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+        self._run(mock_helper, ['a'])
+
+        mock_helper.search_name = 'Other check'
+        self._run(mock_helper, ['a'])
+
+        assert requests_mock.call_count == 2
+
+    def test_invalid_state_keys(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, state_keys=',')
+
+        assert self._run(mock_helper, ['a']) == 1
+        assert requests_mock.call_count == 0
@@ -0,0 +1,139 @@
+# encoding = utf-8
+"""
+Unit tests for cross-alert coalescing.
+"""
+import json
+import os
+import sys
+import pytest
+from unittest.mock import Mock, patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import coalesce, modalert_alert_gotify_helper
+from alert_gotify.store import LocalStore
+from alert_gotify.throttle import token_key
+
+KEY = 'key'
+
+
+def message(text, title=None, priority=5):
+    payload = {'message': text, 'priority': priority}
+    if title:
+        payload['title'] = title
+    return payload
+
+
+@pytest.fixture
+def store():
+    with LocalStore() as s:
+        yield s
+
+
+@pytest.mark.unit
+class TestWindow:
+    """Test joining and collecting a window in the local store."""
+
+    def test_first_member_holds_the_window(self, store):
+        assert coalesce.join(store, KEY, message('a'), 10, 'm1', now=1000) == 1010
+        assert coalesce.join(store, KEY, message('b'), 10, 'm2', now=1005) is None
+        assert coalesce.join(store, KEY, message('c'), 10, 'm3', now=1012) is None
+
+        assert coalesce.collect(store, KEY, 'm1', now=1010) == [message('a'), message('b'), message('c')]
+
+    def test_new_window_after_collection(self, store):
+        coalesce.join(store, KEY, message('a'), 10, 'm1', now=1000)
+        coalesce.collect(store, KEY, 'm1', now=1010)
+
+        assert coalesce.join(store, KEY, message('b'), 10, 'm2', now=1011) == 1021
+
+    def test_windows_are_per_key(self, store):
+        coalesce.join(store, KEY, message('a'), 10, 'm1', now=1000)
+
+        assert coalesce.join(store, 'other', message('b'), 10, 'm2', now=1001) == 1011
+
+    def test_stale_window_is_taken_over(self, store):
+        coalesce.join(store, KEY, message('a'), 10, 'm1', now=1000)
+
+        closes = coalesce.join(store, KEY, message('b'), 10, 'm2', now=1010 + coalesce.STALE_AFTER + 1)
+
+        assert closes == 1010 + coalesce.STALE_AFTER + 11
+        assert coalesce.collect(store, KEY, 'm1', now=closes) == []
+        assert coalesce.collect(store, KEY, 'm2', now=closes) == [message('a'), message('b')]
+
+
+@pytest.mark.unit
+class TestCombine:
+    """Test building the combined notification."""
+
+    def test_single_message_is_kept(self):
+        assert coalesce.combine([message('Disk full', 'web01', 7)]) == message('Disk full', 'web01', 7)
+
+    def test_messages_are_combined(self):
+        payload = coalesce.combine([
+            message('Disk full', 'Disk alert', 4),
+            message('Host down', 'Ping alert', 8),
+            message('No title'),
+        ])
+
+        assert payload['title'] == '3 alerts: Disk alert, Ping alert'
+        assert payload['message'] == 'Disk alert\nDisk full\n\nPing alert\nHost down\n\nNo title'
+        assert payload['priority'] == 8
+
+    def test_markdown_headings(self):
+        payload = coalesce.combine([message('a', 'A'), message('b', 'B')], markdown=True)
+
+        assert payload['message'] == '**A**\na\n\n**B**\nb'
+        assert payload['extras'] == {'client::display': {'contentType': 'text/markdown'}}
+
+    def test_long_title_is_cut(self):
+        payload = coalesce.combine([message('m', 't' * 200), message('m', 'u' * 200)])
+
+        assert len(payload['title']) == coalesce.MAX_TITLE_LENGTH
+
+
+@pytest.mark.unit
+class TestCoalescingAlerts:
+    """Test coalescing in the alert action's single mode."""
+
+    def _set_params(self, helper):
+        helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Disk full',
+            'title': 'Disk alert',
+            'priority': '5',
+            'coalesce_window': '5',
+        }.get(key))
+
+    def _key(self):
+        return token_key('https://gotify.example.com', 'test_global_token')
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_later_alert_joins_the_window(self, mock_post, mock_helper):
+        self._set_params(mock_helper)
+        with LocalStore() as store:
+            coalesce.join(store, self._key(), message('Host down', 'Ping alert'), 60, 'other')
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 0
+        mock_post.assert_not_called()
+        with LocalStore() as store:
+            messages = coalesce.collect(store, self._key(), 'other')
+        assert [payload['message'] for payload in messages] == ['Host down', 'Disk full']
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_first_alert_sends_the_combined_message(self, mock_post, mock_helper, no_retry_sleep):
+        self._set_params(mock_helper)
+        mock_post.return_value = Mock(status_code=200)
+
+        def other_alert_fires(closes):
+            with LocalStore() as store:
+                coalesce.join(store, self._key(), message('Host down', 'Ping alert', 8), 5, 'other')
+
+        with patch('alert_gotify.coalesce.wait', side_effect=other_alert_fires):
+            result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 0
+        payload = json.loads(mock_post.call_args[1]['data'])
+        assert payload['title'] == '2 alerts: Disk alert, Ping alert'
+        assert payload['priority'] == 8
+        mock_helper.log_info.assert_any_call("Sending 2 coalesced Gotify messages as one notification")
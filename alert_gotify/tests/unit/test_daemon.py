@@ -0,0 +1,147 @@
+# encoding = utf-8
+"""
+Unit tests for the delivery daemon and its client.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import daemon
+from alert_gotify.store import LocalStore
+
+pytestmark = pytest.mark.skipif(not daemon.is_supported(), reason="requires Unix domain sockets")
+
+URL = 'https://gotify.example.com'
+
+
+@pytest.fixture
+def short_state_dir(monkeypatch):
+    """Unix socket paths are limited to about 100 bytes, so keep the state directory short."""
+    path = tempfile.mkdtemp(prefix="ag")
+    monkeypatch.setenv("ALERT_GOTIFY_STATE_DIR", path)
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+@pytest.fixture
+def running_daemon(short_state_dir):
+    server = daemon.DeliveryDaemon(workers=2, drain_interval=3600)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    assert server.ready.wait(5)
+    yield server
+    server.stop()
+    thread.join(5)
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _spool_size():
+    with LocalStore() as store:
+        return store.spool_size()
+
+
+@pytest.mark.unit
+class TestDaemonClient:
+    """Test the client side of the socket protocol."""
+
+    def test_connect_without_daemon(self, short_state_dir):
+        assert daemon.DaemonClient().connect() is False
+
+    def test_messages_are_delivered(self, running_daemon, requests_mock):
+        requests_mock.post(URL + '/message', status_code=200)
+
+        client = daemon.DaemonClient()
+        assert client.connect()
+        for i in range(5):
+            client.send(URL, 'tok', True, {'message': str(i), 'priority': 5})
+        assert client.finish() == 5
+
+        assert _wait_for(lambda: requests_mock.call_count == 5)
+        assert sorted(r.json()['message'] for r in requests_mock.request_history) == ['0', '1', '2', '3', '4']
+        assert requests_mock.last_request.headers['X-Gotify-Key'] == 'tok'
+
+    def test_slow_client_is_not_dropped(self, running_daemon, requests_mock, monkeypatch):
+        monkeypatch.setattr(daemon, 'CLIENT_TIMEOUT', 0.1)
+        requests_mock.post(URL + '/message', status_code=200)
+
+        client = daemon.DaemonClient()
+        assert client.connect()
+        client.send(URL, 'tok', True, {'message': 'first', 'priority': 5})
+        # Results are rendered lazily, so the next message can take longer than the client timeout
+        time.sleep(0.3)
+        client.send(URL, 'tok', True, {'message': 'second', 'priority': 5})
+
+        assert client.finish() == 2
+
+    def test_socket_is_private(self, running_daemon):
+        assert os.stat(running_daemon.socket_path).st_mode & 0o077 == 0
+
+
+@pytest.mark.unit
+class TestDeliveryDaemon:
+    """Test delivery, spooling and shutdown of the daemon."""
+
+    def test_retryable_failure_is_spooled(self, running_daemon, requests_mock):
+        requests_mock.post(URL + '/message', status_code=503)
+
+        client = daemon.DaemonClient()
+        assert client.connect()
+        client.send(URL, 'tok', True, {'message': 'm', 'priority': 5})
+        client.finish()
+
+        assert _wait_for(lambda: LocalStore.exists() and _spool_size() == 1)
+
+    def test_client_error_is_not_spooled(self, running_daemon, requests_mock):
+        requests_mock.post(URL + '/message', status_code=400)
+
+        client = daemon.DaemonClient()
+        assert client.connect()
+        client.send(URL, 'tok', True, {'message': 'm', 'priority': 5})
+        client.finish()
+
+        assert _wait_for(lambda: requests_mock.call_count == 1)
+        running_daemon.stop()
+        assert not LocalStore.exists() or _spool_size() == 0
+
+    def test_queued_messages_are_spooled_at_shutdown(self, short_state_dir):
+        server = daemon.DeliveryDaemon(workers=0, drain_interval=3600)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        assert server.ready.wait(5)
+
+        client = daemon.DaemonClient()
+        assert client.connect()
+        for _ in range(3):
+            client.send(URL, 'tok', True, {'message': 'm', 'priority': 5})
+        assert client.finish() == 3
+
+        server.stop()
+        thread.join(5)
+        assert _spool_size() == 3
+        assert not os.path.exists(server.socket_path)
+
+    def test_already_running(self, running_daemon):
+        assert daemon.DeliveryDaemon().already_running()
+
+    def test_stale_socket_is_removed(self, short_state_dir):
+        import socket
+        path = daemon.default_socket_path()
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+
+        assert daemon.DeliveryDaemon().already_running() is False
+        assert not os.path.exists(path)
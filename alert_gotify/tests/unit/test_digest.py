@@ -0,0 +1,59 @@
+# encoding = utf-8
+"""
+Unit tests for the digest aggregation module.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import digest
+from alert_gotify.templating import Template
+
+
+def _builder(**kwargs):
+    return digest.DigestBuilder(Template('$result.host$: $result.msg$'), Template('Alert'), **kwargs)
+
+
+@pytest.mark.unit
+class TestDigestBuilder:
+    """Test grouping, row caps and byte budgets."""
+
+    def test_single_group(self):
+        results = [{'host': 'h{}'.format(i), 'msg': 'down'} for i in range(3)]
+        digests = list(digest.build_digests(results, _builder()))
+        assert digests == [('Alert', 'h0: down\nh1: down\nh2: down')]
+
+    def test_row_cap_splits_into_parts(self):
+        results = [{'host': 'h{}'.format(i), 'msg': 'x'} for i in range(5)]
+        digests = list(digest.build_digests(results, _builder(max_rows=2)))
+        assert [title for title, _ in digests] == ['Alert', 'Alert (part 2)', 'Alert (part 3)']
+        assert digests[2][1] == 'h4: x'
+
+    def test_group_by_field(self):
+        results = [
+            {'host': 'a', 'msg': '1', 'team': 'ops'},
+            {'host': 'b', 'msg': '2', 'team': 'dba'},
+            {'host': 'c', 'msg': '3', 'team': 'ops'},
+        ]
+        digests = dict(digest.build_digests(results, _builder(group_by='team')))
+        assert digests == {
+            'Alert [team=ops]': 'a: 1\nc: 3',
+            'Alert [team=dba]': 'b: 2',
+        }
+
+    def test_byte_budget(self):
+        results = [{'host': 'h', 'msg': 'x' * 10} for _ in range(4)]
+        digests = list(digest.build_digests(results, _builder(max_bytes=30)))
+        # Each line is 13 bytes; two lines plus a separator fit in 30 bytes
+        assert len(digests) == 2
+        assert all(len(message.encode('utf-8')) <= 30 for _, message in digests)
+
+    def test_oversized_line_is_truncated_on_character_boundary(self):
+        results = [{'host': 'h', 'msg': 'é' * 20}]
+        [(_, message)] = digest.build_digests(results, _builder(max_bytes=10))
+        assert len(message.encode('utf-8')) <= 10
+        message.encode('utf-8').decode('utf-8')
+
+    def test_no_results(self):
+        assert list(digest.build_digests([], _builder())) == []
@@ -0,0 +1,132 @@
+# encoding = utf-8
+"""
+Unit tests for the multi-target asyncio delivery engine.
+"""
+import os
+import sys
+import threading
+import time
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import fanout
+from alert_gotify.resilience import RetryPolicy
+
+
+def _slow(seconds, status_code=200):
+    def callback(request, context):
+        time.sleep(seconds)
+        context.status_code = status_code
+        return ''
+    return callback
+
+
+@pytest.mark.unit
+class TestParseTargets:
+    """Test parsing of the targets parameter."""
+
+    def test_entries_and_default_token(self):
+        targets = fanout.parse_targets('https://a.example.com|tokA, https://b.example.com\nhttps://a.example.com|tokA', 'dflt')
+        assert targets == [
+            fanout.Target('https://a.example.com', 'tokA'),
+            fanout.Target('https://b.example.com', 'dflt'),
+        ]
+
+    def test_empty(self):
+        assert fanout.parse_targets(None, 'tok') == []
+        assert fanout.parse_targets(' , ', 'tok') == []
+
+    def test_invalid_url(self):
+        with pytest.raises(ValueError):
+            fanout.parse_targets('gotify.example.com|tok', 'dflt')
+
+
+@pytest.mark.unit
+class TestFanOut:
+    """Test concurrent delivery to several targets."""
+
+    def test_targets_are_sent_concurrently(self, fake_gotify):
+        # requests_mock serializes requests, so this uses a real local server
+        server = fake_gotify(latency=0.2)
+        targets = [fanout.Target(server.url, 'tok{}'.format(i)) for i in range(10)]
+
+        start = time.monotonic()
+        with fanout.FanOut(targets, host_connections=10) as engine:
+            results = engine.send((target, {'message': 'm', 'priority': 5}) for target in targets)
+        elapsed = time.monotonic() - start
+
+        assert all(result.sent == 1 for result in results.values())
+        assert elapsed < 1.0
+
+    def test_per_host_connection_limit(self, requests_mock):
+        target = fanout.Target('https://gotify.example.com', 'tok')
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def callback(request, context):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            threading.Event().wait(0.05)
+            with lock:
+                active.pop()
+            return ''
+        requests_mock.post(target.url + '/message', text=callback)
+
+        with fanout.FanOut([target], host_connections=2) as engine:
+            results = engine.send((target, {'message': str(i), 'priority': 5}) for i in range(8))
+
+        assert results[target].sent == 8
+        assert max(peak) <= 2
+
+    def test_deadline_fails_unsent_jobs(self, requests_mock):
+        target = fanout.Target('https://gotify.example.com', 'tok')
+        requests_mock.post(target.url + '/message', text=_slow(1.0))
+        outcomes = []
+
+        with fanout.FanOut([target], host_connections=1, deadline=0.2, retry=RetryPolicy(0)) as engine:
+            results = engine.send(
+                ((target, {'message': str(i), 'priority': 5}) for i in range(3)),
+                on_result=lambda t, payload, error: outcomes.append((payload['message'], error))
+            )
+
+        # The request running at the deadline is waited for; the other two were never sent
+        outcomes = dict(outcomes)
+        assert results[target].sent == 1
+        assert results[target].failed == 2
+        assert outcomes['0'] is None
+        assert outcomes['1'].retryable and outcomes['2'].retryable
+
+    def test_request_outlasting_the_deadline_is_not_retried(self, requests_mock, mocker):
+        target = fanout.Target('https://gotify.example.com', 'tok')
+        requests_mock.post(target.url + '/message', text=_slow(1.0))
+        outcomes = []
+
+        with fanout.FanOut([target], host_connections=1, deadline=0.1, timeout=(1.0, 0.2),
+                           retry=RetryPolicy(0)) as engine:
+            close = mocker.spy(engine.senders[target], 'close')
+            results = engine.send(
+                [(target, {'message': 'm', 'priority': 5})],
+                on_result=lambda t, payload, error: outcomes.append(error)
+            )
+
+        assert results[target].failed == 1
+        assert not outcomes[0].retryable
+        assert 'may have been delivered' in str(outcomes[0])
+        assert engine.abandoned == 1
+        # The running request keeps its session
+        close.assert_not_called()
+
+    def test_failures_are_reported_per_target(self, requests_mock):
+        good = fanout.Target('https://good.example.com', 'tok')
+        bad = fanout.Target('https://bad.example.com', 'tok')
+        requests_mock.post(good.url + '/message', status_code=200)
+        requests_mock.post(bad.url + '/message', status_code=400)
+
+        with fanout.FanOut([good, bad], retry=RetryPolicy(0)) as engine:
+            results = engine.send([(good, {'message': 'm'}), (bad, {'message': 'm'})])
+
+        assert results[good].sent == 1
+        assert results[bad].failed == 1
+        assert '400' in results[bad].errors[0]
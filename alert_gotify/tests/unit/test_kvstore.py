@@ -0,0 +1,221 @@
+# encoding = utf-8
+"""
+Unit tests for delivery state shared through the KV store.
+"""
+import json
+import os
+import sys
+import time
+import pytest
+from unittest.mock import Mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import coalesce, kvstore, modalert_alert_gotify_helper
+from alert_gotify.kvstore import KVStoreClient, KVStoreState, document_key
+from alert_gotify.store import LocalStore
+from alert_gotify.throttle import token_key
+
+COLLECTION_URL = 'https://127.0.0.1:8089/servicesNS/nobody/alert_gotify/storage/collections/data/alert_gotify_state'
+
+
+def document(namespace, key, value, expires=None):
+    return {'_key': document_key(namespace, key), 'namespace': namespace, 'key': key,
+            'value': json.dumps(value), 'expires': expires}
+
+
+def saved(requests_mock):
+    """Return the documents of all batch_save requests."""
+    documents = []
+    for request in requests_mock.request_history:
+        if request.url.endswith('/batch_save'):
+            documents.extend(request.json())
+    return documents
+
+
+def gets(requests_mock):
+    return [r for r in requests_mock.request_history if r.method == 'GET']
+
+
+@pytest.fixture
+def client():
+    client = KVStoreClient(kvstore.DEFAULT_SERVER_URI, 'session')
+    yield client
+    client.close()
+
+
+@pytest.mark.unit
+class TestKVStoreState:
+    """Test kv_get/kv_update on the KV store collection."""
+
+    def test_reads_once_and_writes_once(self, requests_mock, client):
+        requests_mock.get(COLLECTION_URL, json=[document('ns', 'a', 1)])
+        requests_mock.post(COLLECTION_URL + '/batch_save', json=[])
+        state = KVStoreState(client)
+
+        assert state.kv_get('ns', 'a', 1000) == 1
+        assert state.kv_update('ns', 'a', lambda old: old + 1, 1000, ttl=60) == 2
+        assert state.kv_update('ns', 'b', lambda old: 'x', 1000) == 'x'
+        state.finish()
+
+        assert len(gets(requests_mock)) == 1
+        assert requests_mock.last_request.headers['Authorization'] == 'Splunk session'
+        documents = dict((d['key'], d) for d in saved(requests_mock))
+        assert json.loads(documents['a']['value']) == 2
+        assert documents['a']['expires'] == 1060
+        assert documents['b']['expires'] is None
+
+    def test_expired_documents_are_ignored(self, requests_mock, client):
+        requests_mock.get(COLLECTION_URL, json=[document('ns', 'a', 1, expires=900)])
+        state = KVStoreState(client)
+
+        assert state.kv_get('ns', 'a', 1000) is None
+
+    def test_delete_writes_expired_document(self, requests_mock, client):
+        requests_mock.get(COLLECTION_URL, json=[document('ns', 'a', 1)])
+        requests_mock.post(COLLECTION_URL + '/batch_save', json=[])
+        state = KVStoreState(client)
+
+        state.kv_update('ns', 'a', lambda old: None, 1000)
+        state.finish()
+
+        assert state.kv_get('ns', 'a', 1000) is None
+        assert saved(requests_mock)[0]['expires'] == 1000
+
+    def test_nothing_written_without_changes(self, requests_mock, client):
+        requests_mock.get(COLLECTION_URL, json=[])
+        state = KVStoreState(client)
+
+        state.kv_get('ns', 'a', 1000)
+        state.close()
+        state.finish()
+
+        assert saved(requests_mock) == []
+
+    def test_snapshot_is_reused_within_cache_ttl(self, requests_mock, client):
+        requests_mock.get(COLLECTION_URL, json=[])
+        requests_mock.post(COLLECTION_URL + '/batch_save', json=[])
+        with LocalStore() as cache:
+            first = KVStoreState(client, cache=cache)
+            first.kv_update('ns', 'a', lambda old: 1, 1000)
+            first.flush(1000)
+
+            second = KVStoreState(client, cache=cache)
+            assert second.kv_get('ns', 'a', 1001) == 1
+
+            third = KVStoreState(client, cache=cache)
+            assert third.kv_get('ns', 'a', 1000 + kvstore.DEFAULT_CACHE_TTL + 1) is None
+
+        assert len(gets(requests_mock)) == 2
+
+    def test_falls_back_to_local_store(self, requests_mock, client):
+        requests_mock.get(COLLECTION_URL, status_code=503, text='KV Store is initializing')
+        on_error = Mock()
+        state = KVStoreState(client, on_error=on_error)
+
+        assert state.kv_update('ns', 'a', lambda old: 1, 1000) == 1
+        assert state.kv_get('ns', 'a', 1000) == 1
+        state.finish()
+
+        on_error.assert_called_once()
+        assert 'status 503' in on_error.call_args[0][0]
+        with LocalStore() as store:
+            assert store.kv_get('ns', 'a', 1000) == 1
+
+    def test_purge_deletes_expired_documents(self, requests_mock, client, monkeypatch):
+        monkeypatch.setattr(kvstore, 'PURGE_PROBABILITY', 1)
+        requests_mock.delete(COLLECTION_URL, json={})
+        state = KVStoreState(client)
+
+        state.kv_purge(1000)
+
+        assert json.loads(requests_mock.last_request.qs['query'][0]) == {'expires': {'$lte': 1000}}
+
+    def test_certificate_is_not_verified_with_ca_bundle(self, requests_mock, client, monkeypatch):
+        monkeypatch.setenv('REQUESTS_CA_BUNDLE', '/etc/ssl/certs/ca-certificates.crt')
+        requests_mock.get(COLLECTION_URL, json=[])
+        requests_mock.post(COLLECTION_URL + '/batch_save', json=[])
+        requests_mock.delete(COLLECTION_URL, json={})
+
+        client.query({})
+        client.batch_save([{'_key': 'a'}])
+        client.delete({})
+
+        assert [r.verify for r in requests_mock.request_history] == [False, False, False]
+
+    def test_batch_save_is_chunked(self, requests_mock, client):
+        requests_mock.post(COLLECTION_URL + '/batch_save', json=[])
+
+        client.batch_save([{'_key': str(i)} for i in range(kvstore.MAX_BATCH + 1)])
+
+        assert [len(r.json()) for r in requests_mock.request_history] == [kvstore.MAX_BATCH, 1]
+
+
+@pytest.mark.unit
+class TestSharedState:
+    """Test the alert action with shared_state = kvstore."""
+
+    @pytest.fixture(autouse=True)
+    def no_purge(self, monkeypatch):
+        monkeypatch.setattr(kvstore, 'PURGE_PROBABILITY', 0)
+
+    def _set_params(self, helper, **params):
+        values = {'message': 'Test', 'priority': '5', 'dedup_window': '300', 'shared_state': 'kvstore'}
+        values.update(params)
+        helper.get_param = Mock(side_effect=lambda key: values.get(key))
+        helper.session_key = 'session'
+
+    def test_duplicate_across_members_is_suppressed(self, requests_mock, mock_helper):
+        self._set_params(mock_helper)
+        requests_mock.get(COLLECTION_URL, json=[])
+        requests_mock.post(COLLECTION_URL + '/batch_save', json=[])
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+        documents = saved(requests_mock)
+        assert len(documents) == 1
+
+        # Another member has no snapshot and reads the document written by the first alert
+        with LocalStore() as store:
+            store.kv_update(kvstore.CACHE_NAMESPACE, COLLECTION_URL, lambda old: None, time.time())
+        requests_mock.get(COLLECTION_URL, json=documents)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+
+        posts = [r for r in requests_mock.request_history if r.url == 'https://gotify.example.com/message']
+        assert len(posts) == 1
+        assert len(gets(requests_mock)) == 2
+
+    def test_one_read_and_one_write_per_run(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, rate_limit='60', mode='per_result', message='$result.n$')
+        mock_helper.get_events = Mock(return_value=({'n': str(i)} for i in range(3)))
+        requests_mock.get(COLLECTION_URL, json=[])
+        requests_mock.post(COLLECTION_URL + '/batch_save', json=[])
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+
+        kv_requests = [r for r in requests_mock.request_history if r.url.startswith(COLLECTION_URL)]
+        assert [r.method for r in kv_requests] == ['GET', 'POST']
+
+    def test_coalescing_window_stays_local(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, dedup_window=None, coalesce_window='5')
+        requests_mock.get(COLLECTION_URL, json=[])
+        requests_mock.post(COLLECTION_URL + '/batch_save', json=[])
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+        key = token_key('https://gotify.example.com', 'test_global_token')
+        with LocalStore() as store:
+            coalesce.join(store, key, {'message': 'Host down', 'priority': 8}, 60, 'other')
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+
+        assert not any(r.url == 'https://gotify.example.com/message' for r in requests_mock.request_history)
+        assert saved(requests_mock) == []
+        with LocalStore() as store:
+            messages = coalesce.collect(store, key, 'other')
+        assert [payload['message'] for payload in messages] == ['Host down', 'Test']
+
+    def test_invalid_shared_state(self, mock_helper):
+        self._set_params(mock_helper, shared_state='redis')
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+        mock_helper.log_error.assert_any_call("Invalid shared_state 'redis'. Expected one of: local, kvstore")
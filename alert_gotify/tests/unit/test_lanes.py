@@ -0,0 +1,116 @@
+# encoding = utf-8
+"""
+Unit tests for the priority lane scheduler.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import lanes
+
+
+def _message(priority, text='m', title=None, url='https://gotify.example.com'):
+    payload = {'message': text, 'priority': priority}
+    if title:
+        payload['title'] = title
+    return {'url': url, 'token': 'tok', 'ssl_verify': True, 'payload': payload}
+
+
+def _texts(scheduler):
+    texts = []
+    while len(scheduler):
+        texts.append(scheduler.get(timeout=0)['payload']['message'])
+    return texts
+
+
+@pytest.mark.unit
+class TestLaneHelpers:
+    """Test priority bands and weight parsing."""
+
+    def test_lane_for(self):
+        assert lanes.lane_for(10) == 0
+        assert lanes.lane_for('8') == 0
+        assert lanes.lane_for(5) == 1
+        assert lanes.lane_for(2) == 2
+        assert lanes.lane_for(None) == 2
+
+    def test_parse_weights(self):
+        assert lanes.parse_weights(None) == lanes.DEFAULT_WEIGHTS
+        assert lanes.parse_weights('4,2,1') == (4, 2, 1)
+        with pytest.raises(ValueError):
+            lanes.parse_weights('4,2')
+        with pytest.raises(ValueError):
+            lanes.parse_weights('4,0,1')
+
+
+@pytest.mark.unit
+class TestLaneScheduler:
+    """Test weighted draining, coalescing and shedding."""
+
+    def test_high_priority_first(self):
+        scheduler = lanes.LaneScheduler()
+        for i in range(3):
+            scheduler.put(_message(2, 'low{}'.format(i)))
+        scheduler.put(_message(10, 'page'))
+
+        assert _texts(scheduler)[0] == 'page'
+
+    def test_weighted_round_robin(self):
+        scheduler = lanes.LaneScheduler(weights=(2, 1, 1))
+        for i in range(4):
+            scheduler.put(_message(10, 'h{}'.format(i)))
+            scheduler.put(_message(5, 'n{}'.format(i)))
+            scheduler.put(_message(1, 'l{}'.format(i)))
+
+        assert _texts(scheduler)[:8] == ['h0', 'h1', 'n0', 'l0', 'h2', 'h3', 'n1', 'l1']
+
+    def test_get_times_out(self):
+        assert lanes.LaneScheduler().get(timeout=0.01) is None
+
+    def test_low_priority_is_coalesced_under_backpressure(self):
+        scheduler = lanes.LaneScheduler(capacity=10, coalesce_threshold=0.2)
+        scheduler.put(_message(1, 'a', title='disk'))
+        scheduler.put(_message(1, 'b', title='disk'))
+        # Below the threshold nothing is coalesced
+        assert len(scheduler) == 2
+
+        scheduler.put(_message(1, 'c', title='disk'))
+        scheduler.put(_message(1, 'd', title='cpu'))
+
+        assert len(scheduler) == 3
+        assert scheduler.coalesced == 1
+        assert _texts(scheduler) == ['a', 'b\nc', 'd']
+
+    def test_high_priority_is_never_coalesced(self):
+        scheduler = lanes.LaneScheduler(capacity=10, coalesce_threshold=0)
+        scheduler.put(_message(9, 'a', title='x'))
+        scheduler.put(_message(9, 'b', title='x'))
+        assert len(scheduler) == 2
+
+    def test_full_queue_sheds_lowest_band(self):
+        scheduler = lanes.LaneScheduler(capacity=2, coalesce_threshold=1)
+        assert scheduler.put(_message(1, 'low')) == []
+        assert scheduler.put(_message(5, 'normal')) == []
+
+        shed = scheduler.put(_message(10, 'page'))
+
+        assert [m['payload']['message'] for m in shed] == ['low']
+        assert _texts(scheduler) == ['page', 'normal']
+
+    def test_full_queue_sheds_new_message_when_outranked(self):
+        scheduler = lanes.LaneScheduler(capacity=1)
+        scheduler.put(_message(10, 'page'))
+
+        shed = scheduler.put(_message(1, 'low'))
+
+        assert [m['payload']['message'] for m in shed] == ['low']
+        assert scheduler.shed == 1
+
+    def test_drain(self):
+        scheduler = lanes.LaneScheduler()
+        scheduler.put(_message(1, 'low'))
+        scheduler.put(_message(10, 'page'))
+
+        assert [m['payload']['message'] for m in scheduler.drain()] == ['page', 'low']
+        assert len(scheduler) == 0
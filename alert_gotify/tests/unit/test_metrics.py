@@ -0,0 +1,112 @@
+# encoding = utf-8
+"""
+Unit tests for the metrics module.
+"""
+import json
+import os
+import sys
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import metrics, sender
+
+
+@pytest.mark.unit
+class TestMetrics:
+    """Test span and counter collection."""
+
+    def test_spans_and_counters(self):
+        m = metrics.Metrics()
+        with m.span('build'):
+            pass
+        m.observe('build', 0.5)
+        m.incr('sent')
+        m.incr('sent', 2)
+        m.incr('failed', 0)
+
+        document = m.as_dict(mode='single')
+        assert document['mode'] == 'single'
+        assert document['spans_ms']['build'] >= 500
+        assert document['counters'] == {'sent': 3}
+
+    def test_timed_iter(self):
+        m = metrics.Metrics()
+        assert list(m.timed_iter('build', iter([1, 2, 3]))) == [1, 2, 3]
+        assert 'build' in m.spans
+
+    def test_timed_post_counts_attempts(self, requests_mock):
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+        m = metrics.Metrics()
+
+        m.timed(requests.post)('https://gotify.example.com/message', json={})
+
+        assert m.counters['attempts'] == 1
+        assert 'request' in m.spans and 'response' in m.spans
+
+    def test_timed_post_records_failures(self):
+        m = metrics.Metrics()
+
+        def refused(*args, **kwargs):
+            raise requests.exceptions.ConnectionError('refused')
+
+        with pytest.raises(requests.exceptions.ConnectionError):
+            m.timed(refused)()
+        assert m.counters['attempts'] == 1
+        assert 'request' in m.spans
+
+    def test_connection_setup_is_timed(self, fake_gotify):
+        server = fake_gotify()
+        m = metrics.Metrics().activate()
+        with sender.new_session() as session:
+            for _ in range(3):
+                session.post(server.url + '/message', json={}, headers={'X-Gotify-Key': 'tok'})
+
+        assert m.counters['connections'] == 1
+        assert m.spans['connect'] > 0
+
+    def test_other_connections_are_not_timed(self, fake_gotify):
+        server = fake_gotify()
+        m = metrics.Metrics().activate()
+        sender.new_session().close()
+        with requests.Session() as session:
+            session.post(server.url + '/message', json={}, headers={'X-Gotify-Key': 'tok'})
+
+        assert 'connections' not in m.counters
+        assert 'connect' not in m.spans
+
+    def test_on_retry(self):
+        m = metrics.Metrics()
+        m.on_retry(0.25)
+        assert m.counters['retries'] == 1
+        assert m.spans['backoff'] == 0.25
+
+
+@pytest.mark.unit
+class TestHecOutput:
+    """Test the HEC multiple-metric output."""
+
+    def test_hec_event(self):
+        document = {'mode': 'digest', 'status': 0, 'search_name': None, 'duration_ms': 12.5,
+                    'spans_ms': {'request': 10.0}, 'counters': {'sent': 4}}
+        event = metrics.hec_event(document, 1700000000.1234)
+
+        assert event['time'] == 1700000000.123
+        assert event['event'] == 'metric'
+        assert event['fields'] == {
+            'mode': 'digest',
+            'status': 0,
+            'metric_name:alert_gotify.duration_ms': 12.5,
+            'metric_name:alert_gotify.span.request_ms': 10.0,
+            'metric_name:alert_gotify.sent': 4,
+        }
+
+    def test_write_hec_appends_lines(self, tmp_path):
+        path = str(tmp_path / 'metrics' / 'alert_gotify.json')
+        document = {'duration_ms': 1.0, 'spans_ms': {}, 'counters': {}}
+        metrics.write_hec(path, document, 1.0)
+        metrics.write_hec(path, document, 2.0)
+
+        with open(path) as metrics_file:
+            lines = [json.loads(line) for line in metrics_file]
+        assert [line['time'] for line in lines] == [1.0, 2.0]
@@ -2,6 +2,7 @@
 """
 Unit tests for modalert_alert_gotify_helper module.
 """
+import json
 import os
 import sys
 import pytest
@@ -10,6 +11,8 @@ from unittest.mock import Mock, patch, MagicMock
 # Import the module to test
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
 from alert_gotify import modalert_alert_gotify_helper
+from alert_gotify.adaptive import load_limit
+from alert_gotify.store import LocalStore
 
 
 @pytest.mark.unit
@@ -42,7 +45,7 @@ class TestHelperStructure:
 class TestProcessEvent:
     """Test the process_event function."""
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_successful_message_with_global_settings(self, mock_post, mock_helper):
         """Test sending a message using global settings."""
         # Setup mock response
@@ -56,7 +59,7 @@ class TestProcessEvent:
         # Verify the result
         assert result == 0
         
-        # Verify requests.post was called correctly
+        # Verify post_message was called correctly
         mock_post.assert_called_once()
         call_args = mock_post.call_args
         
@@ -68,8 +71,9 @@ class TestProcessEvent:
         assert headers['X-Gotify-Key'] == 'test_global_token'
         assert headers['Content-Type'] == 'application/json'
         
-        # Check payload
-        payload = call_args[1]['json']
+        # Check payload, posted as the body encoded when it was built
+        assert 'json' not in call_args[1]
+        payload = json.loads(call_args[1]['data'])
         assert payload['message'] == 'Test message'
         assert payload['title'] == 'Test title'
         assert payload['priority'] == 5
@@ -80,7 +84,7 @@ class TestProcessEvent:
         # Verify logging
         mock_helper.log_info.assert_called()
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_successful_message_with_overrides(self, mock_post, mock_helper_with_overrides):
         """Test sending a message with URL/token overrides."""
         # Setup mock response
@@ -94,7 +98,7 @@ class TestProcessEvent:
         # Verify the result
         assert result == 0
         
-        # Verify requests.post was called with override values
+        # Verify post_message was called with override values
         call_args = mock_post.call_args
         
         # Check URL uses override
@@ -110,7 +114,7 @@ class TestProcessEvent:
         # Verify global settings were NOT called
         mock_helper_with_overrides.get_global_setting.assert_not_called()
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_message_without_title(self, mock_post, mock_helper):
         """Test sending a message without a title."""
         # Remove title from params
@@ -132,11 +136,11 @@ class TestProcessEvent:
         assert result == 0
         
         # Check payload doesn't include title
-        payload = mock_post.call_args[1]['json']
+        payload = json.loads(mock_post.call_args[1]['data'])
         assert 'title' not in payload or payload.get('title') is None
         assert payload['message'] == 'Test message without title'
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_different_priority_levels(self, mock_post, mock_helper):
         """Test sending messages with different priority levels."""
         mock_response = Mock()
@@ -156,10 +160,10 @@ class TestProcessEvent:
             result = modalert_alert_gotify_helper.process_event(mock_helper)
             assert result == 0
             
-            payload = mock_post.call_args[1]['json']
+            payload = json.loads(mock_post.call_args[1]['data'])
             assert payload['priority'] == int(priority)
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_url_trailing_slash_handling(self, mock_post, mock_helper):
         """Test that URLs with trailing slashes are handled correctly."""
         # Set URL with trailing slash
@@ -181,7 +185,7 @@ class TestProcessEvent:
         # Should not have double slashes
         assert mock_post.call_args[0][0] == 'https://gotify.example.com/message'
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_failed_request_non_200(self, mock_post, mock_helper):
         """Test handling of non-200 response codes."""
         mock_response = Mock()
@@ -194,7 +198,7 @@ class TestProcessEvent:
         assert result == 1
         mock_helper.log_error.assert_called()
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_ssl_error_handling(self, mock_post, mock_helper):
         """Test handling of SSL errors."""
         import requests
@@ -207,7 +211,7 @@ class TestProcessEvent:
         error_calls = [str(call) for call in mock_helper.log_error.call_args_list]
         assert any('SSL' in str(call) for call in error_calls)
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_request_exception_handling(self, mock_post, mock_helper):
         """Test handling of general request exceptions."""
         import requests
@@ -218,7 +222,7 @@ class TestProcessEvent:
         assert result == 1
         mock_helper.log_error.assert_called()
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_unexpected_exception_handling(self, mock_post, mock_helper):
         """Test handling of unexpected exceptions."""
         mock_post.side_effect = Exception('Unexpected error')
@@ -233,7 +237,7 @@ class TestProcessEvent:
 class TestSSLVerification:
     """Test SSL verification parameter handling."""
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_ssl_verify_default_true(self, mock_post, mock_helper):
         """Test that SSL verification defaults to True."""
         mock_response = Mock()
@@ -244,7 +248,7 @@ class TestSSLVerification:
 
         assert mock_post.call_args[1]['verify'] is True
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_ssl_verify_string_zero(self, mock_post, mock_helper):
         """Test SSL verification with string '0'."""
         mock_helper.get_param = Mock(side_effect=lambda key: {
@@ -264,7 +268,7 @@ class TestSSLVerification:
 
         assert mock_post.call_args[1]['verify'] is False
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_ssl_verify_string_one(self, mock_post, mock_helper):
         """Test SSL verification with string '1'."""
         mock_helper.get_param = Mock(side_effect=lambda key: {
@@ -284,7 +288,7 @@ class TestSSLVerification:
 
         assert mock_post.call_args[1]['verify'] is True
 
-    @patch('alert_gotify.modalert_alert_gotify_helper.requests.post')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
     def test_ssl_verify_various_false_strings(self, mock_post, mock_helper):
         """Test SSL verification with various false-like strings."""
         for false_value in ['0', 'false', 'False', 'FALSE', 'no', 'No', 'NO']:
@@ -304,3 +308,605 @@ class TestSSLVerification:
             modalert_alert_gotify_helper.process_event(mock_helper)
 
             assert mock_post.call_args[1]['verify'] is False, f"Failed for value: {false_value}"
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_ca_path(self, mock_post, mock_helper, tmp_path):
+        """Test that a custom CA path is used for verification."""
+        bundle = tmp_path / 'ca.pem'
+        bundle.write_text('')
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test',
+            'priority': '5',
+            'ca_path': str(bundle),
+        }.get(key))
+        mock_post.return_value = Mock(status_code=200)
+
+        modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert mock_post.call_args[1]['verify'] == str(bundle)
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_long_message_is_truncated(self, mock_post, mock_helper):
+        """Test that messages over max_message_bytes are truncated and marked up."""
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'x' * 10000,
+            'priority': '5',
+            'max_message_bytes': '1000',
+            'markdown': '1',
+        }.get(key))
+        mock_post.return_value = Mock(status_code=200)
+
+        modalert_alert_gotify_helper.process_event(mock_helper)
+
+        payload = json.loads(mock_post.call_args[1]['data'])
+        assert len(payload['message']) <= 1000
+        assert payload['extras'] == {'client::display': {'contentType': 'text/markdown'}}
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_compressed_body(self, mock_post, mock_helper):
+        """Test that large bodies are gzipped when compress is set."""
+        import gzip
+        import json
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'x' * 10000,
+            'priority': '5',
+            'compress': '1',
+        }.get(key))
+        mock_post.return_value = Mock(status_code=200)
+
+        modalert_alert_gotify_helper.process_event(mock_helper)
+
+        kwargs = mock_post.call_args[1]
+        assert kwargs['headers']['Content-Encoding'] == 'gzip'
+        assert kwargs['headers']['X-Gotify-Key'] == 'test_global_token'
+        assert json.loads(gzip.decompress(kwargs['data']))['message'] == 'x' * 10000
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_missing_ca_path(self, mock_post, mock_helper, tmp_path):
+        """Test that a missing CA path fails the alert."""
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test',
+            'priority': '5',
+            'ca_path': str(tmp_path / 'missing.pem'),
+        }.get(key))
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 1
+        mock_post.assert_not_called()
+
+
+@pytest.mark.unit
+class TestPerResultMode:
+    """Test the per-result fan-out mode."""
+
+    def _set_params(self, helper, **overrides):
+        params = {
+            'url': None,
+            'token': None,
+            'message': 'Test message',
+            'title': 'Test title',
+            'priority': '5',
+            'ssl_verify': None,
+            'mode': 'per_result',
+            'workers': '4',
+        }
+        params.update(overrides)
+        helper.get_param = Mock(side_effect=lambda key: params.get(key))
+
+    def test_one_message_per_result(self, requests_mock, mock_helper):
+        self._set_params(mock_helper)
+        mock_helper.get_events = Mock(return_value=iter([{'host': 'a'}, {'host': 'b'}, {'host': 'c'}]))
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 0
+        assert requests_mock.call_count == 3
+        assert requests_mock.last_request.json() == {
+            'message': 'Test message', 'title': 'Test title', 'priority': 5
+        }
+
+    def test_failures_return_error(self, requests_mock, mock_helper):
+        self._set_params(mock_helper)
+        mock_helper.get_events = Mock(return_value=iter([{'host': 'a'}, {'host': 'b'}]))
+        requests_mock.post('https://gotify.example.com/message', status_code=500, text='down')
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 1
+        mock_helper.log_error.assert_called()
+
+    def test_no_results_sends_nothing(self, requests_mock, mock_helper):
+        self._set_params(mock_helper)
+        mock_helper.get_events = Mock(return_value=iter([]))
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 0
+        assert requests_mock.call_count == 0
+
+    def test_invalid_priority(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, priority='high')
+        mock_helper.get_events = Mock(return_value=iter([{'host': 'a'}]))
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 1
+        assert requests_mock.call_count == 0
+        mock_helper.log_error.assert_any_call("Invalid priority 'high'")
+
+    def test_adaptive_concurrency_is_learned(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, adaptive_concurrency='1')
+        mock_helper.get_events = Mock(return_value=iter([{'host': 'a'}, {'host': 'b'}]))
+        requests_mock.post('https://gotify.example.com/message', [
+            {'status_code': 503}, {'status_code': 200}, {'status_code': 200}, {'status_code': 200},
+        ])
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 0
+        with LocalStore() as store:
+            assert load_limit(store, 'https://gotify.example.com', 4).current == 2
+        mock_helper.log_info.assert_any_call(
+            "Adaptive concurrency for Gotify server https://gotify.example.com: 2 request(s) in flight (started at 4)"
+        )
+
+    def test_invalid_mode(self, mock_helper):
+        self._set_params(mock_helper, mode='bogus')
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 1
+        mock_helper.log_error.assert_called()
+
+
+@pytest.mark.unit
+class TestTemplating:
+    """Test $result.field$ templating of message and title."""
+
+    def _set_params(self, helper, **overrides):
+        params = {
+            'url': None,
+            'token': None,
+            'message': '$result.host$ is down',
+            'title': 'Alert for $result.team$',
+            'priority': '5',
+            'ssl_verify': None,
+        }
+        params.update(overrides)
+        helper.get_param = Mock(side_effect=lambda key: params.get(key))
+
+    def test_per_result_rendering(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, mode='per_result', workers='1')
+        mock_helper.get_events = Mock(return_value=iter([
+            {'host': 'web01', 'team': 'ops'},
+            {'host': 'db01', 'team': 'dba'},
+        ]))
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 0
+        bodies = sorted((r.json()['message'], r.json()['title']) for r in requests_mock.request_history)
+        assert bodies == [('db01 is down', 'Alert for dba'), ('web01 is down', 'Alert for ops')]
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_single_mode_renders_first_result(self, mock_post, mock_helper):
+        self._set_params(mock_helper)
+        mock_helper.get_events = Mock(return_value=iter([{'host': 'web01', 'team': 'ops'}, {'host': 'x'}]))
+        mock_post.return_value = Mock(status_code=200)
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 0
+        payload = json.loads(mock_post.call_args[1]['data'])
+        assert payload['message'] == 'web01 is down'
+        assert payload['title'] == 'Alert for ops'
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_static_message_does_not_read_results(self, mock_post, mock_helper):
+        mock_post.return_value = Mock(status_code=200)
+
+        modalert_alert_gotify_helper.process_event(mock_helper)
+
+        mock_helper.get_events.assert_not_called()
+
+
+@pytest.mark.unit
+class TestDigestMode:
+    """Test the digest aggregation mode."""
+
+    def _set_params(self, helper, **overrides):
+        params = {
+            'url': None,
+            'token': None,
+            'message': '$result.host$',
+            'title': 'Hosts down',
+            'priority': '5',
+            'ssl_verify': None,
+            'mode': 'digest',
+        }
+        params.update(overrides)
+        helper.get_param = Mock(side_effect=lambda key: params.get(key))
+
+    def test_many_results_few_messages(self, requests_mock, mock_helper):
+        self._set_params(mock_helper, digest_max_rows='100')
+        mock_helper.get_events = Mock(return_value=({'host': 'h{}'.format(i)} for i in range(1000)))
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 0
+        assert requests_mock.call_count == 10
+        lines = [r.json()['message'].count('\n') + 1 for r in requests_mock.request_history]
+        assert sum(lines) == 1000
+
+    def test_invalid_digest_parameter(self, mock_helper):
+        self._set_params(mock_helper, digest_max_rows='0')
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 1
+        mock_helper.log_error.assert_called()
+
+
+@pytest.mark.unit
+class TestSpool:
+    """Test spooling of undelivered messages."""
+
+    def _spool_size(self):
+        from alert_gotify.store import LocalStore
+        with LocalStore() as store:
+            return store.spool_size()
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_connection_error_is_spooled(self, mock_post, mock_helper):
+        import requests
+        mock_post.side_effect = requests.exceptions.ConnectionError('refused')
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+        assert self._spool_size() == 1
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_success_without_spool_leaves_state_dir_alone(self, mock_post, mock_helper, state_dir):
+        mock_post.return_value = Mock(status_code=200)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+        assert not state_dir.exists()
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_client_error_is_not_spooled(self, mock_post, mock_helper, state_dir):
+        mock_post.return_value = Mock(status_code=400, text='Bad Request')
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+        assert not state_dir.exists()
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_spool_can_be_disabled(self, mock_post, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5', 'spool': '0',
+        }.get(key))
+        mock_post.return_value = Mock(status_code=503, text='Unavailable')
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+        assert self._spool_size() == 0
+
+    def test_success_drains_spool(self, requests_mock, mock_helper):
+        from alert_gotify import spool
+        from alert_gotify.store import LocalStore
+        with LocalStore() as store:
+            spool.defer(store, 'https://gotify.example.com', 'tok', True,
+                        [({'message': 'old', 'priority': 5}, 'down')], now=0)
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+        assert self._spool_size() == 0
+        assert [r.json()['message'] for r in requests_mock.request_history] == ['Test message', 'old']
+
+    def test_per_result_failures_are_spooled(self, requests_mock, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5', 'mode': 'per_result',
+        }.get(key))
+        mock_helper.get_events = Mock(return_value=iter([{}, {}, {}]))
+        requests_mock.post('https://gotify.example.com/message', status_code=502)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+        assert self._spool_size() == 3
+
+
+@pytest.mark.unit
+class TestResilience:
+    """Test timeouts, retries and the circuit breaker in process_event."""
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_timeout_is_passed(self, mock_post, mock_helper):
+        mock_post.return_value = Mock(status_code=200)
+
+        modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert mock_post.call_args[1]['timeout'] == (5.0, 15.0)
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_custom_timeouts(self, mock_post, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5', 'connect_timeout': '1', 'read_timeout': '2.5',
+        }.get(key))
+        mock_post.return_value = Mock(status_code=200)
+
+        modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert mock_post.call_args[1]['timeout'] == (1.0, 2.5)
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_invalid_timeout(self, mock_post, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5', 'read_timeout': 'soon',
+        }.get(key))
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+        mock_post.assert_not_called()
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_transient_failure_is_retried(self, mock_post, mock_helper):
+        import requests
+        mock_post.side_effect = [requests.exceptions.ConnectionError('refused'), Mock(status_code=200)]
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+        assert mock_post.call_count == 2
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_open_breaker_fails_fast(self, mock_post, mock_helper):
+        import requests
+        mock_post.side_effect = requests.exceptions.ConnectTimeout('timed out')
+
+        for _ in range(3):
+            assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+        calls = mock_post.call_count
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+        assert mock_post.call_count == calls
+        assert any('circuit breaker' in str(c) for c in mock_helper.log_error.call_args_list)
+
+        from alert_gotify.store import LocalStore
+        with LocalStore() as store:
+            assert store.spool_size() == 4
+
+
+@pytest.mark.unit
+class TestThrottling:
+    """Test deduplication and rate limiting in process_event."""
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_duplicate_is_suppressed(self, mock_post, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5', 'dedup_window': '300',
+        }.get(key))
+        mock_post.return_value = Mock(status_code=200)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+
+        assert mock_post.call_count == 1
+
+    def test_per_result_rate_limit(self, requests_mock, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': '$result.n$', 'priority': '5', 'mode': 'per_result',
+            'rate_limit': '60', 'rate_burst': '5',
+        }.get(key))
+        mock_helper.get_events = Mock(return_value=({'n': str(i)} for i in range(20)))
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+        assert requests_mock.call_count == 5
+
+
+@pytest.mark.unit
+class TestDaemonHandoff:
+    """Test handing messages to the delivery daemon."""
+
+    @patch('alert_gotify.daemon.DaemonClient')
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_single_message_is_handed_off(self, mock_post, mock_client, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5', 'daemon': '1',
+        }.get(key))
+        client = mock_client.return_value
+        client.connect.return_value = True
+        client.sent = 1
+        client.finish.return_value = 1
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+
+        mock_post.assert_not_called()
+        client.send.assert_called_once_with('https://gotify.example.com', 'test_global_token', True,
+                                            {'message': 'Test', 'priority': 5})
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_falls_back_without_daemon(self, mock_post, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5', 'daemon': '1',
+        }.get(key))
+        mock_post.return_value = Mock(status_code=200)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+        mock_post.assert_called_once()
+
+    @patch('alert_gotify.daemon.DaemonClient')
+    def test_per_result_falls_back_mid_stream(self, mock_client, requests_mock, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': '$result.n$', 'priority': '5', 'mode': 'per_result', 'daemon': '1',
+        }.get(key))
+        mock_helper.get_events = Mock(return_value=({'n': str(i)} for i in range(5)))
+        client = mock_client.return_value
+        client.connect.return_value = True
+        client.sent = 2
+        client.send.side_effect = [None, None, BrokenPipeError('gone')]
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        # The daemon never confirmed the first two, which may or may not be queued
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+        assert sorted(r.json()['message'] for r in requests_mock.request_history) == ['2', '3', '4']
+        mock_helper.log_error.assert_any_call(
+            "2 of 2 message(s) written to the delivery daemon were not confirmed as queued"
+        )
+
+    @patch('alert_gotify.daemon.DaemonClient')
+    def test_unconfirmed_messages_are_failed(self, mock_client, requests_mock, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': '$result.n$', 'priority': '5', 'mode': 'per_result', 'daemon': '1',
+        }.get(key))
+        mock_helper.get_events = Mock(return_value=({'n': str(i)} for i in range(3)))
+        client = mock_client.return_value
+        client.connect.return_value = True
+        client.sent = 3
+        client.finish.return_value = 1
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+        assert requests_mock.call_count == 0
+        mock_helper.log_error.assert_any_call(
+            "2 of 3 message(s) written to the delivery daemon were not confirmed as queued"
+        )
+
+
+@pytest.mark.unit
+class TestMultiTarget:
+    """Test sending one alert to several Gotify targets."""
+
+    def test_single_message_fans_out(self, requests_mock, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5',
+            'targets': 'https://second.example.com|tok2, https://third.example.com',
+        }.get(key))
+        for url in ('https://gotify.example.com', 'https://second.example.com', 'https://third.example.com'):
+            requests_mock.post(url + '/message', status_code=200)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+
+        keys = sorted((r.url, r.headers['X-Gotify-Key']) for r in requests_mock.request_history)
+        assert keys == [
+            ('https://gotify.example.com/message', 'test_global_token'),
+            ('https://second.example.com/message', 'tok2'),
+            ('https://third.example.com/message', 'test_global_token'),
+        ]
+
+    def test_failed_target_is_spooled(self, requests_mock, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': '$result.n$', 'priority': '5', 'mode': 'per_result',
+            'targets': 'https://down.example.com|tok2', 'retries': '0',
+        }.get(key))
+        mock_helper.get_events = Mock(return_value=iter([{'n': '1'}, {'n': '2'}]))
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+        requests_mock.post('https://down.example.com/message', status_code=503)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+
+        from alert_gotify.store import LocalStore
+        with LocalStore() as store:
+            items = store.spool_claim(now=10 ** 10, limit=10, lease=60)
+        assert sorted(item.url for item in items) == ['https://down.example.com'] * 2
+
+    def test_invalid_target(self, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5', 'targets': 'not-a-url',
+        }.get(key))
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+        assert 'Invalid delivery parameter' in str(mock_helper.log_error.call_args)
+
+
+@pytest.mark.unit
+class TestMetrics:
+    """Test the metrics line emitted by process_event."""
+
+    def _metrics(self, helper):
+        import json
+        for call in helper.log_info.call_args_list:
+            message = call[0][0]
+            if message.startswith('Delivery metrics: '):
+                return json.loads(message[len('Delivery metrics: '):])
+        return None
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_single_message_metrics(self, mock_post, mock_helper):
+        import requests
+        mock_post.side_effect = [requests.exceptions.ConnectionError('refused'), Mock(status_code=200)]
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+
+        document = self._metrics(mock_helper)
+        assert document['mode'] == 'single'
+        assert document['status'] == 0
+        assert document['counters'] == {'attempts': 2, 'retries': 1, 'sent': 1}
+        assert set(['settings', 'build', 'request']) <= set(document['spans_ms'])
+
+    def test_per_result_metrics(self, requests_mock, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5', 'mode': 'per_result', 'spool': '0', 'retries': '0',
+        }.get(key))
+        mock_helper.get_events = Mock(return_value=iter([{}, {}, {}]))
+        requests_mock.post('https://gotify.example.com/message', [
+            {'status_code': 200}, {'status_code': 200}, {'status_code': 400},
+        ])
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+
+        counters = self._metrics(mock_helper)['counters']
+        assert counters['sent'] == 2
+        assert counters['failed'] == 1
+        assert counters['dropped'] == 1
+
+    @patch('alert_gotify.modalert_alert_gotify_helper.post_message')
+    def test_metrics_file(self, mock_post, mock_helper, state_dir):
+        import json
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5', 'metrics_file': 'metrics.json',
+        }.get(key))
+        mock_post.return_value = Mock(status_code=200)
+
+        modalert_alert_gotify_helper.process_event(mock_helper)
+
+        with open(str(state_dir / 'metrics.json')) as metrics_file:
+            event = json.loads(metrics_file.readline())
+        assert event['fields']['metric_name:alert_gotify.sent'] == 1
+        assert event['fields']['mode'] == 'single'
+
+
+@pytest.mark.unit
+class TestResultsFile:
+    """Test reading results straight from the results file."""
+
+    def _results_file(self, tmp_path, rows):
+        import csv
+        import gzip
+        path = str(tmp_path / 'results.csv.gz')
+        with gzip.open(path, 'wt', newline='', encoding='utf-8') as results_file:
+            writer = csv.writer(results_file)
+            writer.writerow(['_raw', 'host', 'pct'])
+            writer.writerows(rows)
+        return path
+
+    def test_per_result_reads_results_file(self, requests_mock, mock_helper, tmp_path):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': '$result.host$ at $result.pct$%', 'priority': '5', 'mode': 'per_result',
+        }.get(key))
+        mock_helper.results_file = self._results_file(tmp_path, [['x', 'web01', '91'], ['y', 'web02', '95']])
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+
+        mock_helper.get_events.assert_not_called()
+        messages = sorted(r.json()['message'] for r in requests_mock.request_history)
+        assert messages == ['web01 at 91%', 'web02 at 95%']
+
+    def test_digest_groups_from_results_file(self, requests_mock, mock_helper, tmp_path):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': '$result.pct$', 'title': 'Disk', 'priority': '5', 'mode': 'digest', 'group_by': 'host',
+        }.get(key))
+        mock_helper.results_file = self._results_file(tmp_path, [['x', 'web01', '91'], ['y', 'web01', '95']])
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+
+        assert requests_mock.call_count == 1
+        assert requests_mock.last_request.json()['message'] == '91\n95'
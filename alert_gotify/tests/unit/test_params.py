@@ -0,0 +1,38 @@
+# encoding = utf-8
+"""
+Unit tests for the parameter parsing module.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import params
+
+
+@pytest.mark.unit
+class TestParams:
+    """Test optional parameter parsing."""
+
+    def test_parse_bool(self):
+        assert params.parse_bool(None, True) is True
+        assert params.parse_bool('', False) is False
+        assert params.parse_bool('0', True) is False
+        assert params.parse_bool('no', True) is False
+        assert params.parse_bool('1', False) is True
+        assert params.parse_bool(0, True) is False
+
+    def test_parse_positive_int(self):
+        assert params.parse_positive_int(None, 7) == 7
+        assert params.parse_positive_int('12', 7) == 12
+        with pytest.raises(ValueError):
+            params.parse_positive_int('0', 7)
+        with pytest.raises(ValueError):
+            params.parse_positive_int('abc', 7)
+
+    def test_parse_non_negative(self):
+        assert params.parse_non_negative(None) == 0
+        assert params.parse_non_negative('', None) is None
+        assert params.parse_non_negative('30') == 30.0
+        with pytest.raises(ValueError):
+            params.parse_non_negative('-1')
@@ -0,0 +1,181 @@
+# encoding = utf-8
+"""
+Unit tests for the bulk replay command.
+"""
+import csv
+import gzip
+import json
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import replay
+
+URL = 'https://gotify.example.com'
+
+
+def _jsonl(tmp_path, records):
+    path = tmp_path / 'messages.jsonl'
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    return str(path)
+
+
+def _run(path, *args):
+    return replay.main([path, '--url', URL, '--token', 'tok'] + list(args))
+
+
+@pytest.mark.unit
+class TestReadRecords:
+    """Test reading and rendering the supported input formats."""
+
+    def test_detect_format(self):
+        assert replay.detect_format('lost.jsonl') == 'jsonl'
+        assert replay.detect_format('lost.CSV') == 'csv'
+        assert replay.detect_format('results.csv.gz') == 'results'
+
+    def test_jsonl_skips_blank_lines(self, tmp_path):
+        path = tmp_path / 'messages.jsonl'
+        path.write_text('{"message": "a"}\n\n{"message": "b", "priority": 8}\n')
+
+        records = list(replay.read_records(str(path), 'jsonl', ()))
+
+        assert records == [{'message': 'a'}, {'message': 'b', 'priority': 8}]
+
+    def test_jsonl_reports_bad_line(self, tmp_path):
+        path = tmp_path / 'messages.jsonl'
+        path.write_text('{"message": "a"}\n[1]\n')
+
+        with pytest.raises(ValueError, match='line 2'):
+            list(replay.read_records(str(path), 'jsonl', ()))
+
+    def test_results_file_is_rendered_with_templates(self, tmp_path):
+        path = tmp_path / 'results.csv.gz'
+        with gzip.open(str(path), 'wt', newline='') as results:
+            writer = csv.writer(results)
+            writer.writerow(['host', '_raw', 'pct'])
+            writer.writerow(['web01', 'raw event', '97'])
+        builder = replay.MessageBuilder('$result.host$ at $result.pct$%', 'Disk', 8)
+
+        payloads = [builder.build(row) for row in replay.read_records(str(path), 'results', builder.fields)]
+
+        assert payloads == [{'message': 'web01 at 97%', 'title': 'Disk', 'priority': 8}]
+
+    def test_record_priority_overrides_default(self):
+        builder = replay.MessageBuilder(replay.DEFAULT_MESSAGE, replay.DEFAULT_TITLE, 5)
+
+        assert builder.build({'message': 'm', 'priority': '9'}) == {'message': 'm', 'priority': 9}
+        assert builder.build({'message': 'm', 'priority': ''}) == {'message': 'm', 'priority': 5}
+        assert builder.build({'title': 'no message'}) is None
+
+
+@pytest.mark.unit
+class TestReplay:
+    """Test sending records through the delivery engine."""
+
+    def test_sends_every_record(self, tmp_path, requests_mock, capsys):
+        requests_mock.post(URL + '/message', status_code=200)
+        path = _jsonl(tmp_path, [{'message': 'm{}'.format(i), 'title': 'T'} for i in range(5)] + [{}])
+
+        status = _run(path, '--workers', '2')
+
+        assert status == 0
+        assert requests_mock.call_count == 5
+        assert requests_mock.last_request.headers['X-Gotify-Key'] == 'tok'
+        assert 'sent=5 failed=0 spooled=0 rejected=0 held=0 skipped=1 offset=6' in capsys.readouterr().out
+
+    def test_checkpoint_resumes_after_last_batch(self, tmp_path, requests_mock):
+        requests_mock.post(URL + '/message', status_code=200)
+        path = _jsonl(tmp_path, [{'message': str(i)} for i in range(7)])
+        checkpoint = str(tmp_path / 'replay.checkpoint')
+
+        assert _run(path, '--checkpoint', checkpoint, '--batch-size', '3', '--limit', '4') == 0
+        assert replay.Checkpoint(checkpoint, path).load() == 4
+
+        assert _run(path, '--checkpoint', checkpoint, '--batch-size', '3') == 0
+        sent = [request.json()['message'] for request in requests_mock.request_history]
+        assert sorted(sent) == [str(i) for i in range(7)]
+        assert replay.Checkpoint(checkpoint, path).load() == 7
+
+    def test_failed_batch_stops_replay(self, tmp_path, requests_mock, capsys):
+        requests_mock.post(URL + '/message', [{'status_code': 200}] * 3 + [{'status_code': 503}])
+        path = _jsonl(tmp_path, [{'message': str(i)} for i in range(9)])
+        checkpoint = str(tmp_path / 'replay.checkpoint')
+
+        status = _run(path, '--checkpoint', checkpoint, '--batch-size', '3', '--workers', '1',
+                      '--param', 'retries=0')
+
+        assert status == 1
+        assert requests_mock.call_count == 6
+        assert replay.Checkpoint(checkpoint, path).load() == 3
+        assert 'sent=3 failed=3 spooled=0 rejected=0 held=0 skipped=0 offset=3' in capsys.readouterr().out
+
+    def test_rejected_records_are_skipped(self, tmp_path, requests_mock, capsys):
+        requests_mock.post(URL + '/message', [{'status_code': 200}, {'status_code': 400}, {'status_code': 200}])
+        path = _jsonl(tmp_path, [{'message': str(i)} for i in range(6)])
+        checkpoint = str(tmp_path / 'replay.checkpoint')
+
+        status = _run(path, '--checkpoint', checkpoint, '--batch-size', '3', '--workers', '1')
+
+        assert status == 1
+        assert requests_mock.call_count == 6
+        assert replay.Checkpoint(checkpoint, path).load() == 6
+        captured = capsys.readouterr()
+        assert 'sent=5 failed=1 spooled=0 rejected=1 held=0 skipped=0 offset=6' in captured.out
+        assert 'Skipping 1 rejected message(s) of records 0 to 2' in captured.err
+
+    def test_rejected_batch_is_not_skipped(self, tmp_path, requests_mock):
+        requests_mock.post(URL + '/message', status_code=400)
+        path = _jsonl(tmp_path, [{'message': str(i)} for i in range(2)])
+        checkpoint = str(tmp_path / 'replay.checkpoint')
+
+        assert _run(path, '--checkpoint', checkpoint) == 1
+        assert replay.Checkpoint(checkpoint, path).load() == 0
+
+    def test_checkpoint_of_other_file_is_ignored(self, tmp_path):
+        checkpoint = replay.Checkpoint(str(tmp_path / 'replay.checkpoint'), str(tmp_path / 'a.jsonl'))
+        checkpoint.save(10)
+
+        assert replay.Checkpoint(checkpoint.path, str(tmp_path / 'b.jsonl')).load() == 0
+
+    def test_failures_are_spooled_when_enabled(self, tmp_path, requests_mock, capsys):
+        requests_mock.post(URL + '/message', status_code=503)
+        path = _jsonl(tmp_path, [{'message': 'a'}, {'message': 'b'}])
+
+        assert _run(path, '--param', 'retries=0') == 1
+        assert 'failed=2 spooled=0' in capsys.readouterr().out
+
+        assert _run(path, '--param', 'retries=0', '--param', 'spool=1') == 1
+        assert 'failed=2 spooled=2' in capsys.readouterr().out
+
+    def test_invalid_priority_stops_replay(self, tmp_path, requests_mock, capsys):
+        path = _jsonl(tmp_path, [{'message': 'a', 'priority': 'high'}])
+
+        assert _run(path) == 1
+        assert 'record 0' in capsys.readouterr().err
+        assert requests_mock.call_count == 0
+
+    def test_url_and_token_are_required(self, tmp_path, monkeypatch):
+        monkeypatch.delenv('GOTIFY_URL', raising=False)
+        monkeypatch.delenv('GOTIFY_TOKEN', raising=False)
+
+        with pytest.raises(SystemExit):
+            replay.main([_jsonl(tmp_path, [])])
+
+
+@pytest.mark.unit
+class TestPacer:
+    """Test pacing the replay to a message rate."""
+
+    def test_messages_are_spaced_evenly(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        pacer = replay.Pacer(120, clock=lambda: now[0], sleep=sleep)
+
+        assert list(pacer.paced(range(3))) == [0, 1, 2]
+        assert sleeps == [0.5, 0.5]
@@ -0,0 +1,123 @@
+# encoding = utf-8
+"""
+Unit tests for timeouts, retries and the circuit breaker.
+"""
+import os
+import sys
+import time
+import pytest
+import requests
+from unittest.mock import Mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import resilience
+from alert_gotify.store import LocalStore
+
+
+def _response(status_code, retry_after=None):
+    response = Mock(status_code=status_code)
+    response.headers = {'Retry-After': retry_after} if retry_after is not None else {}
+    return response
+
+
+@pytest.mark.unit
+class TestParsing:
+    """Test timeout and retry parameter parsing."""
+
+    def test_parse_timeout(self):
+        assert resilience.parse_timeout(None, None) == (
+            resilience.DEFAULT_CONNECT_TIMEOUT, resilience.DEFAULT_READ_TIMEOUT
+        )
+        assert resilience.parse_timeout('2', '7.5') == (2.0, 7.5)
+        with pytest.raises(ValueError):
+            resilience.parse_timeout('0', '1')
+
+    def test_parse_retries(self):
+        assert resilience.parse_retries(None) == resilience.DEFAULT_RETRIES
+        assert resilience.parse_retries('0') == 0
+        with pytest.raises(ValueError):
+            resilience.parse_retries('-1')
+
+
+@pytest.mark.unit
+class TestRetryPolicy:
+    """Test retrying of transient failures."""
+
+    def test_success_is_not_retried(self):
+        send = Mock(return_value=_response(200))
+        assert resilience.RetryPolicy(3).run(send).status_code == 200
+        assert send.call_count == 1
+
+    def test_client_error_is_not_retried(self):
+        send = Mock(return_value=_response(400))
+        assert resilience.RetryPolicy(3).run(send).status_code == 400
+        assert send.call_count == 1
+
+    def test_server_errors_retried_until_exhausted(self, no_retry_sleep):
+        send = Mock(return_value=_response(502))
+        assert resilience.RetryPolicy(2).run(send).status_code == 502
+        assert send.call_count == 3
+        assert len(no_retry_sleep) == 2
+
+    def test_connection_error_raised_after_retries(self):
+        send = Mock(side_effect=requests.exceptions.ConnectionError('refused'))
+        with pytest.raises(requests.exceptions.ConnectionError):
+            resilience.RetryPolicy(1).run(send)
+        assert send.call_count == 2
+
+    def test_ssl_error_is_not_retried(self):
+        send = Mock(side_effect=requests.exceptions.SSLError('bad cert'))
+        with pytest.raises(requests.exceptions.SSLError):
+            resilience.RetryPolicy(3).run(send)
+        assert send.call_count == 1
+
+    def test_retry_after_is_honored_and_capped(self, no_retry_sleep):
+        send = Mock(side_effect=[_response(429, '2'), _response(429, '600'), _response(200)])
+        resilience.RetryPolicy(2, max_delay=5.0).run(send)
+        assert no_retry_sleep == [2.0, 5.0]
+
+    def test_only_backoff_is_skipped(self, no_retry_sleep):
+        start = time.monotonic()
+        time.sleep(0.05)
+
+        assert time.monotonic() - start >= 0.05
+        assert no_retry_sleep == []
+
+    def test_backoff_is_bounded(self):
+        policy = resilience.RetryPolicy(base_delay=1.0, max_delay=3.0)
+        assert all(0 <= policy.delay(attempt) <= 3.0 for attempt in range(10))
+
+
+@pytest.mark.unit
+class TestCircuitBreaker:
+    """Test the shared circuit breaker."""
+
+    URL = 'https://gotify.example.com'
+
+    def test_opens_after_threshold(self):
+        with LocalStore() as store:
+            for _ in range(resilience.BREAKER_THRESHOLD - 1):
+                resilience.breaker_record(store, self.URL, False, now=100)
+            assert resilience.breaker_allow(store, self.URL, now=100)
+
+            resilience.breaker_record(store, self.URL, False, now=100)
+            assert not resilience.breaker_allow(store, self.URL, now=101)
+
+    def test_state_is_shared_between_store_connections(self):
+        with LocalStore() as store:
+            for _ in range(resilience.BREAKER_THRESHOLD):
+                resilience.breaker_record(store, self.URL, False, now=100)
+        with LocalStore() as store:
+            assert not resilience.breaker_allow(store, self.URL, now=101)
+            assert resilience.breaker_allow(store, 'https://other.example.com', now=101)
+
+    def test_half_open_allows_single_probe(self):
+        with LocalStore() as store:
+            for _ in range(resilience.BREAKER_THRESHOLD):
+                resilience.breaker_record(store, self.URL, False, now=100)
+            later = 100 + resilience.BREAKER_COOLDOWN
+            assert resilience.breaker_allow(store, self.URL, now=later)
+            assert not resilience.breaker_allow(store, self.URL, now=later + 1)
+
+            resilience.breaker_record(store, self.URL, True, now=later + 2)
+            assert resilience.breaker_allow(store, self.URL, now=later + 3)
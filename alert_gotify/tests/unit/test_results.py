@@ -0,0 +1,83 @@
+# encoding = utf-8
+"""
+Unit tests for the streaming results reader.
+"""
+import csv
+import gzip
+import os
+import sys
+from unittest.mock import Mock
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import results
+
+
+def write_results(path, header, rows):
+    with gzip.open(str(path), "wt", newline="", encoding="utf-8") as results_file:
+        writer = csv.writer(results_file)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return str(path)
+
+
+@pytest.mark.unit
+class TestReadResults:
+    """Test column projection and streaming."""
+
+    def test_projects_columns(self, tmp_path):
+        path = write_results(tmp_path / "results.csv.gz", ["_raw", "host", "pct", "__mv_host"],
+                             [["raw 1", "web01", "91", ""], ["raw 2", "web02", "95", ""]])
+
+        rows = list(results.read_results(path, ("host", "pct", "missing")))
+
+        assert [(row.get("host"), row.get("pct")) for row in rows] == [("web01", "91"), ("web02", "95")]
+        assert rows[0].get("_raw") is None
+        assert rows[0].get("missing", "") == ""
+        assert sorted(rows[0].keys()) == ["host", "pct"]
+
+    def test_multiline_and_unicode_values(self, tmp_path):
+        path = write_results(tmp_path / "results.csv.gz", ["host", "msg"],
+                             [["web01", "line 1\nline 2"], ["wéb02", "ok"]])
+
+        rows = list(results.read_results(path, ("host", "msg")))
+
+        assert rows[0]["msg"] == "line 1\nline 2"
+        assert rows[1]["host"] == "wéb02"
+
+    def test_short_rows(self, tmp_path):
+        path = write_results(tmp_path / "results.csv.gz", ["a", "b"], [["1"]])
+
+        row = next(results.read_results(path, ("a", "b")))
+
+        assert row.get("a") == "1"
+        assert row.get("b") is None
+
+    def test_empty_file(self, tmp_path):
+        path = str(tmp_path / "results.csv.gz")
+        with gzip.open(path, "wt"):
+            pass
+        assert list(results.read_results(path, ("a",))) == []
+
+    def test_rows_are_compact(self, tmp_path):
+        path = write_results(tmp_path / "results.csv.gz", ["host"], [["web01"]])
+        row = next(results.read_results(path, ("host",)))
+        assert not hasattr(row, "__dict__")
+
+
+@pytest.mark.unit
+class TestIterResults:
+    """Test the choice between the results file and get_events()."""
+
+    def test_uses_results_file(self, tmp_path):
+        helper = Mock()
+        helper.results_file = write_results(tmp_path / "results.csv.gz", ["host"], [["web01"]])
+
+        assert [row.get("host") for row in results.iter_results(helper, ("host",))] == ["web01"]
+        helper.get_events.assert_not_called()
+
+    def test_falls_back_to_get_events(self):
+        helper = Mock()
+        helper.get_events = Mock(return_value=iter([{"host": "web01"}]))
+
+        assert list(results.iter_results(helper, ("host",))) == [{"host": "web01"}]
@@ -0,0 +1,149 @@
+# encoding = utf-8
+"""
+Unit tests for routing results by a CSV lookup.
+"""
+import os
+import sys
+import pytest
+from unittest.mock import Mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import modalert_alert_gotify_helper, routing
+from alert_gotify.fanout import Target
+from alert_gotify.store import LocalStore
+
+URL = 'https://gotify.example.com'
+
+TABLE = """team,severity,url,token
+ops,,,ops_token
+ops,critical,https://pager.example.com,page_token
+db,*,https://db.example.com,db_token
+db,*,,db_copy_token
+"""
+
+
+@pytest.fixture
+def lookup(tmp_path):
+    path = tmp_path / 'routes.csv'
+    path.write_text(TABLE)
+    routing._compiled.clear()
+    yield path
+    routing._compiled.clear()
+
+
+@pytest.mark.unit
+class TestRoutingTable:
+    """Test compiling and matching routing lookups."""
+
+    def test_most_specific_row_wins(self, lookup):
+        router = routing.load_routes(str(lookup)).bind(URL, 'alert_token')
+
+        assert router.route({'team': 'ops', 'severity': 'low'}) == [Target(URL, 'ops_token')]
+        assert router.route({'team': 'ops', 'severity': 'critical'}) == [
+            Target('https://pager.example.com', 'page_token')
+        ]
+        assert router.route({'team': 'web'}) is None
+
+    def test_rows_with_the_same_values_send_to_all(self, lookup):
+        router = routing.load_routes(str(lookup)).bind(URL, 'alert_token')
+
+        assert router.route({'team': 'db', 'severity': 'high'}) == [
+            Target('https://db.example.com', 'db_token'), Target(URL, 'db_copy_token')
+        ]
+
+    def test_targets(self, lookup):
+        router = routing.load_routes(str(lookup)).bind(URL, 'alert_token')
+
+        assert router.fields == ('team', 'severity')
+        assert len(router.targets) == 4
+
+    def test_compiled_table_is_cached_until_the_file_changes(self, lookup):
+        first = routing.load_routes(str(lookup))
+        assert routing.load_routes(str(lookup)) is first
+
+        lookup.write_text(TABLE + "web,,,web_token\n")
+        changed = routing.load_routes(str(lookup)).bind(URL, 'alert_token')
+
+        assert changed.route({'team': 'web'}) == [Target(URL, 'web_token')]
+
+    def test_compiled_table_is_cached_on_disk(self, lookup, mocker):
+        with LocalStore() as store:
+            routing.load_routes(str(lookup), store)
+            routing._compiled.clear()
+            compile_routes = mocker.patch('alert_gotify.routing.compile_routes')
+
+            router = routing.load_routes(str(lookup), store).bind(URL, 'alert_token')
+
+        compile_routes.assert_not_called()
+        assert router.route({'team': 'ops', 'severity': 'critical'}) == [
+            Target('https://pager.example.com', 'page_token')
+        ]
+
+    @pytest.mark.parametrize('table', [
+        "team,severity\nops,low\n",
+        "url,token\nhttps://a.example.com,t\n",
+        "team,url,token\nops,,\n",
+        "team,url,token\nops,ftp://a.example.com,t\n",
+    ])
+    def test_invalid_tables(self, tmp_path, table):
+        path = tmp_path / 'routes.csv'
+        path.write_text(table)
+
+        with pytest.raises(ValueError):
+            routing.compile_routes(str(path))
+
+    def test_relative_paths_are_lookups(self):
+        assert routing.resolve_path('routes.csv') == os.path.join(routing.APP_DIR, 'lookups', 'routes.csv')
+
+
+@pytest.mark.unit
+class TestRoutedAlerts:
+    """Test routing in the alert action."""
+
+    def _set_params(self, helper, lookup, **overrides):
+        params = {
+            'message': '$result.host$ is down',
+            'title': 'Host down',
+            'priority': '5',
+            'routes': str(lookup),
+        }
+        params.update(overrides)
+        helper.get_param = Mock(side_effect=lambda key: params.get(key))
+
+    def test_per_result_routing(self, requests_mock, mock_helper, lookup):
+        self._set_params(mock_helper, lookup, mode='per_result')
+        mock_helper.get_events = Mock(return_value=iter([
+            {'host': 'a', 'team': 'ops', 'severity': 'critical'},
+            {'host': 'b', 'team': 'web'},
+        ]))
+        pager = requests_mock.post('https://pager.example.com/message', status_code=200)
+        default = requests_mock.post(URL + '/message', status_code=200)
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 0
+        assert pager.call_count == 1
+        assert pager.last_request.json()['message'] == 'a is down'
+        assert pager.last_request.headers['X-Gotify-Key'] == 'page_token'
+        assert default.call_count == 1
+        assert default.last_request.json()['message'] == 'b is down'
+        assert default.last_request.headers['X-Gotify-Key'] == 'test_global_token'
+
+    def test_single_mode_follows_the_first_result(self, requests_mock, mock_helper, lookup):
+        self._set_params(mock_helper, lookup)
+        mock_helper.get_events = Mock(return_value=iter([{'host': 'a', 'team': 'ops'}]))
+        default = requests_mock.post(URL + '/message', status_code=200)
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 0
+        assert default.call_count == 1
+        assert default.last_request.headers['X-Gotify-Key'] == 'ops_token'
+
+    def test_missing_table(self, requests_mock, mock_helper, tmp_path):
+        self._set_params(mock_helper, tmp_path / 'missing.csv')
+
+        result = modalert_alert_gotify_helper.process_event(mock_helper)
+
+        assert result == 1
+        assert requests_mock.call_count == 0
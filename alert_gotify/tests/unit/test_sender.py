@@ -0,0 +1,189 @@
+# encoding = utf-8
+"""
+Unit tests for the pooled sender module.
+"""
+import gzip
+import json
+import os
+import sys
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import sender
+from alert_gotify.resilience import RetryPolicy
+from alert_gotify.templating import compile_template
+
+
+@pytest.mark.unit
+class TestBuilders:
+    """Test URL, header and payload construction."""
+
+    def test_message_url_strips_trailing_slash(self):
+        assert sender.build_message_url('https://gotify.example.com/') == 'https://gotify.example.com/message'
+        assert sender.build_message_url('https://gotify.example.com') == 'https://gotify.example.com/message'
+
+    def test_payload_without_title(self):
+        payload = sender.build_payload('Body', None, '7')
+        assert payload == {'message': 'Body', 'priority': 7}
+
+    def test_headers_are_cached_per_token(self):
+        assert sender.build_headers('tok') is sender.build_headers('tok')
+        assert sender.build_headers('other')['X-Gotify-Key'] == 'other'
+
+    def test_payload_body_is_invalidated_on_change(self):
+        payload = sender.build_payload('Body', 'Title', 5)
+        assert json.loads(payload.body) == {'message': 'Body', 'priority': 5, 'title': 'Title'}
+
+        payload['message'] = 'Changed'
+        assert json.loads(payload.body)['message'] == 'Changed'
+
+    @pytest.mark.parametrize("values", [
+        {'host': 'web01', 'msg': 'Disk "full"\n\u00e9\u2603 \\ </script>'},
+        {'host': '', 'msg': '\x00\x1f'},
+        {},
+    ])
+    def test_builder_body_matches_json_encoding(self, values):
+        builder = sender.PayloadBuilder(
+            compile_template('$result.msg$ on $result.host$'), compile_template('$result.host$'), '7'
+        )
+
+        payload = builder.build(values)
+
+        assert payload == sender.build_payload(
+            '{} on {}'.format(values.get('msg', ''), values.get('host', '')), values.get('host'), 7
+        )
+        assert payload.body == json.dumps(payload).encode('ascii')
+
+    def test_builder_reuses_static_body(self):
+        builder = sender.PayloadBuilder(compile_template('Disk full'), compile_template(''), 3)
+
+        first, second = builder.build({}), builder.build({})
+
+        assert first == {'message': 'Disk full', 'priority': 3}
+        assert first is not second
+        assert first.body is second.body
+
+    def test_markdown_builder_body_matches_json_encoding(self):
+        builder = sender.PayloadBuilder(compile_template('**$result.host$**'), compile_template('T'), 5,
+                                        markdown=True)
+
+        payload = builder.build({'host': 'web01'})
+
+        assert payload['extras'] == {'client::display': {'contentType': 'text/markdown'}}
+        assert payload.body == json.dumps(payload).encode('ascii')
+
+    def test_builder_truncates_long_messages(self):
+        builder = sender.PayloadBuilder(compile_template('$result.msg$'), compile_template(''), 5, max_bytes=200)
+
+        payload = builder.build({'msg': 'x' * 1000})
+
+        assert len(payload['message']) <= 200
+        assert 'bytes omitted' in payload['message']
+        assert payload.body == json.dumps(payload).encode('ascii')
+
+    def test_builder_rejects_invalid_priority(self):
+        with pytest.raises(ValueError):
+            sender.PayloadBuilder(compile_template('m'), compile_template(''), 'high')
+
+    def test_parse_workers(self):
+        assert sender.parse_workers(None) == sender.DEFAULT_WORKERS
+        assert sender.parse_workers('4') == 4
+        assert sender.parse_workers('0') == 1
+        assert sender.parse_workers('1000') == sender.MAX_WORKERS
+
+
+@pytest.mark.unit
+class TestGotifySender:
+    """Test concurrent delivery through the shared session."""
+
+    def test_send_many_success(self, requests_mock):
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        payloads = (sender.build_payload('Row {}'.format(i), None, 5) for i in range(50))
+        with sender.GotifySender('https://gotify.example.com', 'tok', workers=4) as s:
+            result = s.send_many(payloads)
+
+        assert result.sent == 50
+        assert result.failed == 0
+        assert requests_mock.call_count == 50
+        assert requests_mock.last_request.headers['X-Gotify-Key'] == 'tok'
+
+    def test_send_many_counts_failures(self, requests_mock):
+        requests_mock.post('https://gotify.example.com/message', [
+            {'status_code': 200},
+            {'status_code': 500, 'text': 'boom'},
+            {'exc': requests.exceptions.ConnectionError('refused')},
+        ])
+
+        payloads = [sender.build_payload('m', None, 5) for _ in range(3)]
+        with sender.GotifySender('https://gotify.example.com', 'tok', workers=1, retry=RetryPolicy(0)) as s:
+            result = s.send_many(payloads)
+
+        assert result.sent == 1
+        assert result.failed == 2
+        assert any('500' in e for e in result.errors)
+        assert any('refused' in e for e in result.errors)
+
+    def test_send_many_reports_bounded_errors(self, requests_mock):
+        requests_mock.post('https://gotify.example.com/message', status_code=500)
+
+        payloads = (sender.build_payload('m', None, 5) for _ in range(25))
+        with sender.GotifySender('https://gotify.example.com', 'tok', workers=2) as s:
+            result = s.send_many(payloads)
+
+        assert result.failed == 25
+        assert len(result.errors) == sender.MAX_REPORTED_ERRORS
+
+    def test_send_retries_transient_failures(self, requests_mock):
+        requests_mock.post('https://gotify.example.com/message', [
+            {'status_code': 503},
+            {'exc': requests.exceptions.ConnectTimeout('slow')},
+            {'status_code': 200},
+        ])
+
+        with sender.GotifySender('https://gotify.example.com', 'tok', workers=1) as s:
+            result = s.send_many([sender.build_payload('m', None, 5)])
+
+        assert result.sent == 1
+        assert requests_mock.call_count == 3
+
+    def test_send_uses_timeout(self, mocker):
+        with sender.GotifySender('https://gotify.example.com', 'tok', timeout=(1.0, 2.0)) as s:
+            post = mocker.patch.object(s.session, 'post', return_value=mocker.Mock(status_code=200))
+            s.send({'message': 'm'})
+
+        assert post.call_args[1]['timeout'] == (1.0, 2.0)
+
+    def test_ssl_verify_is_passed_per_request(self, mocker):
+        with sender.GotifySender('https://gotify.example.com', 'tok', ssl_verify=False) as s:
+            post = mocker.patch.object(s.session, 'post', return_value=mocker.Mock(status_code=200))
+            s.send({'message': 'm'})
+
+        assert post.call_args[1]['verify'] is False
+
+    def test_payload_is_posted_as_its_body(self, mocker):
+        payload = sender.build_payload('m', None, 5)
+        with sender.GotifySender('https://gotify.example.com', 'tok') as s:
+            post = mocker.patch.object(s.session, 'post', return_value=mocker.Mock(status_code=200))
+            s.send(payload)
+
+        assert post.call_args[1]['data'] == b'{"message": "m", "priority": 5}'
+        assert 'json' not in post.call_args[1]
+
+    def test_large_body_is_gzipped(self, mocker):
+        payload = sender.build_payload('m' * 5000, None, 5)
+        with sender.GotifySender('https://gotify.example.com', 'tok', compress=True) as s:
+            post = mocker.patch.object(s.session, 'post', return_value=mocker.Mock(status_code=200))
+            s.send(payload)
+
+        assert post.call_args[1]['headers'] == {'Content-Encoding': 'gzip'}
+        assert gzip.decompress(post.call_args[1]['data']) == payload.body
+
+    def test_small_body_is_not_gzipped(self, mocker):
+        with sender.GotifySender('https://gotify.example.com', 'tok', compress=True) as s:
+            post = mocker.patch.object(s.session, 'post', return_value=mocker.Mock(status_code=200))
+            s.send({'message': 'm', 'priority': 5})
+
+        assert post.call_args[1]['data'] == b'{"message": "m", "priority": 5}'
+        assert 'headers' not in post.call_args[1]
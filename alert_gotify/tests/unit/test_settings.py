@@ -0,0 +1,92 @@
+# encoding = utf-8
+"""
+Unit tests for global settings resolution and caching.
+"""
+import os
+import sys
+import pytest
+from unittest.mock import Mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import settings
+from alert_gotify.store import LocalStore
+
+GLOBALS = {'gotify_url': 'https://gotify.example.com', 'gotify_token': 'secret_token'}
+
+
+def _helper(ttl=None):
+    helper = Mock()
+    helper.get_param = Mock(side_effect=lambda key: {'settings_cache_ttl': ttl}.get(key))
+    helper.get_global_setting = Mock(side_effect=GLOBALS.get)
+    return helper
+
+
+@pytest.fixture
+def splunk_home(tmp_path, monkeypatch):
+    """Provide a splunk.secret for token encryption."""
+    home = tmp_path / "splunk"
+    (home / "etc" / "auth").mkdir(parents=True)
+    (home / "etc" / "auth" / "splunk.secret").write_text("not-a-real-secret")
+    monkeypatch.setenv("SPLUNK_HOME", str(home))
+    return home
+
+
+@pytest.mark.unit
+class TestProcessMemo:
+    """Test per-process resolution."""
+
+    def test_resolved_once_per_helper(self):
+        helper = _helper()
+        assert settings.get_global_setting(helper, 'gotify_url') == GLOBALS['gotify_url']
+        assert settings.get_global_setting(helper, 'gotify_url') == GLOBALS['gotify_url']
+        helper.get_global_setting.assert_called_once_with('gotify_url')
+
+    def test_cache_disabled_does_not_touch_store(self, state_dir):
+        settings.get_global_setting(_helper(), 'gotify_token')
+        assert not state_dir.exists()
+
+
+@pytest.mark.unit
+class TestDiskCache:
+    """Test the cross-process settings cache."""
+
+    def test_second_process_skips_splunkd(self, splunk_home):
+        pytest.importorskip("cryptography")
+        first = _helper(ttl='300')
+        assert settings.get_global_setting(first, 'gotify_url') == GLOBALS['gotify_url']
+
+        second = _helper(ttl='300')
+        assert settings.get_global_setting(second, 'gotify_url') == GLOBALS['gotify_url']
+        assert settings.get_global_setting(second, 'gotify_token') == GLOBALS['gotify_token']
+        second.get_global_setting.assert_not_called()
+
+    def test_token_is_stored_encrypted(self, splunk_home):
+        pytest.importorskip("cryptography")
+        settings.get_global_setting(_helper(ttl='300'), 'gotify_url')
+
+        with open(LocalStore().path, 'rb') as db:
+            assert b'secret_token' not in db.read()
+
+    def test_token_not_cached_without_secret(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("SPLUNK_HOME", str(tmp_path / "missing"))
+        settings.get_global_setting(_helper(ttl='300'), 'gotify_url')
+
+        second = _helper(ttl='300')
+        assert settings.get_global_setting(second, 'gotify_token') == GLOBALS['gotify_token']
+        second.get_global_setting.assert_called_once_with('gotify_token')
+
+    def test_config_change_invalidates_cache(self, splunk_home, monkeypatch):
+        pytest.importorskip("cryptography")
+        settings.get_global_setting(_helper(ttl='300'), 'gotify_url')
+
+        monkeypatch.setattr(settings, 'config_fingerprint', lambda: 'changed')
+        second = _helper(ttl='300')
+        settings.get_global_setting(second, 'gotify_url')
+        assert second.get_global_setting.call_count == 2
+
+    def test_fingerprint_tracks_conf_files(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, 'APP_DIR', str(tmp_path))
+        before = settings.config_fingerprint()
+        (tmp_path / "local").mkdir()
+        (tmp_path / "local" / "alert_gotify_settings.conf").write_text("[settings]\n")
+        assert settings.config_fingerprint() != before
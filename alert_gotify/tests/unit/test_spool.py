@@ -0,0 +1,115 @@
+# encoding = utf-8
+"""
+Unit tests for the delivery spool and local store.
+"""
+import os
+import sys
+import pytest
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import spool
+from alert_gotify.store import LocalStore
+
+URL = 'https://gotify.example.com'
+
+
+@pytest.fixture
+def store():
+    with LocalStore() as s:
+        yield s
+
+
+@pytest.mark.unit
+class TestLocalStore:
+    """Test spool persistence in the SQLite store."""
+
+    def test_store_created_in_state_dir(self, store, state_dir):
+        assert os.path.dirname(store.path) == str(state_dir)
+        assert oct(os.stat(store.path).st_mode & 0o777) == oct(0o600)
+
+    def test_claim_only_due_messages(self, store):
+        spool.defer(store, URL, 'tok', True, [({'message': 'a', 'priority': 5}, 'down')], now=1000)
+        assert store.spool_claim(1000, 10, 300) == []
+
+        items = store.spool_claim(1000 + spool.MAX_DELAY, 10, 300)
+        assert len(items) == 1
+        assert items[0].payload == {'message': 'a', 'priority': 5}
+        assert items[0].attempts == 1
+
+    def test_ssl_verify_setting_is_kept(self, store):
+        spool.defer(store, URL, 'tok', False, [({'message': 'a'}, 'down')], now=0)
+        spool.defer(store, URL, 'tok', '/etc/gotify/ca.pem', [({'message': 'b'}, 'down')], now=0)
+
+        items = store.spool_claim(10000, 10, 300)
+
+        assert sorted((item.payload['message'], item.ssl_verify) for item in items) == [
+            ('a', False), ('b', '/etc/gotify/ca.pem')
+        ]
+
+    def test_claimed_messages_are_leased(self, store):
+        spool.defer(store, URL, 'tok', True, [({'message': 'a'}, 'down')], now=0)
+        assert len(store.spool_claim(10000, 10, 300)) == 1
+        assert store.spool_claim(10000, 10, 300) == []
+        assert len(store.spool_claim(10301, 10, 300)) == 1
+
+
+@pytest.mark.unit
+class TestDrain:
+    """Test retrying spooled messages."""
+
+    def test_backoff_grows_and_is_capped(self):
+        assert spool.BASE_DELAY / 2.0 <= spool.backoff_delay(1) <= spool.BASE_DELAY
+        assert spool.backoff_delay(30) <= spool.MAX_DELAY
+
+    def test_drain_delivers_and_deletes(self, store, requests_mock):
+        requests_mock.post(URL + '/message', status_code=200)
+        failures = [({'message': str(i), 'priority': 5}, 'down') for i in range(3)]
+        spool.defer(store, URL, 'tok', True, failures, now=0)
+
+        result = spool.drain(store, now=10000)
+
+        assert result.sent == 3
+        assert store.spool_size() == 0
+        assert sorted(r.json()['message'] for r in requests_mock.request_history) == ['0', '1', '2']
+        assert requests_mock.last_request.headers['X-Gotify-Key'] == 'tok'
+
+    def test_drain_reschedules_retryable_failures(self, store, requests_mock):
+        requests_mock.post(URL + '/message', exc=requests.exceptions.ConnectionError('refused'))
+        spool.defer(store, URL, 'tok', True, [({'message': 'a'}, 'down')], now=0)
+
+        result = spool.drain(store, now=10000)
+
+        assert result.failed == 1
+        assert store.spool_size() == 1
+        [item] = store.spool_claim(10000 + spool.MAX_DELAY, 10, 300)
+        assert item.attempts == 2
+
+    def test_drain_drops_permanent_failures(self, store, requests_mock):
+        requests_mock.post(URL + '/message', status_code=401, text='unauthorized')
+        spool.defer(store, URL, 'tok', True, [({'message': 'a'}, 'down')], now=0)
+
+        result = spool.drain(store, now=10000)
+
+        assert result.dropped == 1
+        assert store.spool_size() == 0
+        assert '401' in result.errors[0]
+
+    def test_drain_claims_nothing_when_nothing_is_due(self, store, mocker):
+        spool.defer(store, URL, 'tok', True, [({'message': 'a'}, 'down')], now=10000)
+        claim = mocker.spy(store, 'spool_claim')
+
+        result = spool.drain(store, now=10000)
+
+        assert result.sent == result.failed == result.dropped == 0
+        claim.assert_not_called()
+        assert store.spool_due(10000 + spool.MAX_DELAY)
+
+    def test_drain_drops_expired_messages(self, store, requests_mock):
+        requests_mock.post(URL + '/message', status_code=503)
+        spool.defer(store, URL, 'tok', True, [({'message': 'a'}, 'down')], now=0)
+
+        result = spool.drain(store, now=spool.MAX_AGE + 1)
+
+        assert result.dropped == 1
+        assert store.spool_size() == 0
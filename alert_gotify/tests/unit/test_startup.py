@@ -0,0 +1,83 @@
+# encoding = utf-8
+"""
+Startup checks for the alert action entry point.
+
+Every alert firing starts a fresh Python process, so what it imports is
+checked in subprocesses. The import time budget is a benchmark, in
+tests/benchmark/test_startup.py.
+"""
+import os
+import subprocess
+import sys
+import pytest
+
+BIN_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+
+# Modules only needed by optional features, which must not load at startup
+LAZY_MODULES = ('alert_gotify.digest', 'alert_gotify.throttle', 'alert_gotify.daemon', 'alert_gotify.fanout',
+                'alert_gotify.adaptive')
+
+# splunktaucclib needs Splunk's Python modules, so the entry point runs against a
+# ModularAlertBase stand-in; only the add-on's own delivery code is checked.
+INVALID_ALERT_SCRIPT = """
+import importlib.util
+import sys
+import types
+
+import import_declare_test
+
+
+class ModularAlertBase(object):
+    def __init__(self, ta_name, alert_name):
+        pass
+
+
+alert_actions_base = types.ModuleType('splunktaucclib.alert_actions_base')
+alert_actions_base.ModularAlertBase = ModularAlertBase
+sys.modules['splunktaucclib'] = types.ModuleType('splunktaucclib')
+sys.modules['splunktaucclib.alert_actions_base'] = alert_actions_base
+
+spec = importlib.util.spec_from_file_location('alert_gotify_main', 'alert_gotify.py')
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+
+# Bypass __init__, which reads the alert payload from stdin and connects to splunkd
+worker = module.AlertActionWorkeralert_gotify.__new__(module.AlertActionWorkeralert_gotify)
+worker.get_param = lambda key: None
+worker.get_global_setting = lambda key: None
+worker.log_error = lambda message: None
+print(worker.process_event(), 'alert_gotify.modalert_alert_gotify_helper' in sys.modules)
+"""
+
+
+def import_times(module):
+    """Return {module: (self_us, cumulative_us)} from python -X importtime."""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        cwd=BIN_DIR, capture_output=True, text=True, check=True
+    ).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if self_us.strip().isdigit():
+            times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+@pytest.mark.unit
+class TestStartup:
+    """Test what the alert action imports."""
+
+    def test_invalid_alert_exits_before_delivery_code(self):
+        output = subprocess.run(
+            [sys.executable, "-c", INVALID_ALERT_SCRIPT],
+            cwd=BIN_DIR, capture_output=True, text=True, check=True
+        ).stdout.split()
+        assert output == ['3', 'False']
+
+    def test_optional_features_are_lazy(self):
+        times = import_times("alert_gotify.modalert_alert_gotify_helper")
+        for module in LAZY_MODULES:
+            assert module not in times
@@ -0,0 +1,180 @@
+# encoding = utf-8
+"""
+Unit tests for stream-based delivery latency measurement.
+"""
+import base64
+import hashlib
+import itertools
+import json
+import os
+import struct
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import modalert_alert_gotify_helper, stream
+from alert_gotify.sender import GotifySender, build_payload
+
+CLIENT_TOKEN = 'client-token'
+
+
+def _frame(opcode, payload, fin=True):
+    header = bytes([(0x80 if fin else 0) | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    else:
+        header += struct.pack('!BH', 126, len(payload))
+    return header + payload
+
+
+class StreamingGotifyHandler(BaseHTTPRequestHandler):
+    """Accept messages and push them to WebSocket subscribers of /stream."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path != '/stream' or self.headers.get('X-Gotify-Key') != CLIENT_TOKEN:
+            self.send_response(401)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        key = self.headers['Sec-WebSocket-Key'] + stream.WEBSOCKET_GUID
+        self.send_response(101)
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', base64.b64encode(hashlib.sha1(key.encode()).digest()).decode())
+        self.end_headers()
+        self.wfile.flush()
+        # Keepalive ping, which the client must answer with a masked pong
+        self.connection.sendall(_frame(stream.OP_PING, b'hi'))
+        with self.server.lock:
+            self.server.subscribers.append(self.connection)
+        while True:
+            header = self.rfile.read(2)
+            if len(header) < 2:
+                break
+            length = header[1] & 0x7F
+            mask = self.rfile.read(4)
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self.rfile.read(length)))
+            self.server.client_frames.append((header[0] & 0x0F, bool(header[1] & 0x80), payload))
+            if header[0] & 0x0F == stream.OP_CLOSE:
+                break
+        self.close_connection = True
+
+    def do_POST(self):
+        document = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        document['id'] = next(self.server.ids)
+        body = json.dumps(document).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+        if self.server.deliver:
+            with self.server.lock:
+                for subscriber in self.server.subscribers:
+                    # Split in two fragments to exercise reassembly
+                    subscriber.sendall(_frame(stream.OP_TEXT, body[:5], fin=False) +
+                                       _frame(stream.OP_CONTINUATION, body[5:]))
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def gotify():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StreamingGotifyHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.subscribers = []
+    server.client_frames = []
+    server.ids = itertools.count(1)
+    server.deliver = True
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.unit
+class TestStreamWatcher:
+    """Test the WebSocket subscription and latency tracking."""
+
+    def test_percentile(self):
+        assert stream.percentile([], 50) is None
+        assert stream.percentile([3, 1, 2], 50) == 2
+        assert stream.percentile([3, 1, 2], 100) == 3
+
+    def test_messages_are_seen_on_stream(self, gotify):
+        watcher = stream.StreamWatcher(gotify.url, CLIENT_TOKEN).open()
+        try:
+            with GotifySender(gotify.url, 'app', workers=2, stream=watcher) as sender:
+                assert sender.send_many(build_payload('m{}'.format(i), None, 5) for i in range(3)).sent == 3
+            watcher.wait(5)
+        finally:
+            watcher.close()
+
+        assert len(watcher.latencies()) == 3
+        assert (stream.OP_PONG, True, b'hi') in gotify.client_frames
+
+    def test_missing_messages_time_out(self, gotify):
+        gotify.deliver = False
+        watcher = stream.StreamWatcher(gotify.url, CLIENT_TOKEN).open()
+        try:
+            with GotifySender(gotify.url, 'app', workers=1, stream=watcher) as sender:
+                sender.send_many([build_payload('m', None, 5)])
+            watcher.wait(0.2)
+        finally:
+            watcher.close()
+
+        assert len(watcher.sent_at) == 1
+        assert watcher.latencies() == []
+
+    def test_invalid_client_token_is_refused(self, gotify):
+        with pytest.raises(stream.StreamError, match='401'):
+            stream.StreamWatcher(gotify.url, 'wrong').open()
+
+
+@pytest.mark.unit
+class TestAlertLatency:
+    """Test latency reporting from the alert action."""
+
+    def _helper(self, mock_helper, url, **params):
+        values = {'url': url, 'token': 'app', 'message': 'Disk full', 'priority': '5',
+                  'stream_token': CLIENT_TOKEN, 'stream_sample': '1'}
+        values.update(params)
+        mock_helper.get_param = Mock(side_effect=values.get)
+        mock_helper.get_events = Mock(return_value=iter([{'n': '1'}, {'n': '2'}]))
+        return mock_helper
+
+    def _logged(self, helper):
+        return [call.args[0] for call in helper.log_info.call_args_list]
+
+    @pytest.mark.parametrize("mode, expected", [('single', 1), ('per_result', 2)])
+    def test_latency_is_logged(self, gotify, mock_helper, mode, expected):
+        helper = self._helper(mock_helper, gotify.url, mode=mode)
+
+        assert modalert_alert_gotify_helper.process_event(helper) == 0
+
+        latency = [line for line in self._logged(helper) if line.startswith('Stream delivery latency')]
+        assert latency and latency[0].startswith(
+            'Stream delivery latency: {0} of {0} message(s) seen'.format(expected))
+
+    def test_unsampled_run_does_not_subscribe(self, gotify, mock_helper):
+        helper = self._helper(mock_helper, gotify.url, stream_sample='0')
+
+        assert modalert_alert_gotify_helper.process_event(helper) == 0
+
+        assert gotify.subscribers == []
+
+    def test_stream_failure_does_not_fail_alert(self, gotify, mock_helper):
+        helper = self._helper(mock_helper, gotify.url, stream_token='wrong')
+
+        assert modalert_alert_gotify_helper.process_event(helper) == 0
+
+        helper.log_error.assert_called()
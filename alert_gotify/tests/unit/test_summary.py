@@ -0,0 +1,132 @@
+# encoding = utf-8
+"""
+Unit tests for heavy-hitter summaries.
+"""
+import gzip
+import os
+import random
+import sys
+import pytest
+from unittest.mock import Mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import modalert_alert_gotify_helper, summary
+
+
+@pytest.mark.unit
+class TestSpaceSaving:
+    """Test the Space-Saving top values."""
+
+    def test_exact_below_capacity(self):
+        counts = summary.SpaceSaving(10)
+        for value in 'aaabbc':
+            counts.add(value)
+
+        assert counts.top(2) == [('a', 3, 0), ('b', 2, 0)]
+        assert not counts.evicted
+
+    def test_heavy_hitters_survive_eviction(self):
+        counts = summary.SpaceSaving(20)
+        values = ['hot'] * 3000 + ['warm'] * 1000 + ['cold{}'.format(i) for i in range(5000)]
+        random.Random(1).shuffle(values)
+        for value in values:
+            counts.add(value)
+
+        top = counts.top(2)
+        assert [value for value, _, _ in top] == ['hot', 'warm']
+        for value, count, error in top:
+            assert count - error <= values.count(value) <= count
+        assert len(counts.counters) == 20
+        assert sum(len(bucket) for bucket in counts.buckets.values()) == 20
+        assert counts.minimum == min(count for count, _ in counts.counters.values())
+
+
+@pytest.mark.unit
+class TestHyperLogLog:
+    """Test the distinct value estimate."""
+
+    @pytest.mark.parametrize('distinct', [10, 1000, 100000])
+    def test_estimate_is_close(self, distinct):
+        sketch = summary.HyperLogLog()
+        for i in range(distinct):
+            sketch.add('value{}'.format(i))
+            sketch.add('value{}'.format(i))
+
+        assert abs(sketch.estimate() - distinct) <= max(1, distinct * 0.05)
+
+
+@pytest.mark.unit
+class TestSummary:
+    """Test summarizing results into a message."""
+
+    def test_render(self):
+        results = [{'host': 'web01', 'status': '500'}, {'host': 'web01', 'status': '503'},
+                   {'host': 'web02', 'status': '500'}, {'host': ''}]
+        s = summary.Summary(('host', 'status'), top=1)
+
+        assert summary.summarize(results, s) == results[0]
+        assert s.render('Errors') == (
+            'Errors\n\n4 result(s)\n\n'
+            'Top host (2 distinct in 3 result(s)):\n- web01: 2\n\n'
+            'Top status (2 distinct in 3 result(s)):\n- 500: 2'
+        )
+
+    def test_estimates_after_eviction(self):
+        s = summary.Summary(('user',), top=1)
+        summary.summarize(({'user': 'u{}'.format(i % 500)} for i in range(2000)), s)
+
+        message = s.render(markdown=True)
+        assert '**Top user (about ' in message
+        assert len(s.fields[0].counts.counters) == summary.CAPACITY_FACTOR
+
+    def test_parse_fields(self):
+        assert summary.parse_fields(' host, status,host ') == ('host', 'status')
+        with pytest.raises(ValueError):
+            summary.parse_fields(' , ')
+
+
+@pytest.mark.unit
+class TestSummaryMode:
+    """Test summary mode in process_event."""
+
+    def _write_results(self, tmp_path, rows):
+        path = str(tmp_path / 'results.csv.gz')
+        with gzip.open(path, 'wt', newline='') as f:
+            f.write('host,status,_raw\n')
+            for host, status in rows:
+                f.write('{},{},raw event\n'.format(host, status))
+        return path
+
+    def test_sends_one_message(self, requests_mock, mock_helper, tmp_path):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Errors on $result.host$', 'title': 'HTTP errors', 'priority': '5', 'mode': 'summary',
+            'summary_fields': 'host,status', 'summary_top': '2',
+        }.get(key))
+        rows = [('web{}'.format(i % 3), '500' if i % 4 else '503') for i in range(1000)]
+        mock_helper.results_file = self._write_results(tmp_path, rows)
+        requests_mock.post('https://gotify.example.com/message', status_code=200)
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+
+        assert requests_mock.call_count == 1
+        payload = requests_mock.last_request.json()
+        assert payload['title'] == 'HTTP errors'
+        assert payload['message'].startswith('Errors on web0\n\n1000 result(s)\n\nTop host (3 distinct')
+        assert '- 500: 750\n- 503: 250' in payload['message']
+
+    def test_no_results(self, requests_mock, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5', 'mode': 'summary', 'summary_fields': 'host',
+        }.get(key))
+        mock_helper.get_events = Mock(return_value=iter([]))
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 0
+        assert requests_mock.call_count == 0
+
+    def test_missing_fields(self, mock_helper):
+        mock_helper.get_param = Mock(side_effect=lambda key: {
+            'message': 'Test', 'priority': '5', 'mode': 'summary',
+        }.get(key))
+
+        assert modalert_alert_gotify_helper.process_event(mock_helper) == 1
+        mock_helper.log_error.assert_any_call("Invalid summary parameter: summary_fields names no fields")
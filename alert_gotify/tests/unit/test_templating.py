@@ -0,0 +1,55 @@
+# encoding = utf-8
+"""
+Unit tests for the templating module.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import templating
+
+
+@pytest.mark.unit
+class TestTemplate:
+    """Test template compilation and rendering."""
+
+    def test_static_template(self):
+        template = templating.Template('Disk full')
+        assert template.is_static
+        assert template.fields == ()
+        assert template.render({'host': 'a'}) == 'Disk full'
+
+    def test_none_source_renders_empty(self):
+        template = templating.Template(None)
+        assert template.is_static
+        assert template.render({}) == ''
+
+    def test_render_fields(self):
+        template = templating.Template('$result.host$ is at $result.pct$% on $result.host$')
+        assert template.fields == ('host', 'pct', 'host')
+        assert template.render({'host': 'web01', 'pct': '97'}) == 'web01 is at 97% on web01'
+
+    def test_leading_and_trailing_tokens(self):
+        template = templating.Template('$result.a$-$result.b$')
+        assert template.render({'a': '1', 'b': '2'}) == '1-2'
+
+    def test_missing_and_non_string_values(self):
+        template = templating.Template('[$result.a$][$result.b$][$result.c$]')
+        assert template.render({'a': None, 'b': 3}) == '[][3][]'
+
+    def test_dotted_field_names(self):
+        template = templating.Template('$result.data.user$ logged in')
+        assert template.render({'data.user': 'alice'}) == 'alice logged in'
+
+    def test_plain_dollar_signs_are_literal(self):
+        template = templating.Template('Cost $5 for $result.item$')
+        assert template.render({'item': 'tea'}) == 'Cost $5 for tea'
+
+    def test_render_is_reentrant(self):
+        template = templating.Template('<$result.x$>')
+        rendered = [template.render({'x': str(i)}) for i in range(3)]
+        assert rendered == ['<0>', '<1>', '<2>']
+
+    def test_compile_template_is_cached(self):
+        assert templating.compile_template('$result.x$') is templating.compile_template('$result.x$')
@@ -0,0 +1,87 @@
+# encoding = utf-8
+"""
+Unit tests for cross-process deduplication and rate limiting.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import throttle
+from alert_gotify.store import LocalStore
+
+URL = 'https://gotify.example.com'
+
+
+@pytest.fixture
+def store():
+    with LocalStore() as s:
+        yield s
+
+
+@pytest.mark.unit
+class TestDedup:
+    """Test the deduplication window."""
+
+    def test_key_covers_title_message_priority(self):
+        base = {'message': 'm', 'title': 't', 'priority': 5}
+        key = throttle.dedup_key(URL, base)
+        assert key == throttle.dedup_key(URL, dict(base))
+        assert key != throttle.dedup_key(URL, dict(base, priority=6))
+        assert key != throttle.dedup_key(URL, dict(base, title='x'))
+        assert key != throttle.dedup_key('https://other', base)
+
+    def test_fixed_window(self, store):
+        assert not throttle.is_duplicate(store, 'k', 60, now=1000)
+        assert throttle.is_duplicate(store, 'k', 60, now=1030)
+        # Repeats inside the window do not extend it
+        assert throttle.is_duplicate(store, 'k', 60, now=1059)
+        assert not throttle.is_duplicate(store, 'k', 60, now=1061)
+
+    def test_shared_between_connections(self):
+        with LocalStore() as first:
+            assert not throttle.is_duplicate(first, 'k', 60, now=1000)
+        with LocalStore() as second:
+            assert throttle.is_duplicate(second, 'k', 60, now=1001)
+
+
+@pytest.mark.unit
+class TestTokenBucket:
+    """Test the per-token rate limiter."""
+
+    def test_burst_then_refill(self, store):
+        granted = [throttle.take_token(store, 'tok', 60, 3, now=1000) for _ in range(5)]
+        assert granted == [True, True, True, False, False]
+        # 60 per minute refills one token per second
+        assert throttle.take_token(store, 'tok', 60, 3, now=1001)
+        assert not throttle.take_token(store, 'tok', 60, 3, now=1001)
+
+    def test_buckets_are_per_token(self, store):
+        assert throttle.take_token(store, 'a', 1, 1, now=1000)
+        assert not throttle.take_token(store, 'a', 1, 1, now=1000)
+        assert throttle.take_token(store, 'b', 1, 1, now=1000)
+
+    def test_token_is_not_stored(self, store):
+        key = throttle.token_key(URL, 'secret-token')
+        assert 'secret-token' not in key
+
+
+@pytest.mark.unit
+class TestThrottle:
+    """Test combined admission control."""
+
+    def test_admit(self, store):
+        t = throttle.Throttle(store, URL, 'tok', dedup_window=60, rate_limit=60, burst=2)
+        assert t.admit({'message': 'a', 'priority': 5}, now=1000) is None
+        assert t.admit({'message': 'a', 'priority': 5}, now=1000) == throttle.DUPLICATE
+        assert t.admit({'message': 'b', 'priority': 5}, now=1000) is None
+        assert t.admit({'message': 'c', 'priority': 5}, now=1000) == throttle.RATE_LIMITED
+        assert (t.duplicates, t.rate_limited) == (1, 1)
+
+    def test_rate_limited_message_is_not_recorded_as_sent(self, store):
+        t = throttle.Throttle(store, URL, 'tok', dedup_window=300, rate_limit=1, burst=1)
+        assert t.admit({'message': 'a', 'priority': 5}, now=1000) is None
+        assert t.admit({'message': 'm', 'priority': 5}, now=1001) == throttle.RATE_LIMITED
+        # The bucket has refilled and m was never sent
+        assert t.admit({'message': 'm', 'priority': 5}, now=1200) is None
+        assert t.admit({'message': 'm', 'priority': 5}, now=1201) == throttle.DUPLICATE
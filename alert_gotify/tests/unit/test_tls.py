@@ -0,0 +1,94 @@
+# encoding = utf-8
+"""
+Unit tests for the shared TLS contexts and session resumption.
+"""
+import os
+import ssl
+import sys
+from unittest.mock import Mock
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify import tls
+from alert_gotify.metrics import Metrics
+from alert_gotify.sender import GotifySender, build_payload
+
+
+@pytest.fixture
+def tls_server(fake_gotify):
+    return fake_gotify(tls=True)
+
+
+def _url(server):
+    # The certificate is issued for localhost
+    return server.url.replace('127.0.0.1', 'localhost')
+
+
+@pytest.mark.unit
+class TestResolveVerify:
+    """Test combining ssl_verify with a CA path."""
+
+    def test_flag_without_ca_path(self):
+        assert tls.resolve_verify(True) is True
+        assert tls.resolve_verify(False, '/does/not/matter') is False
+
+    def test_ca_path(self, tmp_path):
+        bundle = tmp_path / 'ca.pem'
+        bundle.write_text('')
+
+        assert tls.resolve_verify(True, str(bundle)) == str(bundle)
+        with pytest.raises(ValueError):
+            tls.resolve_verify(True, str(tmp_path / 'missing.pem'))
+
+
+@pytest.mark.unit
+class TestSharedContext:
+    """Test the process-wide contexts and the adapter using them."""
+
+    def test_context_is_shared_per_verify_value(self, tls_server):
+        assert tls.ssl_context(True) is tls.ssl_context(True)
+        assert tls.ssl_context(False).verify_mode == ssl.CERT_NONE
+        assert tls.ssl_context(tls_server.cert_path) is not tls.ssl_context(True)
+
+    def test_ca_bundle_is_not_loaded_per_connection(self, tls_server):
+        adapter = tls.TLSAdapter()
+        request = Mock(url='https://localhost:8443/message')
+
+        _, pool_kwargs = adapter.build_connection_pool_key_attributes(request, tls_server.cert_path)
+
+        assert 'ca_certs' not in pool_kwargs
+        assert pool_kwargs['ssl_context'] is tls.ssl_context(tls_server.cert_path)
+
+    def test_custom_ca_is_trusted(self, tls_server):
+        with GotifySender(_url(tls_server), 'tok', ssl_verify=tls_server.cert_path, workers=1) as sender:
+            assert sender.send_many([build_payload('m', None, 5)]).sent == 1
+
+    def test_default_bundle_rejects_unknown_ca(self, tls_server):
+        with GotifySender(_url(tls_server), 'tok', ssl_verify=True, workers=1) as sender:
+            result = sender.send_many([build_payload('m', None, 5)])
+
+        assert result.failed == 1
+        assert 'CERTIFICATE_VERIFY_FAILED' in result.errors[0]
+
+
+@pytest.mark.unit
+class TestSessionResumption:
+    """Test that later connections resume the last TLS session."""
+
+    def test_new_sender_resumes_session(self, tls_server):
+        for _ in range(3):
+            with GotifySender(_url(tls_server), 'tok', ssl_verify=tls_server.cert_path, workers=1) as sender:
+                assert sender.send_many([build_payload('m', None, 5)]).sent == 1
+
+        assert tls_server.handshakes == 3
+        assert tls_server.resumed == 2
+
+    def test_resumptions_are_counted(self, tls_server):
+        metrics = Metrics().activate()
+        for _ in range(2):
+            with GotifySender(_url(tls_server), 'tok', ssl_verify=tls_server.cert_path, workers=1,
+                              metrics=metrics) as sender:
+                sender.send_many([build_payload('m', None, 5)])
+
+        assert metrics.counters['connections'] == 2
+        assert metrics.counters['tls_resumed'] >= 1
@@ -0,0 +1,83 @@
+# encoding = utf-8
+"""
+Unit tests for message truncation.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "package", "bin"))
+from alert_gotify.truncation import truncate_message
+
+
+def size(text):
+    return len(text.encode("utf-8"))
+
+
+@pytest.mark.unit
+class TestTruncateMessage:
+    """Test head and tail truncation to a byte budget."""
+
+    def test_short_message_is_unchanged(self):
+        assert truncate_message("short", 100) == "short"
+        assert truncate_message("x" * 1000, 0) == "x" * 1000
+        assert truncate_message(None, 100) is None
+
+    def test_keeps_head_and_tail(self):
+        text = "BEGIN" + "x" * 5000 + "END"
+
+        truncated = truncate_message(text, 500)
+
+        assert size(truncated) <= 500
+        assert truncated.startswith("BEGIN")
+        assert truncated.endswith("END")
+        assert "bytes omitted" in truncated
+
+    def test_marker_counts_omitted_bytes(self):
+        text = "a" * 3000
+
+        truncated = truncate_message(text, 300)
+        head, _, rest = truncated.partition("\n\n[... ")
+        omitted, _, tail = rest.partition(" bytes omitted ...]\n\n")
+
+        assert len(head) + int(omitted) + len(tail) == 3000
+
+    def test_cuts_at_line_boundaries(self):
+        text = "\n".join("line {:04d} of the results".format(i) for i in range(500))
+
+        truncated = truncate_message(text, 1000)
+        head, _, rest = truncated.partition("\n\n[... ")
+        tail = rest.partition("...]\n\n")[2]
+
+        assert all(line.startswith("line ") and line.endswith("results") for line in head.split("\n"))
+        assert all(line.startswith("line ") and line.endswith("results") for line in tail.split("\n"))
+
+    def test_multibyte_characters_are_not_split(self):
+        text = "☃" * 2000
+
+        truncated = truncate_message(text, 301)
+
+        assert size(truncated) <= 301
+        assert truncated.startswith("☃")
+        assert truncated.endswith("☃")
+
+    def test_tiny_budget_cuts_hard(self):
+        assert truncate_message("x" * 100, 10) == "x" * 10
+
+    def test_markdown_fences_stay_balanced(self):
+        text = "Summary\n```\n" + "\n".join("row {}".format(i) for i in range(1000)) + "\n```\nDone"
+
+        truncated = truncate_message(text, 400, markdown=True)
+        head, _, rest = truncated.partition("\n\n[... ")
+        tail = rest.partition("...]\n\n")[2]
+
+        assert size(truncated) <= 400
+        assert head.startswith("Summary\n```\n")
+        assert head.endswith("\n```")
+        assert tail.startswith("```\n")
+        assert tail.endswith("\n```\nDone")
+
+    def test_markdown_without_fences_is_unchanged(self):
+        text = "**bold** " * 500
+
+        assert "```" not in truncate_message(text, 300, markdown=True)